@@ -0,0 +1,349 @@
+# backend/benchmarks/bench_predict.py
+"""
+Offline benchmark suite for the predict service.
+
+    python benchmarks/bench_predict.py [--model model.h5] [--json results.json]
+    python benchmarks/bench_predict.py --json new.json --compare old.json
+
+Needs no network and no real model: it builds a tiny stand-in Keras model
+with the service's input contract (224x224x3 -> 5 softmax classes) unless
+--model is given, and scores the sample images in uploads/ plus synthetic
+fundus-like JPEGs at typical camera resolutions. Reports, as p50/p95/p99:
+
+  stages   decode, crop/resize, quality gate, CLAHE, normalize and model predict per image
+  predict  model latency and images/sec per batch size
+  compiled Keras model.predict vs the "compiled" backend's traced fixed-shape
+           functions (and XLA with --xla) per batch size, on the same .h5
+  service  end-to-end /upload latency and requests/sec per concurrency level
+           (in-process ASGI, so micro-batching and executors are included)
+
+--json writes everything in machine-readable form (plus git commit and
+library versions) so runs can be compared across commits with --compare.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from bench_preprocess import load_samples, synthetic_fundus_jpeg  # noqa: E402
+from predict_backends import bucket_sizes, load_backend  # noqa: E402
+from predict_preprocess import (  # noqa: E402
+    PreprocessOptions, apply_clahe_to_rgb, crop_resize, decode, load_rgb, normalize_batch, normalize_into,
+)
+from predict_quality import QualityThresholds, assess  # noqa: E402
+
+RESOLUTIONS = [(1024, 1024), (2048, 1536), (3000, 2000), (4288, 2848)]
+
+
+# Inputs
+def build_stand_in_model(path, input_shape=(224, 224, 3), classes=5):
+    """A small conv net with the production model's input/output contract."""
+    import tensorflow as tf
+
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input(shape=input_shape),
+        tf.keras.layers.Conv2D(16, 3, strides=2, activation="relu"),
+        tf.keras.layers.Conv2D(32, 3, strides=2, activation="relu"),
+        tf.keras.layers.Conv2D(64, 3, strides=2, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(classes, activation="softmax"),
+    ])
+    model.save(path)
+    return path
+
+
+def bench_images():
+    images = list(load_samples())
+    images = [(name, data) for name, data in images if not name.startswith("synthetic")]
+    for w, h in RESOLUTIONS:
+        images.append((f"synthetic_{w}x{h}.jpg", synthetic_fundus_jpeg(w, h)))
+    return images
+
+
+# Stats
+def summarize(samples_ms):
+    arr = np.asarray(samples_ms, dtype=np.float64)
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+    return {
+        "n": int(arr.size),
+        "mean_ms": round(float(arr.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+    }
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return out, (time.perf_counter() - t0) * 1000.0
+
+
+# Benchmarks
+def bench_stages(backend, images, repeat):
+    target = tuple(backend.input_shape[:2])
+    out = np.empty((1,) + tuple(backend.input_shape), dtype=np.float32)
+    thresholds = QualityThresholds()
+    results = {}
+    for name, data in images:
+        stages = {"decode": [], "crop_resize": [], "quality": [], "clahe": [], "normalize": [], "predict": []}
+        for i in range(repeat + 1):
+            img, t_decode = timed(decode, data, target)
+            rgb, t_resize = timed(crop_resize, img, target)
+            _, t_quality = timed(assess, img, rgb, thresholds)
+            _, t_clahe = timed(apply_clahe_to_rgb, rgb)
+            _, t_norm = timed(normalize_into, rgb, out[0])
+            _, t_pred = timed(backend.predict, out)
+            if i == 0:
+                continue  # first pass warms lazy imports and caches
+            for key, ms in zip(stages, (t_decode, t_resize, t_quality, t_clahe, t_norm, t_pred)):
+                stages[key].append(ms)
+        results[name] = {key: summarize(ms) for key, ms in stages.items()}
+        print(f"  {name:<28}" + "".join(f"{k}={v['p50_ms']:.2f} " for k, v in results[name].items()))
+    return results
+
+
+def bench_predict(backend, batch_sizes, repeat):
+    rng = np.random.default_rng(0)
+    results = {}
+    for size in batch_sizes:
+        batch = rng.random((size,) + tuple(backend.input_shape), dtype=np.float32)
+        backend.predict(batch)  # warm-up / tracing for this batch size
+        runs = [timed(backend.predict, batch)[1] for _ in range(repeat)]
+        stats = summarize(runs)
+        stats["images_per_sec"] = round(size * 1000.0 / stats["mean_ms"], 2)
+        results[str(size)] = stats
+        print(f"  batch {size:<4} p50={stats['p50_ms']:.2f}ms  {stats['images_per_sec']:.1f} img/s")
+    return results
+
+
+def bench_compiled(model_path, batch_sizes, repeat, xla=False):
+    """Keras model.predict against the compiled backend on the same model and inputs."""
+    variants = {
+        "predict": load_backend("keras", model_path),
+        "compiled": load_backend("compiled", model_path, batch_buckets=bucket_sizes(max(batch_sizes))),
+    }
+    if xla:
+        variants["compiled_xla"] = load_backend("compiled", model_path, batch_buckets=bucket_sizes(max(batch_sizes)),
+                                                jit_compile=True)
+    shape = tuple(variants["predict"].input_shape)
+    rng = np.random.default_rng(0)
+    results = {}
+    for size in batch_sizes:
+        batch = rng.random((size,) + shape, dtype=np.float32)
+        row, outputs = {}, {}
+        for name, backend in variants.items():
+            outputs[name] = backend.predict(batch)  # warm-up / tracing for this batch size
+            row[name] = summarize([timed(backend.predict, batch)[1] for _ in range(repeat)])
+        # same math, so outputs should agree to float32 rounding
+        row["max_abs_diff"] = max(float(np.max(np.abs(outputs[name] - outputs["predict"])))
+                                  for name in outputs if name != "predict")
+        row["speedup_p50"] = round(row["predict"]["p50_ms"] / row["compiled"]["p50_ms"], 2)
+        results[str(size)] = row
+        print(f"  batch {size:<4}" + "".join(f"{name}={row[name]['p50_ms']:.2f}ms  " for name in variants)
+              + f"speedup x{row['speedup_p50']}")
+    return results
+
+
+def bench_preprocess_throughput(images, target, concurrency_levels, requests):
+    """Decode + resize + normalize throughput of the thread pool alone (no model)."""
+    options = PreprocessOptions(target_size=target)
+    payloads = [data for _, data in images]
+    results = {}
+    for level in concurrency_levels:
+        def work(i):
+            _, ms = timed(lambda: normalize_batch([load_rgb(payloads[i % len(payloads)], options)]))
+            return ms
+        with ThreadPoolExecutor(max_workers=level) as pool:
+            list(pool.map(work, range(level)))
+            t0 = time.perf_counter()
+            runs = list(pool.map(work, range(requests)))
+            wall = time.perf_counter() - t0
+        stats = summarize(runs)
+        stats["images_per_sec"] = round(requests / wall, 2)
+        results[str(level)] = stats
+        print(f"  concurrency {level:<3} p50={stats['p50_ms']:.2f}ms  {stats['images_per_sec']:.1f} img/s")
+    return results
+
+
+async def _bench_service_async(ps, images, concurrency_levels, requests):
+    import httpx
+
+    await ps.startup_event()
+    await ps.ensure_model()
+    results = {}
+    try:
+        transport = httpx.ASGITransport(app=ps.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def one(i):
+                name, data = images[i % len(images)]
+                t0 = time.perf_counter()
+                r = await client.post("/upload", files={"file": (name, data, "application/octet-stream")})
+                r.raise_for_status()
+                return (time.perf_counter() - t0) * 1000.0
+
+            for level in concurrency_levels:
+                sem = asyncio.Semaphore(level)
+
+                async def limited(i):
+                    async with sem:
+                        return await one(i)
+
+                await asyncio.gather(*(limited(i) for i in range(level)))
+                t0 = time.perf_counter()
+                runs = await asyncio.gather(*(limited(i) for i in range(requests)))
+                wall = time.perf_counter() - t0
+                stats = summarize(runs)
+                stats["requests_per_sec"] = round(requests / wall, 2)
+                results[str(level)] = stats
+                print(f"  concurrency {level:<3} p50={stats['p50_ms']:.2f}ms  p99={stats['p99_ms']:.2f}ms  "
+                      f"{stats['requests_per_sec']:.1f} req/s")
+    finally:
+        await ps.shutdown_event()
+    return results
+
+
+def bench_service(model_path, backend_kind, images, concurrency_levels, requests):
+    # the service reads its config at import time; keep caching/persistence out of the numbers
+    os.environ.update({
+        "ICARE_MODEL_PATH": model_path,
+        "ICARE_MODEL_BACKEND": backend_kind,
+        "ICARE_CACHE": "false",
+        "ICARE_UPLOAD_STORE": "false",
+        # requests cycle through a handful of images, so concurrent ones would mostly be coalesced
+        "ICARE_COALESCE": "false",
+        # the synthetic images are smooth enough to fail the blur check; measure the full pipeline
+        "ICARE_QUALITY_GATE": "false",
+    })
+    cwd = os.getcwd()
+    os.chdir(BACKEND_DIR)
+    try:
+        import predict_service as ps
+        return asyncio.run(_bench_service_async(ps, images, concurrency_levels, requests))
+    finally:
+        os.chdir(cwd)
+
+
+# Reporting
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    info = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+    }
+    try:
+        import tensorflow as tf
+        info["tensorflow"] = tf.__version__
+    except ImportError:
+        pass
+    return info
+
+
+def _flatten(tree, prefix=""):
+    for key, value in tree.items():
+        path = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from _flatten(value, path)
+        elif key in ("p50_ms", "p95_ms", "p99_ms", "images_per_sec", "requests_per_sec"):
+            yield path, value
+
+
+def compare(current, baseline_path, threshold):
+    """Print metrics that moved by more than `threshold` (fraction) against a previous --json run."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    old = dict(_flatten(baseline["results"]))
+    print(f"\nvs {baseline_path} (commit {baseline.get('environment', {}).get('commit')}):")
+    regressions = 0
+    for path, value in _flatten(current):
+        before = old.get(path)
+        if not before:
+            continue
+        change = (value - before) / before
+        # latency going up or throughput going down is a regression
+        worse = change > threshold if path.endswith("_ms") else change < -threshold
+        if abs(change) > threshold:
+            print(f"  {'REGRESSION' if worse else 'improved  '} {path}: {before} -> {value} ({change:+.1%})")
+            regressions += worse
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="model to benchmark (default: a generated stand-in .h5)")
+    parser.add_argument("--backend", default="keras", choices=["keras", "compiled", "tflite"])
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per stage / batch size")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=64, help="requests per concurrency level")
+    parser.add_argument("--skip", nargs="*", default=[],
+                        choices=["stages", "predict", "compiled", "preprocess", "service"])
+    parser.add_argument("--xla", action="store_true", help="also benchmark the compiled backend with XLA")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="previous --json output to diff against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change reported by --compare")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model or build_stand_in_model(os.path.join(tmp, "stand_in.h5"))
+        backend = load_backend(args.backend, model_path)
+        images = bench_images()
+        target = tuple(backend.input_shape[:2])
+        results = {}
+
+        if "stages" not in args.skip:
+            print("Per-stage latency (p50 ms):")
+            results["stages"] = bench_stages(backend, images, args.repeat)
+        if "predict" not in args.skip:
+            print("Model predict by batch size:")
+            results["predict"] = bench_predict(backend, args.batch_sizes, args.repeat)
+        if "compiled" not in args.skip and not model_path.endswith(".tflite"):
+            print("model.predict vs compiled (p50 ms):")
+            results["compiled"] = bench_compiled(model_path, args.batch_sizes, args.repeat, args.xla)
+        if "preprocess" not in args.skip:
+            print("Preprocessing throughput by concurrency:")
+            results["preprocess"] = bench_preprocess_throughput(images, target, args.concurrency, args.requests)
+        if "service" not in args.skip:
+            print("Service /upload by concurrency:")
+            results["service"] = bench_service(os.path.abspath(model_path), args.backend, images,
+                                               args.concurrency, args.requests)
+
+    report = {
+        "environment": environment(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "compare")},
+        "model": args.model or "stand-in",
+        "input_shape": list(backend.input_shape),
+        "images": [{"name": name, "bytes": len(data)} for name, data in images],
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.json}")
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
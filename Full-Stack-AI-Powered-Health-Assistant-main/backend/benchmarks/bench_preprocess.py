@@ -0,0 +1,102 @@
+# backend/benchmarks/bench_preprocess.py
+"""
+Micro-benchmark: legacy per-request preprocessing vs predict_preprocess.
+
+    python benchmarks/bench_preprocess.py [--repeat 20] [--clahe]
+
+Runs fully offline on the sample images in uploads/ plus a synthetic
+3000px JPEG, and prints per-image milliseconds for both pipelines.
+"""
+import argparse
+import glob
+import io
+import os
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from predict_preprocess import PreprocessOptions, preprocess  # noqa: E402
+
+
+def legacy_preprocess(data: bytes, target_size, use_clahe: bool):
+    """The pre-engine implementation from predict_service.py, kept for comparison."""
+    img = Image.open(io.BytesIO(data)).convert("RGB")
+    w, h = img.size
+    min_side = min(w, h)
+    left = (w - min_side) // 2
+    top = (h - min_side) // 2
+    img = img.crop((left, top, left + min_side, top + min_side))
+    img = img.resize((target_size[1], target_size[0]), Image.LANCZOS)
+    arr = np.array(img)
+    if use_clahe:
+        lab = cv2.cvtColor(arr, cv2.COLOR_RGB2LAB)
+        l, a, b = cv2.split(lab)
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        arr = cv2.cvtColor(cv2.merge((clahe.apply(l), a, b)), cv2.COLOR_LAB2RGB)
+    arr = arr.astype("float32") / 255.0
+    return np.expand_dims(arr, axis=0)
+
+
+def synthetic_fundus_jpeg(width=3000, height=2000, seed=0) -> bytes:
+    """Bright textured disc on a black background, roughly like a fundus photo."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    cy, cx, r = height / 2, width / 2, min(width, height) * 0.45
+    dist = np.sqrt((yy - cy) ** 2 + (xx - cx) ** 2)
+    disc = np.clip(1.0 - dist / r, 0, 1) ** 0.3
+    img = np.zeros((height, width, 3), dtype=np.float32)
+    img[..., 0] = 200 * disc
+    img[..., 1] = 90 * disc
+    img[..., 2] = 40 * disc
+    img += rng.normal(0, 6, img.shape) * (disc[..., None] > 0)
+    buf = io.BytesIO()
+    Image.fromarray(np.clip(img, 0, 255).astype(np.uint8)).save(buf, format="JPEG", quality=92)
+    return buf.getvalue()
+
+
+def load_samples():
+    samples = []
+    for path in sorted(glob.glob(os.path.join(BACKEND_DIR, "uploads", "*.png"))):
+        with open(path, "rb") as f:
+            samples.append((os.path.basename(path), f.read()))
+    samples.append(("synthetic_3000x2000.jpg", synthetic_fundus_jpeg()))
+    return samples
+
+
+def time_ms(fn, repeat):
+    fn()  # warm caches / lazy imports
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        runs.append((time.perf_counter() - t0) * 1000.0)
+    return statistics.median(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--size", type=int, default=224)
+    parser.add_argument("--clahe", action="store_true")
+    args = parser.parse_args()
+
+    target = (args.size, args.size)
+    options = PreprocessOptions(target_size=target, apply_clahe=args.clahe)
+    out = np.empty((1, args.size, args.size, 3), dtype=np.float32)
+
+    print(f"{'image':<28}{'legacy ms':>12}{'engine ms':>12}{'speedup':>10}")
+    for name, data in load_samples():
+        before = time_ms(lambda: legacy_preprocess(data, target, args.clahe), args.repeat)
+        after = time_ms(lambda: preprocess(data, options, out=out), args.repeat)
+        print(f"{name:<28}{before:>12.2f}{after:>12.2f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
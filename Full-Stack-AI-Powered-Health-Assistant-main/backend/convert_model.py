@@ -0,0 +1,233 @@
+# backend/convert_model.py
+"""
+Export the DR Keras model to TFLite and check the variants against it.
+
+    # fp32 / fp16 / int8 (post-training, calibrated on fundus images)
+    python convert_model.py export --model without_handling_dataimbalance_nonlinear3.h5 --out-dir models
+
+    # stage agreement, probability deltas and latency vs the Keras model
+    python convert_model.py parity --model without_handling_dataimbalance_nonlinear3.h5 \
+        --tflite models/*.tflite --json parity.json
+
+Serve a variant with ICARE_MODEL_BACKEND=tflite ICARE_MODEL_PATH=models/<name>.tflite
+(and optionally ICARE_TFLITE_THREADS).
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from predict_backends import KerasBackend, TFLiteBackend, decode_output
+from predict_preprocess import PreprocessOptions, load_rgb, normalize_batch
+
+VARIANTS = ("fp32", "fp16", "int8")
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+
+
+# Calibration / evaluation images
+def list_images(paths):
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            for name in sorted(os.listdir(p)):
+                if name.lower().endswith(IMAGE_EXTS):
+                    files.append(os.path.join(p, name))
+        else:
+            files.extend(sorted(glob.glob(p)))
+    return files
+
+
+def load_images(paths, target_size, apply_clahe=False):
+    options = PreprocessOptions(target_size=target_size, apply_clahe=apply_clahe)
+    images = []
+    for path in list_images(paths):
+        with open(path, "rb") as f:
+            images.append((os.path.basename(path), load_rgb(f.read(), options)))
+    if not images:
+        raise SystemExit(f"No images found in: {', '.join(paths)}")
+    return images
+
+
+def augmentations(rgb):
+    """Cheap label-preserving variants so a handful of samples covers more of the input range."""
+    yield rgb
+    yield rgb[:, ::-1]
+    yield rgb[::-1, :]
+    yield np.rot90(rgb)
+    yield np.clip(rgb.astype(np.int16) * 0.8, 0, 255).astype(np.uint8)
+    yield np.clip(rgb.astype(np.int16) * 1.2, 0, 255).astype(np.uint8)
+
+
+def calibration_set(images, samples):
+    out = []
+    while len(out) < samples:
+        for _, rgb in images:
+            for aug in augmentations(rgb):
+                out.append(np.ascontiguousarray(aug))
+                if len(out) >= samples:
+                    return out
+    return out
+
+
+# Export
+def _converter(tf, model, input_shape):
+    try:
+        return tf.lite.TFLiteConverter.from_keras_model(model)
+    except Exception:
+        # Keras 3 models can't always go through from_keras_model; trace them instead
+        fn = tf.function(lambda x: model(x, training=False))
+        concrete = fn.get_concrete_function(tf.TensorSpec([None, *input_shape], tf.float32))
+        return tf.lite.TFLiteConverter.from_concrete_functions([concrete], model)
+
+
+def export(args):
+    import tensorflow as tf
+
+    backend = KerasBackend(args.model)
+    input_shape = backend.input_shape
+    os.makedirs(args.out_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(args.model))[0]
+
+    calib = None
+    if "int8" in args.variants:
+        images = load_images(args.calibration, input_shape[:2], args.clahe)
+        calib = calibration_set(images, args.calibration_samples)
+        print(f"Calibrating int8 on {len(calib)} samples from {len(images)} images")
+
+    def representative_dataset():
+        for rgb in calib:
+            yield [normalize_batch([rgb])]
+
+    for variant in args.variants:
+        conv = _converter(tf, backend.model, input_shape)
+        if variant == "fp16":
+            conv.optimizations = [tf.lite.Optimize.DEFAULT]
+            conv.target_spec.supported_types = [tf.float16]
+        elif variant == "int8":
+            conv.optimizations = [tf.lite.Optimize.DEFAULT]
+            conv.representative_dataset = representative_dataset
+            conv.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        try:
+            content = conv.convert()
+        except Exception as e:
+            if variant != "int8":
+                raise
+            # some layers have no int8 kernel; keep them in float instead of failing
+            print(f"Full-integer conversion failed ({e}); retrying with float fallback")
+            conv.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.TFLITE_BUILTINS]
+            content = conv.convert()
+        out_path = os.path.join(args.out_dir, f"{stem}.{variant}.tflite")
+        with open(out_path, "wb") as f:
+            f.write(content)
+        print(f"Wrote {out_path} ({len(content) / 1e6:.2f} MB)")
+
+
+# Parity
+def _latency_ms(backend, batch, repeat):
+    backend.predict(batch)  # warm-up
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        backend.predict(batch)
+        runs.append((time.perf_counter() - t0) * 1000.0)
+    return statistics.median(runs)
+
+
+def parity(args):
+    reference = KerasBackend(args.model)
+    images = load_images(args.images, reference.input_shape[:2], args.clahe)
+    samples = []
+    for name, rgb in images:
+        for i, aug in enumerate(augmentations(rgb) if args.augment else [rgb]):
+            samples.append((f"{name}#{i}", np.ascontiguousarray(aug)))
+    batch = normalize_batch([rgb for _, rgb in samples])
+    one = batch[:1]
+
+    ref_out = reference.predict(batch)
+    ref_stages = [decode_output(row)[0] for row in ref_out]
+    rows = [{
+        "variant": "keras",
+        "path": args.model,
+        "size_mb": os.path.getsize(args.model) / 1e6,
+        "stage_agreement": 1.0,
+        "max_prob_delta": 0.0,
+        "mean_prob_delta": 0.0,
+        "latency_ms": _latency_ms(reference, one, args.repeat),
+    }]
+
+    for path in sorted({p for pattern in args.tflite for p in glob.glob(pattern)}):
+        backend = TFLiteBackend(path, num_threads=args.threads)
+        out = np.concatenate([backend.predict(batch[i:i + 1]) for i in range(len(batch))], axis=0)
+        stages = [decode_output(row)[0] for row in out]
+        delta = np.abs(out.reshape(len(batch), -1) - ref_out.reshape(len(batch), -1))
+        rows.append({
+            "variant": os.path.basename(path),
+            "path": path,
+            "size_mb": os.path.getsize(path) / 1e6,
+            "stage_agreement": float(np.mean([a == b for a, b in zip(stages, ref_stages)])),
+            "max_prob_delta": float(delta.max()),
+            "mean_prob_delta": float(delta.mean()),
+            "latency_ms": _latency_ms(backend, one, args.repeat),
+        })
+
+    within = [r for r in rows[1:]
+              if r["stage_agreement"] >= args.min_agreement and r["max_prob_delta"] <= args.tolerance]
+    best = min(within, key=lambda r: r["latency_ms"]) if within else None
+
+    print(f"{len(samples)} images, tolerance: max prob delta <= {args.tolerance}, "
+          f"stage agreement >= {args.min_agreement}")
+    print(f"{'variant':<48}{'MB':>8}{'agree':>8}{'maxΔ':>9}{'meanΔ':>9}{'ms/img':>9}")
+    for r in rows:
+        print(f"{r['variant']:<48}{r['size_mb']:>8.2f}{r['stage_agreement']:>8.3f}"
+              f"{r['max_prob_delta']:>9.4f}{r['mean_prob_delta']:>9.4f}{r['latency_ms']:>9.2f}")
+    print("Recommended:", best["path"] if best else "none within tolerance (keep keras)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "images": len(samples),
+                "tolerance": args.tolerance,
+                "min_agreement": args.min_agreement,
+                "results": rows,
+                "recommended": best["path"] if best else None,
+            }, f, indent=2)
+    return 0 if best else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("export", help="convert the Keras model to TFLite variants")
+    p.add_argument("--model", default=os.getenv("ICARE_MODEL_PATH", "without_handling_dataimbalance_nonlinear3.h5"))
+    p.add_argument("--out-dir", default="models")
+    p.add_argument("--variants", nargs="+", choices=VARIANTS, default=list(VARIANTS))
+    p.add_argument("--calibration", nargs="+", default=["uploads"], help="image dirs/globs for int8 calibration")
+    p.add_argument("--calibration-samples", type=int, default=100)
+    p.add_argument("--clahe", action="store_true", help="calibrate on CLAHE-processed images")
+    p.set_defaults(func=export)
+
+    p = sub.add_parser("parity", help="compare TFLite variants against the Keras model")
+    p.add_argument("--model", default=os.getenv("ICARE_MODEL_PATH", "without_handling_dataimbalance_nonlinear3.h5"))
+    p.add_argument("--tflite", nargs="+", required=True, help="converted .tflite files/globs")
+    p.add_argument("--images", nargs="+", default=["uploads"], help="image dirs/globs to evaluate on")
+    p.add_argument("--augment", action="store_true", help="also evaluate flipped/rotated/brightness variants")
+    p.add_argument("--clahe", action="store_true")
+    p.add_argument("--threads", type=int, default=0, help="TFLite interpreter threads (0 = default)")
+    p.add_argument("--repeat", type=int, default=20, help="timed runs per variant")
+    p.add_argument("--tolerance", type=float, default=0.05, help="max allowed absolute probability delta")
+    p.add_argument("--min-agreement", type=float, default=1.0, help="min fraction of matching stages")
+    p.add_argument("--json", help="write the report to this file")
+    p.set_defaults(func=parity)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+# backend/predict_admission.py
+import asyncio
+import math
+import time
+from collections import Counter
+from typing import Callable, Optional
+
+
+class Overloaded(Exception):
+    """The admission queue is full; the client should retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Server overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before `stage` could start."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded before {stage}")
+        self.stage = stage
+
+
+def parse_deadline(headers, default_timeout_ms: float = 0.0) -> Optional[float]:
+    """
+    Request deadline as a time.monotonic() value, or None for no deadline.
+
+    `X-Request-Timeout-Ms` (relative, preferred: immune to clock skew) wins
+    over `X-Request-Deadline` (absolute Unix seconds). Without either header
+    `default_timeout_ms` applies (0 = no deadline).
+    """
+    now = time.monotonic()
+    try:
+        timeout_ms = headers.get("x-request-timeout-ms")
+        if timeout_ms is not None:
+            return now + max(0.0, float(timeout_ms)) / 1000.0
+        absolute = headers.get("x-request-deadline")
+        if absolute is not None:
+            return now + (float(absolute) - time.time())
+    except ValueError:
+        pass
+    if default_timeout_ms and default_timeout_ms > 0:
+        return now + default_timeout_ms / 1000.0
+    return None
+
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    """Seconds left before `deadline` (None if there is no deadline)."""
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class AdmissionController:
+    """
+    Bounded admission for prediction requests.
+
+    At most `max_concurrent` requests run at once and at most `max_queue` wait
+    behind them; anything beyond that is rejected immediately (Overloaded)
+    rather than piling up. Queued requests whose deadline passes are dropped
+    before they start. `check()` lets handlers drop expired work again before
+    each expensive stage (fetch, inference).
+
+    Retry-After is estimated from the current queue and a moving average of
+    how long admitted requests hold their slot.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, max_retry_after: int = 30,
+                 on_shed: Optional[Callable[[str], None]] = None,
+                 on_change: Optional[Callable[[int, int], None]] = None):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queue = max(0, int(max_queue))
+        self.max_retry_after = max(1, int(max_retry_after))
+        self.on_shed = on_shed
+        self.on_change = on_change  # called with (active, queued) whenever either changes
+        self._sem = asyncio.Semaphore(self.max_concurrent)
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed = Counter()
+        self._avg_hold = 0.0  # EWMA of seconds a slot is held
+
+    def retry_after(self) -> int:
+        waves = (self.queued + 1) / self.max_concurrent
+        return max(1, min(self.max_retry_after, math.ceil(waves * self._avg_hold)))
+
+    def _shed(self, reason: str):
+        self.shed[reason] += 1
+        if self.on_shed is not None:
+            self.on_shed(reason)
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self.active, self.queued)
+
+    def expire(self, stage: str) -> DeadlineExceeded:
+        """Count work dropped at `stage` because its deadline passed; returns the exception to raise."""
+        self._shed(f"deadline_{stage}")
+        return DeadlineExceeded(stage)
+
+    def check(self, deadline: Optional[float], stage: str):
+        """Raise DeadlineExceeded (and count it) if `deadline` has already passed."""
+        if deadline is not None and time.monotonic() >= deadline:
+            raise self.expire(stage)
+
+    async def acquire(self, deadline: Optional[float] = None) -> Callable[[], None]:
+        """Wait for a slot; returns an idempotent release function."""
+        self.check(deadline, "admission")
+        if self._sem.locked():
+            if self.queued >= self.max_queue:
+                self._shed("queue_full")
+                raise Overloaded(self.retry_after())
+            self.queued += 1
+            self._changed()
+            try:
+                await asyncio.wait_for(self._sem.acquire(), timeout=remaining(deadline))
+            except asyncio.TimeoutError:
+                raise self.expire("queue") from None
+            finally:
+                self.queued -= 1
+                self._changed()
+        else:
+            await self._sem.acquire()
+
+        self.active += 1
+        self.admitted += 1
+        self._changed()
+        started = time.monotonic()
+        released = False
+
+        def release():
+            nonlocal released
+            if released:
+                return
+            released = True
+            self.active -= 1
+            held = time.monotonic() - started
+            self._avg_hold = held if self._avg_hold == 0.0 else 0.9 * self._avg_hold + 0.1 * held
+            self._sem.release()
+            self._changed()
+
+        return release
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+            "avg_service_ms": self._avg_hold * 1000.0,
+            "retry_after_s": self.retry_after(),
+        }
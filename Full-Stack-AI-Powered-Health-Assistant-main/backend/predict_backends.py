@@ -0,0 +1,244 @@
+# backend/predict_backends.py
+import os
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def parse_input_shape(shape) -> Tuple[int, int, int]:
+    """Model input shape -> (height, width, channels), defaulting to 224x224 RGB."""
+    try:
+        if isinstance(shape, list):
+            shape = shape[0]
+        shape = tuple(shape)
+        if len(shape) == 4:
+            _, h, w, c = shape
+        elif len(shape) == 3:
+            h, w, c = shape
+        else:
+            h, w, c = (224, 224, 3)
+        return int(h), int(w), int(c)
+    except Exception:
+        return 224, 224, 3
+
+
+def decode_output(preds) -> Tuple[int, list]:
+    """One image's model output -> (stage, probabilities)."""
+    preds = np.asarray(preds).squeeze()
+
+    if preds.ndim == 0:
+        val = float(preds)
+        if val < 0.2: stage = 0
+        elif val < 0.4: stage = 1
+        elif val < 0.6: stage = 2
+        elif val < 0.8: stage = 3
+        else: stage = 4
+        return stage, [val]
+    return int(np.argmax(preds)), preds.tolist()
+
+
+def configure_tf_threads(intra_op: int = 0, inter_op: int = 0):
+    """
+    Size TensorFlow's thread pools (0 leaves TF's default of one thread per core).
+
+    Must happen before TensorFlow runs its first op; afterwards TF refuses and
+    the current pools are kept.
+    """
+    if not intra_op and not inter_op:
+        return
+    import tensorflow as tf
+
+    try:
+        if intra_op:
+            tf.config.threading.set_intra_op_parallelism_threads(int(intra_op))
+        if inter_op:
+            tf.config.threading.set_inter_op_parallelism_threads(int(inter_op))
+    except RuntimeError as e:
+        print("TensorFlow thread pools already initialized, keeping them:", str(e))
+
+
+def bucket_sizes(max_batch_size: int) -> Tuple[int, ...]:
+    """Powers of two up to `max_batch_size`, plus `max_batch_size` itself."""
+    sizes, b = set(), 1
+    while b < max_batch_size:
+        sizes.add(b)
+        b *= 2
+    sizes.add(max(1, int(max_batch_size)))
+    return tuple(sorted(sizes))
+
+
+class KerasBackend:
+    """The original `.h5` model served through tf.keras."""
+
+    kind = "keras"
+
+    def __init__(self, path: str):
+        import tensorflow as tf
+
+        self.path = path
+        self.model = tf.keras.models.load_model(path, compile=False)
+        self.input_shape = parse_input_shape(self.model.input_shape)
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return np.asarray(self.model.predict(batch, verbose=0))
+
+
+class CompiledKerasBackend(KerasBackend):
+    """
+    The `.h5` model called through traced tf.functions instead of `model.predict`.
+
+    `predict()` builds a tf.data pipeline and callbacks on every call, which
+    dominates the cost of one- or few-image batches. Here there is one
+    concrete function per bucket size with a fixed input signature (optionally
+    XLA-compiled); a batch is zero-padded up to the nearest bucket and anything
+    larger than the biggest bucket is run in chunks, so tracing happens once
+    per bucket instead of once per distinct batch size.
+    """
+
+    kind = "compiled"
+
+    def __init__(self, path: str, batch_buckets: Sequence[int] = (1, 2, 4, 8), jit_compile: bool = False):
+        super().__init__(path)
+        self.batch_buckets = tuple(sorted({int(b) for b in batch_buckets if int(b) > 0})) or (1,)
+        self.jit_compile = bool(jit_compile)
+        self._fns: Dict[int, object] = {}
+        self._guard = threading.Lock()
+
+    def _get(self, bucket: int):
+        fn = self._fns.get(bucket)
+        if fn is None:
+            with self._guard:
+                fn = self._fns.get(bucket)
+                if fn is None:
+                    import tensorflow as tf
+
+                    model = self.model
+                    spec = tf.TensorSpec((bucket,) + tuple(self.input_shape), tf.float32)
+                    traced = tf.function(lambda x: model(x, training=False), input_signature=[spec],
+                                         jit_compile=self.jit_compile)
+                    fn = self._fns[bucket] = traced.get_concrete_function()
+        return fn
+
+    def _bucket(self, n: int) -> int:
+        for b in self.batch_buckets:
+            if b >= n:
+                return b
+        return self.batch_buckets[-1]
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        largest = self.batch_buckets[-1]
+        outputs = []
+        for start in range(0, batch.shape[0], largest):
+            chunk = np.asarray(batch[start:start + largest], dtype=np.float32)
+            n = chunk.shape[0]
+            bucket = self._bucket(n)
+            if bucket != n:
+                padded = np.zeros((bucket,) + chunk.shape[1:], dtype=np.float32)
+                padded[:n] = chunk
+                chunk = padded
+            out = self._get(bucket)(chunk)
+            if isinstance(out, (list, tuple)):
+                out = out[0]
+            elif isinstance(out, dict):
+                out = next(iter(out.values()))
+            outputs.append(np.asarray(out)[:n])
+        return outputs[0] if len(outputs) == 1 else np.concatenate(outputs)
+
+
+def _tflite_interpreter_cls():
+    # prefer the slim runtimes when installed, fall back to full TensorFlow
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    import tensorflow as tf
+    return tf.lite.Interpreter
+
+
+class TFLiteBackend:
+    """
+    A converted `.tflite` model (see convert_model.py).
+
+    TFLite interpreters have a fixed batch dimension and are not thread-safe,
+    so one interpreter is kept per batch size, each behind its own lock.
+    Quantized (int8/uint8) input and output tensors are (de)quantized here so
+    callers always pass and receive float32.
+    """
+
+    kind = "tflite"
+
+    def __init__(self, path: str, num_threads: int = 0):
+        self.path = path
+        self.num_threads = int(num_threads) or None
+        with open(path, "rb") as f:
+            self._content = f.read()
+        self._interpreter_cls = _tflite_interpreter_cls()
+        self._interpreters: Dict[int, Tuple[object, threading.Lock]] = {}
+        self._guard = threading.Lock()
+        interp, _ = self._get(1)
+        self.input_shape = parse_input_shape(interp.get_input_details()[0]["shape"])
+
+    def _get(self, batch_size: int):
+        with self._guard:
+            entry = self._interpreters.get(batch_size)
+            if entry is None:
+                interp = self._interpreter_cls(model_content=self._content, num_threads=self.num_threads)
+                inp = interp.get_input_details()[0]
+                if int(inp["shape"][0]) != batch_size:
+                    interp.resize_tensor_input(inp["index"], [batch_size] + list(inp["shape"][1:]))
+                interp.allocate_tensors()
+                entry = self._interpreters[batch_size] = (interp, threading.Lock())
+            return entry
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        interp, lock = self._get(int(batch.shape[0]))
+        with lock:
+            inp = interp.get_input_details()[0]
+            out = interp.get_output_details()[0]
+            x = batch
+            if inp["dtype"] in (np.int8, np.uint8):
+                scale, zero = inp["quantization"]
+                x = np.round(batch / scale + zero)
+                info = np.iinfo(inp["dtype"])
+                x = np.clip(x, info.min, info.max)
+            interp.set_tensor(inp["index"], x.astype(inp["dtype"], copy=False))
+            interp.invoke()
+            y = interp.get_tensor(out["index"])
+            if out["dtype"] in (np.int8, np.uint8):
+                scale, zero = out["quantization"]
+                y = (y.astype(np.float32) - zero) * scale
+            return np.array(y, dtype=np.float32)
+
+
+BACKENDS = {
+    "keras": KerasBackend,
+    "compiled": CompiledKerasBackend,
+    "tflite": TFLiteBackend,
+}
+
+
+def load_backend(kind: str, path: str, num_threads: int = 0, batch_buckets: Optional[Sequence[int]] = None,
+                 jit_compile: bool = False, inter_op_threads: int = 0):
+    """
+    `num_threads` is the TFLite interpreter's thread count, or TensorFlow's
+    intra-op pool size for the Keras backends (which also take
+    `inter_op_threads`). `batch_buckets` / `jit_compile` apply to "compiled".
+    """
+    kind = (kind or "keras").lower()
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown model backend '{kind}' (expected one of: {', '.join(BACKENDS)})")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Model file not found at: {path}")
+    if kind == "tflite":
+        return TFLiteBackend(path, num_threads=num_threads)
+    configure_tf_threads(num_threads, inter_op_threads)
+    if kind == "compiled":
+        return CompiledKerasBackend(path, batch_buckets=batch_buckets or bucket_sizes(8), jit_compile=jit_compile)
+    return KerasBackend(path)
@@ -0,0 +1,202 @@
+# backend/predict_batcher.py
+import asyncio
+import threading
+import time
+from collections import Counter
+from typing import Callable, List, Optional
+
+import numpy as np
+
+
+class BatcherStopped(RuntimeError):
+    """submit() on a batcher that has been stopped (e.g. its model version was retired)."""
+
+
+class MicroBatcher:
+    """
+    Coalesce single-image tensors from concurrent requests into one forward pass.
+
+    Callers `await submit(tensor)` with a (1, H, W, C) or (H, W, C) array and get
+    back their own row of the model output. A batch is flushed as soon as it
+    holds `max_batch_size` items or the oldest item has waited `max_wait_ms`.
+
+    Items are written into reusable float32 batch buffers by `collate(item, out)`
+    (a plain copy by default), so callers can submit raw uint8 images and have
+    them normalized straight into the model input.
+
+    `max_in_flight` > 1 lets several batches run at once, e.g. one per
+    inference worker process.
+
+    `submit(tensor, timings)` fills the optional dict with this item's
+    "queue_wait" and "inference" seconds.
+
+    `start()` must be called (from the event loop) before the first submit;
+    once `stop()` has run the batcher stays stopped and submit raises
+    BatcherStopped rather than bringing a worker back up.
+    """
+
+    def __init__(self, predict_fn: Callable[[np.ndarray], np.ndarray],
+                 max_batch_size: int = 8, max_wait_ms: float = 5.0, executor=None,
+                 collate: Optional[Callable[[np.ndarray, np.ndarray], None]] = None,
+                 max_in_flight: int = 1):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.executor = executor
+        self.collate = collate or (lambda item, out: np.copyto(out, item, casting="unsafe"))
+        self._buffers: List[np.ndarray] = []
+        self._buffers_lock = threading.Lock()
+        self._in_flight = set()
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._stopped = False
+
+        # tuning stats
+        self.batches = 0
+        self.items = 0
+        self.batch_size_counts = Counter()
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.inference_time_total = 0.0
+
+    def start(self):
+        if self._stopped:
+            raise BatcherStopped("Batcher has been stopped and cannot be restarted")
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        self._stopped = True
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        # fail anything still waiting so callers don't hang
+        while self._queue is not None and not self._queue.empty():
+            _, fut, _, _ = self._queue.get_nowait()
+            if not fut.done():
+                fut.set_exception(BatcherStopped("Batcher stopped"))
+
+    async def submit(self, tensor: np.ndarray, timings: Optional[dict] = None) -> np.ndarray:
+        if self._stopped:
+            raise BatcherStopped("Batcher stopped")
+        if self._worker is None:
+            raise RuntimeError("Batcher not started; call start() first")
+        if tensor.ndim == 4:
+            tensor = tensor[0]
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((tensor, fut, time.perf_counter(), timings))
+        return await fut
+
+    async def _collect(self) -> List[tuple]:
+        first = await self._queue.get()
+        items = [first]
+        deadline = first[2] + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                # drain whatever is already queued without waiting
+                try:
+                    items.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                items.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    def _take_buffer(self, shape) -> np.ndarray:
+        with self._buffers_lock:
+            while self._buffers:
+                buf = self._buffers.pop()
+                if buf.shape[1:] == shape:
+                    return buf
+        return np.empty((self.max_batch_size,) + shape, dtype=np.float32)
+
+    def _forward(self, tensors: List[np.ndarray]) -> np.ndarray:
+        # at most max_in_flight buffers exist; each is reused once its batch is done
+        buf = self._take_buffer(tensors[0].shape)
+        try:
+            batch = buf[:len(tensors)]
+            for i, t in enumerate(tensors):
+                self.collate(t, batch[i])
+            return np.asarray(self.predict_fn(batch))
+        finally:
+            with self._buffers_lock:
+                self._buffers.append(buf)
+
+    async def _dispatch(self, items: List[tuple]):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        for _, _, enqueued, timings in items:
+            wait = started - enqueued
+            self.queue_wait_total += wait
+            self.queue_wait_max = max(self.queue_wait_max, wait)
+            if timings is not None:
+                timings["queue_wait"] = wait
+
+        try:
+            preds = await loop.run_in_executor(self.executor, self._forward, [it[0] for it in items])
+        except Exception as e:
+            for _, fut, _, _ in items:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        elapsed = time.perf_counter() - started
+        self.inference_time_total += elapsed
+        self.batches += 1
+        self.items += len(items)
+        self.batch_size_counts[len(items)] += 1
+
+        for i, (_, fut, _, timings) in enumerate(items):
+            if timings is not None:
+                timings["inference"] = elapsed
+            if not fut.done():
+                fut.set_result(preds[i])
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.max_in_flight)
+        while True:
+            await slots.acquire()
+            try:
+                items = await self._collect()
+            except BaseException:
+                slots.release()
+                raise
+            # skip callers that gave up while queued
+            items = [it for it in items if not it[1].done()]
+            if not items:
+                slots.release()
+                continue
+            task = loop.create_task(self._dispatch(items))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+            task.add_done_callback(lambda _: slots.release())
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "max_in_flight": self.max_in_flight,
+            "stopped": self._stopped,
+            "in_flight": len(self._in_flight),
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": (self.items / self.batches) if self.batches else 0.0,
+            "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_size_counts.items())},
+            "avg_queue_wait_ms": (self.queue_wait_total / self.items * 1000.0) if self.items else 0.0,
+            "max_queue_wait_ms": self.queue_wait_max * 1000.0,
+            "avg_inference_ms": (self.inference_time_total / self.batches * 1000.0) if self.batches else 0.0,
+        }
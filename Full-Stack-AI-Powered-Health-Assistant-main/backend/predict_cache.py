@@ -0,0 +1,138 @@
+# backend/predict_cache.py
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+def model_identity(path: str) -> str:
+    """Short fingerprint of a model file (name, size, mtime) so cached results die with the model."""
+    try:
+        st = os.stat(path)
+        raw = f"{os.path.basename(path)}:{st.st_size}:{int(st.st_mtime)}"
+    except OSError:
+        raw = os.path.basename(path)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class PredictionCache:
+    """
+    Content-addressed cache of prediction results.
+
+    Keys are derived from the raw image bytes, the preprocessing options and the
+    model identity. Values are plain dicts (a PredictResponse without the
+    per-request fields). There is an in-memory LRU tier bounded by entry count
+    and TTL, and an optional JSON-on-disk tier that survives restarts.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 86400.0,
+                 disk_dir: Optional[str] = None):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl_seconds)
+        self.disk_dir = disk_dir or None
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(data: bytes, model_id: str, **options) -> str:
+        h = hashlib.sha256(data)
+        opts = ",".join(f"{k}={options[k]}" for k in sorted(options))
+        h.update(f"|{opts}|{model_id}".encode("utf-8"))
+        return h.hexdigest()
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl > 0 and (time.time() - created) > self.ttl
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _remember(self, key: str, created: float, value: dict):
+        # caller holds the lock
+        self._entries[key] = (created, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, value = entry
+                if not self._expired(created):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(value)
+                del self._entries[key]
+
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, value[0], value[1])
+            return dict(value[1])
+
+    def put(self, key: str, value: dict):
+        created = time.time()
+        with self._lock:
+            self._remember(key, created, dict(value))
+        self._write_disk(key, created, value)
+
+    def _read_disk(self, key: str):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._expired(record.get("created", 0)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return record["created"], record["value"]
+
+    def _write_disk(self, key: str, created: float, value: dict):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"created": created, "value": value}, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print("Prediction cache disk write failed:", str(e))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "disk_dir": self.disk_dir,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": ((self.hits + self.disk_hits) / lookups) if lookups else 0.0,
+        }
@@ -0,0 +1,90 @@
+# backend/predict_fetch.py
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+
+class FetchError(Exception):
+    """Image could not be downloaded (network error, bad status, ...)."""
+
+
+class ImageTooLargeError(FetchError):
+    """Remote image exceeded the configured byte cap."""
+
+
+class ImageFetcher:
+    """
+    Async image downloader backed by one pooled, keep-alive httpx client.
+
+    Each host gets its own semaphore so a single slow image server cannot take
+    every connection (dropped again once no fetch for that host is pending,
+    so client-chosen hosts can't grow it without bound), and bodies are streamed so oversized responses are cut
+    off before they are fully buffered.
+    """
+
+    def __init__(self, timeout: float = 30.0, max_connections: int = 64,
+                 max_keepalive: int = 16, per_host_limit: int = 8,
+                 max_bytes: int = 20 * 1024 * 1024):
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.per_host_limit = max(1, int(per_host_limit))
+        self.max_bytes = int(max_bytes)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_limits: Dict[str, List] = {}  # host -> [semaphore, fetches holding or waiting on it]
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_keepalive),
+                follow_redirects=True,
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @asynccontextmanager
+    async def _host_limit(self, url: str):
+        host = urlsplit(url).netloc.lower()
+        entry = self._host_limits.get(host)
+        if entry is None:
+            entry = self._host_limits[host] = [asyncio.Semaphore(self.per_host_limit), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and self._host_limits.get(host) is entry:
+                del self._host_limits[host]
+
+    async def fetch(self, url) -> bytes:
+        url = str(url)
+        async with self._host_limit(url):
+            try:
+                async with self.client.stream("GET", url) as resp:
+                    resp.raise_for_status()
+                    declared = resp.headers.get("content-length")
+                    if declared and declared.isdigit() and int(declared) > self.max_bytes:
+                        raise ImageTooLargeError(f"Image is {declared} bytes (limit {self.max_bytes})")
+                    buf = bytearray()
+                    async for chunk in resp.aiter_bytes():
+                        buf.extend(chunk)
+                        if len(buf) > self.max_bytes:
+                            raise ImageTooLargeError(f"Image exceeds {self.max_bytes} bytes")
+                    return bytes(buf)
+            except FetchError:
+                raise
+            except httpx.HTTPStatusError as e:
+                raise FetchError(f"HTTP {e.response.status_code} from {url}") from e
+            except httpx.HTTPError as e:
+                raise FetchError(f"{type(e).__name__}: {e}") from e
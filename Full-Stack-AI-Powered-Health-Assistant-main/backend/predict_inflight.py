@@ -0,0 +1,76 @@
+# backend/predict_inflight.py
+import asyncio
+from collections import Counter
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+
+class SingleFlight:
+    """
+    Coalesce identical in-flight work.
+
+    The first caller for a key starts `fn(*args)` as a task; callers arriving
+    with the same key while it runs await that same task instead of starting
+    their own, and all of them get its result (or its exception). The key is
+    forgotten as soon as the task finishes, so later calls start fresh work
+    (caching finished results is PredictionCache's job).
+
+    Waiters await the task through asyncio.shield: a waiter that is cancelled
+    (client disconnect, its own deadline) leaves the shared work running for
+    everyone else. Once the last waiter has gone, the work is cancelled and
+    the key forgotten, so nothing keeps running for nobody.
+    """
+
+    def __init__(self, on_join: Optional[Callable[[str], None]] = None):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}  # per task, not per key: a key can outlive its task
+        self.on_join = on_join  # called with the key's kind whenever a caller joins existing work
+        self.started = Counter()
+        self.joined = Counter()
+
+    async def do(self, kind: str, key: Hashable, fn: Callable[..., Awaitable], *args):
+        full_key = (kind, key)
+        task = self._calls.get(full_key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._calls[full_key] = task
+            task.add_done_callback(lambda t: self._done(full_key, t))
+            self.started[kind] += 1
+        else:
+            self.joined[kind] += 1
+            if self.on_join is not None:
+                self.on_join(kind)
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._leave(full_key, task)
+
+    def _leave(self, key, task: asyncio.Task):
+        left = self._waiters.get(task, 1) - 1
+        if left > 0:
+            self._waiters[task] = left
+            return
+        self._waiters.pop(task, None)
+        if not task.done():
+            # every caller gave up; a new one must start fresh rather than join a cancelled task
+            if self._calls.get(key) is task:
+                del self._calls[key]
+            task.cancel()
+
+    def _done(self, key, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # every waiter may have gone away; don't let the result go "never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    def cancel_all(self):
+        for task in list(self._calls.values()):
+            task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "started": dict(self.started),
+            "joined": dict(self.joined),
+        }
@@ -0,0 +1,217 @@
+# backend/predict_metrics.py
+"""
+Prometheus metrics for the predict service.
+
+prometheus_client is optional: without it every recording call is a no-op
+and /metrics reports that metrics are unavailable. For multi-process
+deployments (uvicorn --workers N, gunicorn) set PROMETHEUS_MULTIPROC_DIR to
+an empty, writable directory before start-up; /metrics then aggregates all
+processes.
+"""
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+# per-request stage seconds; set by MetricsMiddleware, read back for Server-Timing
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("icare_request_timings", default=None)
+
+
+def _multiprocess() -> bool:
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR") or os.environ.get("prometheus_multiproc_dir"))
+
+
+class Metrics:
+    """Thin wrapper so call sites don't care whether prometheus_client is installed."""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = bool(enabled) and prometheus_client is not None
+        if not self.enabled:
+            return
+        from prometheus_client import Counter, Gauge, Histogram
+
+        self.stage_seconds = Histogram(
+            "icare_predict_stage_seconds", "Time spent per pipeline stage, per image",
+            ["stage"], buckets=STAGE_BUCKETS)
+        self.request_seconds = Histogram(
+            "icare_predict_request_seconds", "Request latency including the response body",
+            ["endpoint"], buckets=STAGE_BUCKETS)
+        self.requests = Counter(
+            "icare_predict_requests_total", "Requests by endpoint and status code", ["endpoint", "status"])
+        self.in_flight = Gauge(
+            "icare_predict_requests_in_flight", "Requests currently being handled",
+            ["endpoint"], multiprocess_mode="livesum")
+        self.errors = Counter(
+            "icare_predict_errors_total", "Failures by type (fetch, too_large, decode, inference, ...)", ["type"])
+        self.cache = Counter(
+            "icare_predict_cache_lookups_total", "Prediction cache lookups", ["result"])
+        self.batch_size = Histogram(
+            "icare_predict_batch_size", "Images per model forward pass", buckets=BATCH_BUCKETS)
+        self.model_seconds = Histogram(
+            "icare_predict_model_seconds", "Model forward pass time, per batch", buckets=STAGE_BUCKETS)
+        self.model_info = Gauge(
+            "icare_predict_model_info", "Active model version (value is always 1)",
+            ["version", "backend", "model_id"], multiprocess_mode="liveall")
+        self.shed = Counter(
+            "icare_predict_shed_total", "Requests/images dropped by admission control, by reason", ["reason"])
+        self.admission_active = Gauge(
+            "icare_predict_admission_active", "Requests holding an admission slot", multiprocess_mode="livesum")
+        self.admission_queued = Gauge(
+            "icare_predict_admission_queue_depth", "Requests waiting for an admission slot",
+            multiprocess_mode="livesum")
+        self.shadow_results = Counter(
+            "icare_predict_shadow_total", "Shadow comparisons by result (agree, disagree, error)", ["result"])
+        self.ungradable_images = Counter(
+            "icare_predict_ungradable_total", "Images rejected by the quality gate, by reason", ["reason"])
+        self.coalesced_requests = Counter(
+            "icare_predict_coalesced_total", "Requests that joined identical in-flight work", ["kind"])
+        self.model_load_seconds = Gauge(
+            "icare_predict_model_load_seconds", "Time to load the model", multiprocess_mode="max")
+        self.model_warmup_seconds = Gauge(
+            "icare_predict_model_warmup_seconds", "Time spent in warm-up inferences", multiprocess_mode="max")
+
+    # recording
+    def observe(self, stage: str, seconds: float):
+        """Record one stage duration for the histogram and the current request's Server-Timing."""
+        if self.enabled:
+            self.stage_seconds.labels(stage).observe(seconds)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+    def observe_all(self, timings: Dict[str, float]):
+        for stage, seconds in timings.items():
+            self.observe(stage, seconds)
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0)
+
+    def error(self, kind: str):
+        if self.enabled:
+            self.errors.labels(kind).inc()
+
+    def cache_lookup(self, hit: bool):
+        if self.enabled:
+            self.cache.labels("hit" if hit else "miss").inc()
+
+    def batch(self, size: int, seconds: float):
+        if self.enabled:
+            self.batch_size.observe(size)
+            self.model_seconds.observe(seconds)
+
+    def shed_request(self, reason: str):
+        if self.enabled:
+            self.shed.labels(reason).inc()
+
+    def admission(self, active: int, queued: int):
+        if self.enabled:
+            self.admission_active.set(active)
+            self.admission_queued.set(queued)
+
+    def shadow(self, result: str):
+        if self.enabled:
+            self.shadow_results.labels(result).inc()
+
+    def ungradable(self, reasons):
+        if self.enabled:
+            for reason in reasons:
+                self.ungradable_images.labels(reason).inc()
+
+    def coalesced(self, kind: str):
+        if self.enabled:
+            self.coalesced_requests.labels(kind).inc()
+
+    def model_loaded(self, version: str, backend: str, model_id: str,
+                     load_seconds: Optional[float], warmup_seconds: Optional[float]):
+        """Mark `version` as the one serving traffic."""
+        if not self.enabled:
+            return
+        self.model_info.clear()
+        self.model_info.labels(version, backend, model_id or "").set(1)
+        if load_seconds is not None:
+            self.model_load_seconds.set(load_seconds)
+        if warmup_seconds is not None:
+            self.model_warmup_seconds.set(warmup_seconds)
+
+    # exposition
+    def render(self):
+        """(body, content_type) in Prometheus text format, aggregated across processes if configured."""
+        from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest
+
+        registry = REGISTRY
+        if _multiprocess():
+            from prometheus_client import multiprocess
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+    def process_exit(self):
+        if self.enabled and _multiprocess():
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(os.getpid())
+
+
+def format_server_timing(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{stage};dur={seconds * 1000.0:.2f}" for stage, seconds in timings.items())
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware: in-flight gauge, request counter/latency and an
+    optional `Server-Timing` header for the given paths. Other paths pass
+    straight through.
+    """
+
+    def __init__(self, app, metrics: Metrics, paths, server_timing: bool = False):
+        self.app = app
+        self.metrics = metrics
+        self.paths = frozenset(paths)
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = scope["path"]
+        metrics = self.metrics
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+        if metrics.enabled:
+            metrics.in_flight.labels(endpoint).inc()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    timings["total"] = time.perf_counter() - start
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", format_server_timing(timings).encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_timings.reset(token)
+            if metrics.enabled:
+                metrics.in_flight.labels(endpoint).dec()
+                metrics.requests.labels(endpoint, str(status)).inc()
+                metrics.request_seconds.labels(endpoint).observe(time.perf_counter() - start)
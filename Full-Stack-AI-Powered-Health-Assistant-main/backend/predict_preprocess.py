@@ -0,0 +1,159 @@
+# backend/predict_preprocess.py
+import io
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from predict_quality import QualityThresholds, UngradableImage, assess
+
+
+@dataclass(frozen=True)
+class PreprocessOptions:
+    """Per-request preprocessing settings (no more toggling module globals)."""
+    target_size: Tuple[int, int]  # (height, width)
+    apply_clahe: bool = False
+    clahe_clip_limit: float = 2.0
+    clahe_tile_grid: int = 8
+    quality: Optional[QualityThresholds] = None  # run the quality gate before anything model-specific
+
+
+class InvalidImage(ValueError):
+    """Raised when the bytes are not a decodable image (a client error, unlike a failure to score)."""
+
+
+_local = threading.local()
+_cv2 = None
+
+
+def _cv():
+    # cv2 is only needed for CLAHE; importing it lazily keeps it off the startup path
+    global _cv2
+    if _cv2 is None:
+        import cv2
+        _cv2 = cv2
+    return _cv2
+
+
+def _get_clahe(clip_limit: float, tile_grid: int):
+    # cv2 CLAHE objects are cheap to reuse but not safe to share across threads
+    cache = getattr(_local, "clahe", None)
+    if cache is None:
+        cache = _local.clahe = {}
+    key = (clip_limit, tile_grid)
+    clahe = cache.get(key)
+    if clahe is None:
+        clahe = cache[key] = _cv().createCLAHE(clipLimit=clip_limit, tileGridSize=(tile_grid, tile_grid))
+    return clahe
+
+
+def apply_clahe_to_rgb(image: np.ndarray, clip_limit: float = 2.0, tile_grid: int = 8) -> np.ndarray:
+    cv2 = _cv()
+    lab = cv2.cvtColor(image, cv2.COLOR_RGB2LAB)
+    # equalize the L channel in place instead of split/merge copies
+    lab[..., 0] = _get_clahe(clip_limit, tile_grid).apply(np.ascontiguousarray(lab[..., 0]))
+    return cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+
+
+def decode(data: bytes, target_size: Tuple[int, int]) -> Image.Image:
+    """
+    Decode image bytes to an RGB PIL image.
+
+    JPEGs are decoded at a reduced DCT scale when the source is much larger
+    than the model input, so a 3000px fundus photo is never fully
+    materialized just to be shrunk to 224px.
+    """
+    target_h, target_w = target_size
+    try:
+        img = Image.open(io.BytesIO(data))
+    except (OSError, ValueError):
+        # UnidentifiedImageError's message embeds the BytesIO repr; say what went wrong instead
+        raise InvalidImage("Could not decode image: unsupported or corrupt image data") from None
+    if img.format == "JPEG":
+        w, h = img.size
+        # smallest scale whose short side still covers the target
+        scale = min(w, h) / float(max(target_h, target_w))
+        if scale >= 2:
+            img.draft("RGB", (int(w / scale) + 1, int(h / scale) + 1))
+    try:
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.load()
+    except (OSError, ValueError) as e:
+        # truncated or corrupt pixel data
+        raise InvalidImage(f"Could not decode {img.format or 'image'} data: {e}") from None
+    return img
+
+
+def crop_resize(img: Image.Image, target_size: Tuple[int, int]) -> np.ndarray:
+    """Center-crop to a square and resize to (H, W); returns uint8 (H, W, 3)."""
+    target_h, target_w = target_size
+    w, h = img.size
+    min_side = min(w, h)
+    left = (w - min_side) // 2
+    top = (h - min_side) // 2
+    # crop + resize in one pass; reducing_gap box-averages first so LANCZOS
+    # only runs over a ~3x-target image instead of the full-resolution one
+    img = img.resize((target_w, target_h), Image.LANCZOS,
+                     box=(left, top, left + min_side, top + min_side), reducing_gap=3.0)
+    return np.asarray(img)
+
+
+def load_rgb(data: bytes, options: PreprocessOptions, timings: Optional[dict] = None) -> np.ndarray:
+    """
+    Decode, center-crop, resize and optionally CLAHE an image into uint8 (H, W, 3).
+
+    With `options.quality` set, the quality gate runs right after the resize
+    and raises UngradableImage for images that fail it. If `timings` is
+    given, per-stage seconds are written to it under "decode", "resize",
+    "quality" and "clahe".
+    """
+    t0 = time.perf_counter()
+    img = decode(data, options.target_size)
+    t1 = time.perf_counter()
+    arr = crop_resize(img, options.target_size)
+    t2 = time.perf_counter()
+    if timings is not None:
+        timings["decode"] = t1 - t0
+        timings["resize"] = t2 - t1
+    if options.quality is not None:
+        report = assess(img, arr, options.quality)
+        if timings is not None:
+            timings["quality"] = report.seconds
+        if not report.gradable:
+            raise UngradableImage(report)
+    if options.apply_clahe:
+        t3 = time.perf_counter()
+        try:
+            arr = apply_clahe_to_rgb(arr, options.clahe_clip_limit, options.clahe_tile_grid)
+        except Exception:
+            pass
+        if timings is not None:
+            timings["clahe"] = time.perf_counter() - t3
+    return arr
+
+
+def normalize_into(rgb: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """Scale uint8 pixels to [0, 1] float32, writing into a caller-owned buffer."""
+    np.divide(rgb, np.float32(255.0), out=out, dtype=np.float32)
+    return out
+
+
+def normalize_batch(images: Sequence[np.ndarray], out: Optional[np.ndarray] = None) -> np.ndarray:
+    if out is None:
+        out = np.empty((len(images),) + images[0].shape, dtype=np.float32)
+    for i, rgb in enumerate(images):
+        normalize_into(rgb, out[i])
+    return out[:len(images)]
+
+
+def preprocess(data: bytes, options: PreprocessOptions, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Bytes -> (1, H, W, 3) float32 model input."""
+    rgb = load_rgb(data, options)
+    if out is None:
+        out = np.empty((1,) + rgb.shape, dtype=np.float32)
+    normalize_into(rgb, out[0])
+    return out
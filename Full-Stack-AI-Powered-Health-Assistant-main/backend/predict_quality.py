@@ -0,0 +1,129 @@
+# backend/predict_quality.py
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image
+
+
+@dataclass(frozen=True)
+class QualityThresholds:
+    """Limits for the pre-inference quality gate (see assess())."""
+    size: int = 256  # long side of the grey copy used for the disc and exposure checks
+    background_level: int = 20  # grey level separating the fundus from the black surround
+    min_fundus_fraction: float = 0.20  # fundus area / frame area
+    min_circle_fill: float = 0.75  # fundus area / its enclosing circle (a plain photo fills a rectangle, ~0.6)
+    min_sharpness: float = 25.0  # variance of the Laplacian inside the fundus, at model input size
+    min_brightness: float = 25.0  # mean grey level inside the fundus
+    max_brightness: float = 220.0
+    max_overexposed: float = 0.25  # fraction of fundus pixels at >= 250
+    max_underexposed: float = 0.50  # fraction of fundus pixels at <= 2 * background_level
+
+
+@dataclass
+class QualityReport:
+    gradable: bool
+    reasons: List[str] = field(default_factory=list)
+    metrics: Dict[str, float] = field(default_factory=dict)
+    seconds: float = 0.0
+
+    def describe(self) -> dict:
+        return {
+            "gradable": self.gradable,
+            "reasons": list(self.reasons),
+            "metrics": dict(self.metrics),
+            "ms": round(self.seconds * 1000.0, 3),
+        }
+
+
+class UngradableImage(Exception):
+    """Raised by preprocessing when an image fails the quality gate; carries the report."""
+
+    def __init__(self, report: QualityReport):
+        super().__init__("Image is ungradable: " + ", ".join(report.reasons))
+        self.report = report
+
+
+def _cv():
+    from predict_preprocess import _cv as lazy_cv2  # shares the lazy cv2 import
+    return lazy_cv2()
+
+
+def _frame_copy(img: Image.Image, size: int) -> np.ndarray:
+    # nearest-neighbour: ~100x cheaper than filtering the full-resolution frame,
+    # and plenty for finding the disc and reading the exposure histogram
+    w, h = img.size
+    scale = size / float(max(w, h))
+    if scale < 1.0:
+        img = img.resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.NEAREST)
+    return np.asarray(img.convert("L"))
+
+
+def _fundus_mask(grey: np.ndarray, level: int):
+    """Largest region brighter than `level`, filled: (mask, area fraction, fill of its enclosing circle)."""
+    cv2 = _cv()
+    mask = (grey > level).astype(np.uint8)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return mask, 0.0, 0.0
+    largest = max(contours, key=cv2.contourArea)
+    area = float(cv2.contourArea(largest))
+    (_, _), radius = cv2.minEnclosingCircle(largest)
+    mask = np.zeros_like(mask)
+    cv2.drawContours(mask, [largest], -1, 1, thickness=cv2.FILLED)
+    return mask, area / float(grey.size), (area / (np.pi * radius * radius) if radius > 0 else 0.0)
+
+
+def assess(img: Image.Image, rgb: np.ndarray, thresholds: QualityThresholds) -> QualityReport:
+    """
+    Fundus-circle, exposure and sharpness checks.
+
+    `img` is the decoded full frame, used only through a tiny subsampled
+    grey copy (a real fundus photo is a near-circular disc on black; an
+    ordinary photo fills its frame, so its circle fill is ~0.6). Sharpness
+    is the Laplacian variance of `rgb`, the already-downscaled model input,
+    i.e. blur as the model would see it. Costs about a millisecond whatever
+    the camera resolution.
+    """
+    cv2 = _cv()
+    t0 = time.perf_counter()
+    t = thresholds
+    reasons = []
+
+    grey = _frame_copy(img, t.size)
+    mask, fundus_fraction, circle_fill = _fundus_mask(grey, t.background_level)
+    if fundus_fraction < t.min_fundus_fraction:
+        reasons.append("no_fundus")
+    elif circle_fill < t.min_circle_fill:
+        reasons.append("not_fundus_shape")
+
+    pixels = grey[mask.astype(bool)] if fundus_fraction > 0 else grey.ravel()
+    hist = np.bincount(pixels, minlength=256)
+    n = float(max(1, pixels.size))
+    brightness = float(np.dot(hist, np.arange(256)) / n)
+    overexposed = float(hist[250:].sum() / n)
+    underexposed = float(hist[:2 * t.background_level + 1].sum() / n)
+    if brightness < t.min_brightness or underexposed > t.max_underexposed:
+        reasons.append("underexposed")
+    if brightness > t.max_brightness or overexposed > t.max_overexposed:
+        reasons.append("overexposed")
+
+    small = cv2.cvtColor(np.ascontiguousarray(rgb), cv2.COLOR_RGB2GRAY)
+    core, _, _ = _fundus_mask(small, t.background_level)
+    # shrink the disc so its own rim doesn't count as detail
+    core = cv2.erode(core, np.ones((5, 5), np.uint8)).astype(bool)
+    lap = cv2.Laplacian(small, cv2.CV_32F, ksize=3)
+    sharpness = float(lap[core].var()) if core.any() else float(lap.var())
+    if sharpness < t.min_sharpness:
+        reasons.append("blurry")
+
+    metrics = {
+        "fundus_fraction": round(fundus_fraction, 4),
+        "circle_fill": round(circle_fill, 4),
+        "sharpness": round(sharpness, 2),
+        "brightness": round(brightness, 2),
+        "overexposed": round(overexposed, 4),
+        "underexposed": round(underexposed, 4),
+    }
+    return QualityReport(not reasons, reasons, metrics, time.perf_counter() - t0)
@@ -0,0 +1,263 @@
+# backend/predict_registry.py
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from predict_backends import decode_output
+from predict_preprocess import PreprocessOptions, load_rgb, normalize_batch
+
+
+class ModelVersion:
+    """One loaded model plus everything the service keeps per model (batcher, timings)."""
+
+    def __init__(self, name: str, path: str, backend: str):
+        self.name = name
+        self.path = path
+        self.backend = backend
+        self.model = None  # a predict_backends backend or a WorkerPool
+        self.model_id = None  # fingerprint used in cache keys
+        self.input_shape = None
+        self.batcher = None
+        self.status = "loading"  # loading -> ready | failed
+        self.error = None
+        self.created_at = time.time()
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.warmup_batch_sizes = {}
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def describe(self) -> dict:
+        return {
+            "name": self.name,
+            "path": self.path,
+            "backend": self.model.kind if self.model is not None else self.backend,
+            "model_id": self.model_id,
+            "input_shape": list(self.input_shape) if self.input_shape else None,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "warmup_batch_sizes": self.warmup_batch_sizes,
+        }
+
+
+class ModelRegistry:
+    """
+    Named model versions with one active version, rollback history and an
+    optional shadow candidate.
+
+    Loading and warming happen outside the registry (the service does that on
+    a background thread); a version is only added once it's ready, and
+    `activate()` swaps the active reference in one step. Requests take a
+    snapshot of `active` once and use it throughout, so a swap never mixes
+    two models (or input shapes, or cache keys) within one request.
+
+    Shadow scoring runs a sampled fraction of production inputs through the
+    shadow version on its own thread, off the request path, and counts
+    stage agreement with production.
+    """
+
+    def __init__(self, max_versions: int = 3, shadow_max_pending: int = 16,
+                 on_shadow: Optional[Callable[[str], None]] = None):
+        self.max_versions = max(1, int(max_versions))
+        self._versions: "OrderedDict[str, ModelVersion]" = OrderedDict()
+        self._active: Optional[ModelVersion] = None
+        self._history: List[str] = []  # previously active names, most recent last
+        self._lock = threading.Lock()
+
+        self._shadow: Optional[ModelVersion] = None
+        self.shadow_rate = 0.0
+        self._shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="icare-shadow")
+        self._shadow_pending = 0
+        self.shadow_max_pending = max(1, int(shadow_max_pending))
+        self.on_shadow = on_shadow
+        self._reset_shadow_stats()
+
+    # versions
+    @property
+    def active(self) -> Optional[ModelVersion]:
+        return self._active
+
+    @property
+    def shadow(self) -> Optional[ModelVersion]:
+        return self._shadow
+
+    def get(self, name: str) -> Optional[ModelVersion]:
+        return self._versions.get(name)
+
+    def versions(self) -> List[ModelVersion]:
+        return list(self._versions.values())
+
+    def add(self, version: ModelVersion) -> List[ModelVersion]:
+        """Register a ready version. Returns versions evicted to stay within max_versions (caller closes them)."""
+        if not version.ready:
+            raise ValueError(f"Model version '{version.name}' is not ready ({version.status})")
+        with self._lock:
+            if version.name in self._versions:
+                raise ValueError(f"Model version '{version.name}' already exists")
+            self._versions[version.name] = version
+            return self._evict(keep=version)
+
+    def _evict(self, keep: ModelVersion) -> List[ModelVersion]:
+        # caller holds the lock; oldest versions that are neither active, shadow nor `keep` go first
+        evicted = []
+        for name in list(self._versions):
+            if len(self._versions) <= self.max_versions:
+                break
+            v = self._versions[name]
+            if v is self._active or v is self._shadow or v is keep:
+                continue
+            evicted.append(self._versions.pop(name))
+            self._history = [h for h in self._history if h != name]
+        return evicted
+
+    def activate(self, name: str) -> Optional[ModelVersion]:
+        """Make `name` the active version. Returns the previously active version."""
+        with self._lock:
+            version = self._versions.get(name)
+            if version is None:
+                raise KeyError(f"Unknown model version '{name}'")
+            previous = self._active
+            if previous is version:
+                return previous
+            if previous is not None:
+                self._history = [h for h in self._history if h != previous.name] + [previous.name]
+            self._history = [h for h in self._history if h != name]
+            self._active = version
+            if self._shadow is version:
+                self._shadow = None
+            return previous
+
+    def rollback(self) -> ModelVersion:
+        """Re-activate the most recent previously active version still loaded."""
+        with self._lock:
+            while self._history:
+                name = self._history.pop()
+                version = self._versions.get(name)
+                if version is not None:
+                    current = self._active
+                    self._active = version
+                    if self._shadow is version:
+                        self._shadow = None
+                    # rolling back twice returns to where we started
+                    if current is not None:
+                        self._history.append(current.name)
+                    return version
+        raise LookupError("No previous model version to roll back to")
+
+    def remove(self, name: str) -> ModelVersion:
+        with self._lock:
+            version = self._versions.get(name)
+            if version is None:
+                raise KeyError(f"Unknown model version '{name}'")
+            if version is self._active:
+                raise ValueError(f"Model version '{name}' is active; activate another version first")
+            if version is self._shadow:
+                self._shadow = None
+                self.shadow_rate = 0.0
+            self._history = [h for h in self._history if h != name]
+            return self._versions.pop(name)
+
+    # shadow scoring
+    def _reset_shadow_stats(self):
+        self.shadow_compared = 0
+        self.shadow_agreed = 0
+        self.shadow_errors = 0
+        self.shadow_dropped = 0
+        self.shadow_delta_total = 0.0
+        self.shadow_delta_max = 0.0
+
+    def set_shadow(self, name: str, sample_rate: float):
+        with self._lock:
+            version = self._versions.get(name)
+            if version is None:
+                raise KeyError(f"Unknown model version '{name}'")
+            if version is self._active:
+                raise ValueError(f"Model version '{name}' is already active")
+            if self._shadow is not version:
+                self._reset_shadow_stats()
+            self._shadow = version
+            self.shadow_rate = min(1.0, max(0.0, float(sample_rate)))
+
+    def clear_shadow(self):
+        with self._lock:
+            self._shadow = None
+            self.shadow_rate = 0.0
+
+    def maybe_shadow(self, data: bytes, rgb: np.ndarray, apply_clahe: bool, production_preds):
+        """Sample this request for shadow scoring; never blocks or raises into the caller."""
+        shadow = self._shadow
+        if shadow is None or self.shadow_rate <= 0 or random.random() >= self.shadow_rate:
+            return
+        with self._lock:
+            if self._shadow_pending >= self.shadow_max_pending:
+                self.shadow_dropped += 1
+                return
+            self._shadow_pending += 1
+        self._shadow_executor.submit(self._shadow_score, shadow, data, rgb, apply_clahe, production_preds)
+
+    def _shadow_score(self, shadow: ModelVersion, data, rgb, apply_clahe, production_preds):
+        result = "error"
+        try:
+            target = tuple(shadow.input_shape[:2])
+            if tuple(rgb.shape[:2]) != target:
+                rgb = load_rgb(data, PreprocessOptions(target_size=target, apply_clahe=apply_clahe))
+            preds = np.asarray(shadow.model.predict(normalize_batch([rgb])))[0]
+            prod_stage, prod_probs = decode_output(production_preds)
+            cand_stage, cand_probs = decode_output(preds)
+            delta = 0.0
+            if len(prod_probs) == len(cand_probs):
+                delta = float(np.max(np.abs(np.asarray(prod_probs) - np.asarray(cand_probs))))
+            agree = prod_stage == cand_stage
+            result = "agree" if agree else "disagree"
+            with self._lock:
+                if shadow is self._shadow:
+                    self.shadow_compared += 1
+                    self.shadow_agreed += int(agree)
+                    self.shadow_delta_total += delta
+                    self.shadow_delta_max = max(self.shadow_delta_max, delta)
+            if not agree:
+                print(f"Shadow disagreement: production stage {prod_stage} vs "
+                      f"'{shadow.name}' stage {cand_stage} (max prob delta {delta:.3f})")
+        except Exception as e:
+            with self._lock:
+                self.shadow_errors += 1
+            print(f"Shadow scoring on '{shadow.name}' failed:", str(e))
+        finally:
+            with self._lock:
+                self._shadow_pending -= 1
+            if self.on_shadow is not None:
+                self.on_shadow(result)
+
+    def close(self):
+        self._shadow_executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        active, shadow = self._active, self._shadow
+        compared = self.shadow_compared
+        return {
+            "active": active.name if active else None,
+            "history": list(self._history),
+            "max_versions": self.max_versions,
+            "versions": [v.describe() for v in self._versions.values()],
+            "shadow": {
+                "version": shadow.name if shadow else None,
+                "sample_rate": self.shadow_rate,
+                "compared": compared,
+                "agreement": (self.shadow_agreed / compared) if compared else None,
+                "mean_max_prob_delta": (self.shadow_delta_total / compared) if compared else None,
+                "max_prob_delta": self.shadow_delta_max,
+                "errors": self.shadow_errors,
+                "dropped": self.shadow_dropped,
+                "pending": self._shadow_pending,
+            },
+        }
@@ -1,28 +1,145 @@
 # backend/predict_service.py
 import os
 import io
-import shutil
-import requests
+import json
+import time
+import asyncio
+import dataclasses
+import functools
+import threading
 import numpy as np
-import tensorflow as tf
-import cv2
 
-from typing import Optional
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from fastapi import Depends, FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, HttpUrl
-from PIL import Image
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, HttpUrl, ValidationError
+
+from predict_admission import AdmissionController, DeadlineExceeded, Overloaded, parse_deadline, remaining
+from predict_backends import bucket_sizes, decode_output, load_backend
+from predict_batcher import BatcherStopped, MicroBatcher
+from predict_cache import PredictionCache, model_identity
+from predict_fetch import FetchError, ImageFetcher, ImageTooLargeError
+from predict_inflight import SingleFlight
+from predict_metrics import Metrics, MetricsMiddleware
+from predict_preprocess import InvalidImage, PreprocessOptions, load_rgb, normalize_batch, normalize_into
+from predict_quality import QualityReport, QualityThresholds, UngradableImage
+from predict_registry import ModelRegistry, ModelVersion
+from predict_storage import ImageStore
+from predict_workers import WorkerPool
 
 
 app = FastAPI(title="iCare Model Predict Service")
 
 # Config from env
 MODEL_PATH = os.getenv("ICARE_MODEL_PATH", "without_handling_dataimbalance_nonlinear3.h5")
+# "keras" serves the .h5 through model.predict; "compiled" serves it through traced fixed-shape
+# tf.functions (much less per-call overhead); "tflite" expects ICARE_MODEL_PATH to point at a converted .tflite
+MODEL_BACKEND = os.getenv("ICARE_MODEL_BACKEND", "keras").lower()
+TFLITE_THREADS = int(os.getenv("ICARE_TFLITE_THREADS", "0"))  # 0 = interpreter default
+# TensorFlow thread pools for the keras/compiled backends (0 = TF default, one thread per core).
+# With several uvicorn workers on one box, cap intra-op threads to cores / workers.
+TF_INTRA_OP_THREADS = int(os.getenv("ICARE_TF_INTRA_OP_THREADS", "0"))
+TF_INTER_OP_THREADS = int(os.getenv("ICARE_TF_INTER_OP_THREADS", "0"))
+XLA_ENABLED = os.getenv("ICARE_XLA", "false").lower() in ("1", "true", "yes")  # jit_compile the compiled backend
+# Worker-pool mode: >0 runs inference in that many separate processes (this one only does HTTP + preprocessing)
+WORKER_PROCESSES = int(os.getenv("ICARE_WORKER_PROCESSES", "0"))
+WORKER_THREADS = int(os.getenv("ICARE_WORKER_THREADS", "0"))  # 0 = cores / workers
+WORKER_PIN_CPUS = os.getenv("ICARE_WORKER_PIN_CPUS", "true").lower() in ("1", "true", "yes")
+WORKER_TIMEOUT = float(os.getenv("ICARE_WORKER_TIMEOUT", "60"))
 USE_CLAHE = os.getenv("ICARE_USE_CLAHE", "false").lower() in ("1", "true", "yes")
-MODEL = None
-INPUT_SHAPE = None  # (height, width, channels)
+# Model registry: the startup model is registered under this version name
+MODEL_VERSION = os.getenv("ICARE_MODEL_VERSION") or os.path.splitext(os.path.basename(MODEL_PATH))[0]
+MODEL_MAX_VERSIONS = int(os.getenv("ICARE_MODEL_MAX_VERSIONS", "3"))  # loaded versions kept for rollback/shadow
+SHADOW_MAX_PENDING = int(os.getenv("ICARE_SHADOW_MAX_PENDING", "16"))
+ADMIN_TOKEN = os.getenv("ICARE_ADMIN_TOKEN", "")  # /admin/* is disabled unless set
 UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Uploads are scored from memory; keeping a copy is optional and happens in the background
+UPLOAD_STORE_ENABLED = os.getenv("ICARE_UPLOAD_STORE", "true").lower() in ("1", "true", "yes")
+UPLOAD_STORE_DIR = os.getenv("ICARE_UPLOAD_STORE_DIR", os.path.join(UPLOAD_DIR, "store"))
+UPLOAD_STORE_MAX_MB = float(os.getenv("ICARE_UPLOAD_STORE_MAX_MB", "1024"))
+BATCHING_ENABLED = os.getenv("ICARE_BATCHING", "true").lower() in ("1", "true", "yes")
+BATCH_MAX_SIZE = int(os.getenv("ICARE_BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("ICARE_BATCH_MAX_WAIT_MS", "5"))
+# Warm-up: one dummy inference per batch size before /readyz reports ready.
+# Defaults to single requests plus a full micro-batch; "" disables model warm-up.
+WARMUP_BATCH_SIZES = [int(b) for b in os.getenv(
+    "ICARE_WARMUP_BATCH_SIZES", f"1,{BATCH_MAX_SIZE}" if BATCHING_ENABLED else "1").split(",") if b.strip()]
+WARMUP_RUNS = int(os.getenv("ICARE_WARMUP_RUNS", "1"))
+MODEL_TASK = None  # background load + warm-up of the startup model
+# set at shutdown; a load still running on the CPU pool then closes what it built instead of going "ready"
+SHUTTING_DOWN = threading.Event()
+_LOAD_LOCK = threading.Lock()
+STARTED_AT = time.time()
+READINESS = {
+    "model_loaded": False,
+    "warmed": False,
+    "load_seconds": None,
+    "warmup_seconds": None,
+    "warmup_batch_sizes": {},
+    "error": None,
+}
+# /predict/batch limits
+BATCH_MAX_IMAGES = int(os.getenv("ICARE_BATCH_MAX_IMAGES", "64"))
+BATCH_CHUNK_SIZE = int(os.getenv("ICARE_BATCH_CHUNK_SIZE", "8"))
+BATCH_FETCH_CONCURRENCY = int(os.getenv("ICARE_BATCH_FETCH_CONCURRENCY", "8"))
+# "compiled" backend: batches are padded up to the nearest of these sizes (one traced function each)
+COMPILED_BATCH_BUCKETS = [int(b) for b in os.getenv("ICARE_COMPILED_BATCH_BUCKETS", ",".join(
+    map(str, bucket_sizes(max(BATCH_MAX_SIZE, BATCH_CHUNK_SIZE))))).split(",") if b.strip()]
+# Image fetching / CPU offload
+FETCH_TIMEOUT = float(os.getenv("ICARE_FETCH_TIMEOUT", "30"))
+FETCH_MAX_CONNECTIONS = int(os.getenv("ICARE_FETCH_MAX_CONNECTIONS", "64"))
+FETCH_MAX_KEEPALIVE = int(os.getenv("ICARE_FETCH_MAX_KEEPALIVE", "16"))
+FETCH_PER_HOST_LIMIT = int(os.getenv("ICARE_FETCH_PER_HOST_LIMIT", "8"))
+MAX_IMAGE_BYTES = int(os.getenv("ICARE_MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+# in worker-pool mode each in-flight batch parks one thread while it waits on its process
+CPU_WORKERS = int(os.getenv("ICARE_CPU_WORKERS", str(min(8, os.cpu_count() or 1) + WORKER_PROCESSES)))
+CPU_EXECUTOR = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="icare-cpu")
+FETCHER = ImageFetcher(
+    timeout=FETCH_TIMEOUT,
+    max_connections=FETCH_MAX_CONNECTIONS,
+    max_keepalive=FETCH_MAX_KEEPALIVE,
+    per_host_limit=FETCH_PER_HOST_LIMIT,
+    max_bytes=MAX_IMAGE_BYTES,
+)
+# Prediction cache
+CACHE_ENABLED = os.getenv("ICARE_CACHE", "true").lower() in ("1", "true", "yes")
+CACHE = PredictionCache(
+    max_entries=int(os.getenv("ICARE_CACHE_MAX_ENTRIES", "2048")),
+    ttl_seconds=float(os.getenv("ICARE_CACHE_TTL", "86400")),
+    disk_dir=os.getenv("ICARE_CACHE_DIR") or None,
+) if CACHE_ENABLED else None
+# Quality gate: blurry, badly exposed or non-fundus images get an "ungradable" response (stage -1,
+# gradable=false) instead of a stage. Off by default: clients must check `gradable` before using `stage`.
+# Every QualityThresholds field can be overridden as ICARE_QUALITY_<FIELD>, e.g. ICARE_QUALITY_MIN_SHARPNESS=40.
+QUALITY_GATE_ENABLED = os.getenv("ICARE_QUALITY_GATE", "false").lower() in ("1", "true", "yes")
+QUALITY_THRESHOLDS = QualityThresholds(**{
+    f.name: type(f.default)(os.environ[f"ICARE_QUALITY_{f.name.upper()}"])
+    for f in dataclasses.fields(QualityThresholds) if f"ICARE_QUALITY_{f.name.upper()}" in os.environ
+}) if QUALITY_GATE_ENABLED else None
+# Single-flight: identical concurrent /predict (same URL) and /upload (same bytes) requests share one
+# fetch + inference instead of each running their own
+COALESCE_ENABLED = os.getenv("ICARE_COALESCE", "true").lower() in ("1", "true", "yes")
+# Admission control: at most MAX_CONCURRENT requests run, ADMISSION_QUEUE wait, the rest get 503 + Retry-After.
+# Requests carry a deadline (X-Request-Timeout-Ms / X-Request-Deadline, else ICARE_REQUEST_TIMEOUT_MS);
+# expired work is dropped before fetch and before inference.
+ADMISSION_ENABLED = os.getenv("ICARE_ADMISSION", "true").lower() in ("1", "true", "yes")
+MAX_CONCURRENT = int(os.getenv("ICARE_MAX_CONCURRENT", str(max(2 * BATCH_MAX_SIZE, CPU_WORKERS))))
+ADMISSION_QUEUE = int(os.getenv("ICARE_ADMISSION_QUEUE", "64"))
+REQUEST_TIMEOUT_MS = float(os.getenv("ICARE_REQUEST_TIMEOUT_MS", "30000"))  # 0 = no default deadline
+# Metrics: Prometheus text at /metrics; Server-Timing adds per-stage durations to each response
+METRICS = Metrics(enabled=os.getenv("ICARE_METRICS", "true").lower() in ("1", "true", "yes"))
+SERVER_TIMING = os.getenv("ICARE_SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+ADMISSION = AdmissionController(MAX_CONCURRENT, ADMISSION_QUEUE, on_shed=METRICS.shed_request,
+                                on_change=METRICS.admission) if ADMISSION_ENABLED else None
+REGISTRY = ModelRegistry(max_versions=MODEL_MAX_VERSIONS, shadow_max_pending=SHADOW_MAX_PENDING,
+                         on_shadow=METRICS.shadow)
+INFLIGHT = SingleFlight(on_join=METRICS.coalesced) if COALESCE_ENABLED else None
+LOADING = {}  # version name -> ModelVersion still loading (or failed) via /admin/models
+BACKGROUND_TASKS = set()
+UPLOAD_STORE = ImageStore(UPLOAD_STORE_DIR, max_bytes=int(UPLOAD_STORE_MAX_MB * 1024 * 1024)) if UPLOAD_STORE_ENABLED else None
 
 # Labels & Reports
 STAGE_LABELS = {
@@ -46,119 +163,249 @@ class PredictRequest(BaseModel):
     image_url: HttpUrl
     apply_clahe: Optional[bool] = None
 
+class BatchPredictRequest(BaseModel):
+    image_urls: List[HttpUrl]
+    apply_clahe: Optional[bool] = None
+
 class PredictResponse(BaseModel):
-    stage: int
+    stage: int  # -1 when the image failed the quality gate
     stage_label: str
     probabilities: list
     report: str
     model_input_shape: list
     filename: Optional[str] = None
+    cached: bool = False
+    model_version: Optional[str] = None
+    gradable: bool = True
+    quality: Optional[dict] = None  # quality gate result (reasons, metrics, ms) for ungradable images
+
+class LoadModelRequest(BaseModel):
+    name: str
+    path: str
+    backend: Optional[str] = None  # defaults to ICARE_MODEL_BACKEND
+    activate: bool = False  # switch traffic as soon as it's warmed
+    shadow_sample_rate: Optional[float] = None  # or start shadow scoring it at this rate
+
+class ShadowRequest(BaseModel):
+    sample_rate: float
 
 # Model Loading
-def load_model():
-    global MODEL, INPUT_SHAPE
-    if MODEL is not None:
-        return MODEL
-    if not os.path.exists(MODEL_PATH):
-        raise FileNotFoundError(f"Model file not found at: {MODEL_PATH}")
-    MODEL = tf.keras.models.load_model(MODEL_PATH, compile=False)
-    try:
-        shape = MODEL.input_shape
-        if isinstance(shape, list):
-            shape = shape[0]
-        if len(shape) == 4:
-            _, h, w, c = shape
-        elif len(shape) == 3:
-            h, w, c = shape
-        else:
-            h, w, c = (224, 224, 3)
-        INPUT_SHAPE = (int(h), int(w), int(c))
-    except Exception:
-        INPUT_SHAPE = (224, 224, 3)
-    return MODEL
+def warmup_sizes(kind: str):
+    # every bucket of the compiled backend is its own traced function
+    if kind == "compiled" and WARMUP_BATCH_SIZES:
+        return sorted(set(WARMUP_BATCH_SIZES) | set(COMPILED_BATCH_BUCKETS))
+    return WARMUP_BATCH_SIZES
 
-# Image Processing
-def apply_clahe_to_rgb(image: np.ndarray) -> np.ndarray:
-    lab = cv2.cvtColor(image, cv2.COLOR_RGB2LAB)
-    l, a, b = cv2.split(lab)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    cl = clahe.apply(l)
-    merged = cv2.merge((cl, a, b))
-    final = cv2.cvtColor(merged, cv2.COLOR_LAB2RGB)
-    return final
-
-def preprocess_image_from_path(path: str, target_size):
-    img = Image.open(path).convert("RGB")
-    w, h = img.size
-    min_side = min(w, h)
-    left = (w - min_side) // 2
-    top = (h - min_side) // 2
-    img = img.crop((left, top, left + min_side, top + min_side))
-    target_h, target_w = target_size[0], target_size[1]
-    img = img.resize((target_w, target_h), Image.LANCZOS)
-    arr = np.array(img)
-    if USE_CLAHE:
+def open_model(kind: str, path: str):
+    """A predict_backends backend, or a WorkerPool serving it when ICARE_WORKER_PROCESSES > 0."""
+    options = {"batch_buckets": COMPILED_BATCH_BUCKETS, "jit_compile": XLA_ENABLED} if kind == "compiled" else {}
+    if WORKER_PROCESSES > 0:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Model file not found at: {path}")
+        return WorkerPool(kind, path, WORKER_PROCESSES,
+                          threads_per_worker=WORKER_THREADS, max_batch_size=max(BATCH_MAX_SIZE, BATCH_CHUNK_SIZE),
+                          pin_cpus=WORKER_PIN_CPUS, timeout=WORKER_TIMEOUT,
+                          warmup_batch_sizes=warmup_sizes(kind), backend_options=options).start()
+    if kind == "tflite":
+        return load_backend(kind, path, num_threads=TFLITE_THREADS)
+    return load_backend(kind, path, num_threads=TF_INTRA_OP_THREADS, inter_op_threads=TF_INTER_OP_THREADS,
+                        **options)
+
+def close_model(model):
+    if isinstance(model, WorkerPool):
+        model.close()
+
+def _warmup_image(mv: ModelVersion) -> bytes:
+    # a small JPEG so the decoder (and cv2 when CLAHE is on) get loaded too
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new("RGB", (mv.input_shape[1] * 2, mv.input_shape[0] * 2), (120, 60, 30)).save(buf, format="JPEG")
+    return buf.getvalue()
+
+def warm_up(mv: ModelVersion):
+    """Run dummy inferences at the served batch sizes so the first real request doesn't pay for tracing."""
+    image = _warmup_image(mv)
+    # both paths, so the first CLAHE request doesn't pay for importing cv2
+    for apply_clahe in (False, True):
         try:
-            arr = apply_clahe_to_rgb(arr)
-        except Exception:
-            pass
-    arr = arr.astype("float32") / 255.0
-    batch = np.expand_dims(arr, axis=0)
-    return batch
-
-def preprocess_image_from_url(url: str, target_size):
-    try:
-        response = requests.get(str(url), timeout=30)
-        response.raise_for_status()
-        img = Image.open(io.BytesIO(response.content)).convert("RGB")
-        
-        # Crop to square
-        w, h = img.size
-        min_side = min(w, h)
-        left = (w - min_side) // 2
-        top = (h - min_side) // 2
-        img = img.crop((left, top, left + min_side, top + min_side))
-        
-        # Resize
-        target_h, target_w = target_size[0], target_size[1]
-        img = img.resize((target_w, target_h), Image.LANCZOS)
-        
-        arr = np.array(img)
-        
-        # Apply CLAHE if enabled
-        if USE_CLAHE:
-            try:
-                arr = apply_clahe_to_rgb(arr)
-            except Exception:
-                pass
-        
-        # Normalize
-        arr = arr.astype("float32") / 255.0
-        batch = np.expand_dims(arr, axis=0)
-        return batch
+            load_rgb(image, preprocess_options(mv, apply_clahe))
+        except UngradableImage:
+            pass  # a flat test image never passes the gate; running it is what counts
+    timings = {}
+    if isinstance(mv.model, WorkerPool):
+        return timings  # worker processes warm themselves before reporting ready
+    for size in warmup_sizes(mv.model.kind):
+        batch = np.zeros((size,) + tuple(mv.input_shape), dtype=np.float32)
+        t0 = time.perf_counter()
+        for _ in range(max(1, WARMUP_RUNS)):
+            mv.model.predict(batch)
+        timings[str(size)] = round((time.perf_counter() - t0) * 1000.0, 2)
+    return timings
+
+def load_version(mv: ModelVersion) -> ModelVersion:
+    """Load and warm a model version (blocking; runs on the CPU pool)."""
+    t0 = time.perf_counter()
+    try:
+        mv.model = open_model(mv.backend, mv.path)
+        mv.model_id = model_identity(mv.path)
+        mv.input_shape = mv.model.input_shape
+        mv.load_seconds = round(time.perf_counter() - t0, 3)
+        print(f"Model '{mv.name}' loaded ({mv.model.kind}) in {mv.load_seconds}s. Input shape:", mv.input_shape)
+        t0 = time.perf_counter()
+        mv.warmup_batch_sizes = warm_up(mv)
+        mv.warmup_seconds = round(time.perf_counter() - t0, 3)
+        print(f"Model '{mv.name}' warmed up in {mv.warmup_seconds}s (batch sizes {warmup_sizes(mv.backend)})")
+        with _LOAD_LOCK:
+            # cancelling the awaiting task doesn't stop this thread; nobody would install or close the model
+            if SHUTTING_DOWN.is_set():
+                raise RuntimeError("Service shut down while the model was loading")
+            mv.status = "ready"
     except Exception as e:
-        raise Exception(f"Failed to process image from URL: {str(e)}")
+        mv.status, mv.error = "failed", str(e)
+        if mv.model is not None:
+            close_model(mv.model)
+            mv.model = None
+        print(f"Failed to load model '{mv.name}':", str(e))
+        raise
+    return mv
+
+async def install_version(mv: ModelVersion, activate: bool):
+    """Give a loaded version its batcher and register it; optionally switch traffic to it."""
+    if BATCHING_ENABLED:
+        mv.batcher = MicroBatcher(functools.partial(predict_batch, mv), max_batch_size=BATCH_MAX_SIZE,
+                                  max_wait_ms=BATCH_MAX_WAIT_MS, executor=CPU_EXECUTOR,
+                                  collate=normalize_into, max_in_flight=max(1, WORKER_PROCESSES))
+        mv.batcher.start()
+    for old in REGISTRY.add(mv):
+        await retire_version(old)
+    if activate:
+        activate_version(mv.name)
+
+def activate_version(name: str):
+    previous = REGISTRY.activate(name)
+    mv = REGISTRY.active
+    METRICS.model_loaded(mv.name, mv.model.kind, mv.model_id, mv.load_seconds, mv.warmup_seconds)
+    print(f"Serving model '{mv.name}'" + (f" (was '{previous.name}')" if previous and previous is not mv else ""))
+
+async def retire_version(mv: ModelVersion):
+    """Stop a version that is no longer registered. Requests already holding it finish first."""
+    if mv.batcher is not None:
+        await mv.batcher.stop()
+    await run_cpu(close_model, mv.model)
+    print(f"Unloaded model '{mv.name}'")
+
+async def load_and_install(mv: ModelVersion, activate: bool):
+    """
+    load_version on the CPU pool, then install_version. If shutdown cancels
+    this after the load finished but before the version was registered,
+    its model (and any worker pool) is closed here instead of leaking.
+    """
+    try:
+        await run_cpu(load_version, mv)
+        await install_version(mv, activate=activate)
+    except asyncio.CancelledError:
+        if mv.status == "ready" and REGISTRY.get(mv.name) is not mv:
+            if mv.batcher is not None:
+                await mv.batcher.stop()
+            close_model(mv.model)
+            mv.model, mv.status = None, "failed"
+        raise
+
+async def load_startup_model():
+    mv = ModelVersion(MODEL_VERSION, MODEL_PATH, MODEL_BACKEND)
+    try:
+        await load_and_install(mv, activate=True)
+    except Exception as e:
+        READINESS["error"] = str(e)
+        raise
+    READINESS.update(model_loaded=True, warmed=True, load_seconds=mv.load_seconds,
+                     warmup_seconds=mv.warmup_seconds, warmup_batch_sizes=mv.warmup_batch_sizes)
+
+async def ensure_model() -> ModelVersion:
+    """The active model version, waiting for the startup load if it's still running."""
+    global MODEL_TASK
+    mv = REGISTRY.active
+    if mv is not None:
+        return mv
+    if MODEL_TASK is None:
+        MODEL_TASK = asyncio.ensure_future(load_startup_model())
+    try:
+        # shield: a cancelled request must not cancel the shared load
+        await asyncio.shield(MODEL_TASK)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Model not available: {e}")
+    return REGISTRY.active
+
+# Admission / Deadlines
+async def admit(request: Request):
+    """Deadline and admission slot for one request. Returns (deadline, release)."""
+    deadline = parse_deadline(request.headers, REQUEST_TIMEOUT_MS)
+    if ADMISSION is None:
+        return deadline, (lambda: None)
+    t0 = time.perf_counter()
+    try:
+        release = await ADMISSION.acquire(deadline)
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    METRICS.observe("admission", time.perf_counter() - t0)
+    return deadline, release
+
+def check_deadline(deadline, stage: str):
+    if ADMISSION is not None:
+        ADMISSION.check(deadline, stage)
+    elif deadline is not None and remaining(deadline) <= 0:
+        raise DeadlineExceeded(stage)
+
+async def coalesced(kind: str, key, deadline, fn, *args, **kwargs):
+    """
+    Await `fn(*args, deadline=deadline, **kwargs)`, sharing it with identical requests already in flight.
+
+    Shared work runs with no deadline of its own: each caller stops waiting
+    at its own deadline without cancelling the work for the others, and the
+    work is cancelled once every caller has given up. A request that joins
+    with a longer budget than the one that started the work keeps it.
+    """
+    if INFLIGHT is None:
+        return await fn(*args, deadline=deadline, **kwargs)
+    shared = functools.partial(fn, *args, deadline=None, **kwargs)
+    return await with_deadline(deadline, "coalesced", INFLIGHT.do, kind, key, shared)
+
+async def with_deadline(deadline, stage: str, fn, *args):
+    """Await `fn(*args)`, giving up (and cancelling it) once `deadline` passes."""
+    check_deadline(deadline, stage)
+    if deadline is None:
+        return await fn(*args)
+    try:
+        return await asyncio.wait_for(fn(*args), timeout=remaining(deadline))
+    except asyncio.TimeoutError:
+        if ADMISSION is not None:
+            raise ADMISSION.expire(stage) from None
+        raise DeadlineExceeded(stage) from None
+
+# Image Processing
+def preprocess_options(mv: ModelVersion, apply_clahe: Optional[bool] = None) -> PreprocessOptions:
+    """Resolve per-request options against the service defaults."""
+    if apply_clahe is None:
+        apply_clahe = USE_CLAHE
+    return PreprocessOptions(target_size=(mv.input_shape[0], mv.input_shape[1]), apply_clahe=bool(apply_clahe),
+                             quality=QUALITY_THRESHOLDS)
+
+async def run_cpu(fn, *args, **kwargs):
+    """Run decode/inference work on the bounded CPU pool instead of the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(CPU_EXECUTOR, functools.partial(fn, *args, **kwargs))
 
 # Prediction Logic
-def run_prediction(img_batch, filename=None):
-    preds = MODEL.predict(img_batch)
-    preds = np.asarray(preds).squeeze()
-
-    if preds.ndim == 0:
-        val = float(preds)
-        if val < 0.2: stage = 0
-        elif val < 0.4: stage = 1
-        elif val < 0.6: stage = 2
-        elif val < 0.8: stage = 3
-        else: stage = 4
-        probs = [val]
-    else:
-        if preds.ndim == 1 and preds.shape[0] >= 5:
-            probs = preds.tolist()
-            stage = int(np.argmax(preds))
-        else:
-            probs = preds.tolist()
-            stage = int(np.argmax(preds))
+def predict_batch(mv: ModelVersion, img_batch):
+    t0 = time.perf_counter()
+    preds = mv.model.predict(img_batch)
+    METRICS.batch(len(img_batch), time.perf_counter() - t0)
+    return preds
+
+def build_response(preds, mv: ModelVersion, filename=None):
+    stage, probs = decode_output(preds)
 
     stage_label = STAGE_LABELS.get(stage, "Unknown")
     report_text = HARD_CODED_REPORTS.get(stage, "No report available")
@@ -168,51 +415,553 @@ def run_prediction(img_batch, filename=None):
         stage_label=stage_label,
         probabilities=probs,
         report=report_text,
-        model_input_shape=list(INPUT_SHAPE),
-        filename=filename
+        model_input_shape=list(mv.input_shape),
+        filename=filename,
+        model_version=mv.name
     )
 
-# Startup Event
-@app.on_event("startup")
-def startup_event():
+UNGRADABLE_REPORTS = {
+    "no_fundus": "no retina could be found in the image",
+    "not_fundus_shape": "the image does not look like a fundus photograph",
+    "blurry": "the image is out of focus",
+    "underexposed": "the image is too dark",
+    "overexposed": "the image is overexposed",
+}
+
+def ungradable_response(report: QualityReport, mv: ModelVersion, filename=None):
+    problems = "; ".join(UNGRADABLE_REPORTS.get(r, r) for r in report.reasons)
+    return PredictResponse(
+        stage=-1,
+        stage_label="Ungradable",
+        probabilities=[],
+        report=f"Image quality is insufficient for grading ({problems}). Please retake the fundus photograph.",
+        model_input_shape=list(mv.input_shape),
+        filename=filename,
+        model_version=mv.name,
+        gradable=False,
+        quality=report.describe()
+    )
+
+def run_prediction(mv: ModelVersion, img_batch, filename=None):
+    preds = predict_batch(mv, img_batch)
+    return build_response(preds[0], mv, filename=filename)
+
+def predict_images(mv: ModelVersion, images):
+    """Normalize a list of uint8 RGB images into one batch and score it."""
+    return predict_batch(mv, normalize_batch(images))
+
+async def predict_async(mv: ModelVersion, rgb, filename=None, deadline=None):
+    """Score one uint8 RGB image, coalescing with concurrent requests when batching is on."""
     try:
-        load_model()
-        print("Model loaded. Input shape:", INPUT_SHAPE)
-    except Exception as e:
-        print("Failed to load model:", str(e))
+        if mv.batcher is None:
+            check_deadline(deadline, "inference")
+            with METRICS.stage("inference"):
+                preds = (await run_cpu(predict_images, mv, [rgb]))[0]
+        else:
+            # a request that times out while queued is cancelled, and the batcher skips it
+            timings = {}
+            preds = await with_deadline(deadline, "inference", mv.batcher.submit, rgb, timings)
+            METRICS.observe_all(timings)
+    except DeadlineExceeded:
+        raise
+    except BatcherStopped:
+        # the version was retired (hot swap / eviction) while this request held it
+        raise HTTPException(status_code=503, detail=f"Model version '{mv.name}' was unloaded; retry",
+                            headers={"Retry-After": "1"})
+    except Exception:
+        METRICS.error("inference")
+        raise
+    return build_response(preds, mv, filename=filename)
+
+async def load_rgb_async(data: bytes, options: PreprocessOptions):
+    """Decode/resize/quality gate/CLAHE on the CPU pool, recording per-stage timings."""
+    timings = {}
+    try:
+        rgb = await run_cpu(load_rgb, data, options, timings)
+    except UngradableImage as e:
+        METRICS.observe_all(timings)
+        METRICS.ungradable(e.report.reasons)
+        raise
+    except InvalidImage:
+        # the client sent something that isn't an image; not a service failure
+        raise
+    except Exception:
+        METRICS.error("decode")
         raise
+    METRICS.observe_all(timings)
+    return rgb
+
+# Prediction Cache
+def content_key(mv: ModelVersion, data: bytes, options: PreprocessOptions):
+    """Digest of the image bytes, preprocessing options and model; identical inputs give identical results."""
+    return PredictionCache.make_key(data, mv.model_id, clahe=options.apply_clahe, input_shape=mv.input_shape,
+                                    quality=options.quality)
+
+def cache_key(mv: ModelVersion, data: bytes, options: PreprocessOptions):
+    if CACHE is None:
+        return None
+    return content_key(mv, data, options)
+
+async def cache_lookup(key, filename=None):
+    if key is None:
+        return None
+    # the disk tier does file I/O, keep it off the event loop
+    hit = await run_cpu(CACHE.get, key) if CACHE.disk_dir else CACHE.get(key)
+    METRICS.cache_lookup(hit is not None)
+    if hit is None:
+        return None
+    hit.update(filename=filename, cached=True)
+    return PredictResponse(**hit)
+
+async def cache_store(key, resp: PredictResponse):
+    if key is None:
+        return
+    value = resp.dict(exclude={"filename", "cached"})
+    if CACHE.disk_dir:
+        await run_cpu(CACHE.put, key, value)
+    else:
+        CACHE.put(key, value)
+
+def store_upload(data: bytes, filename=None):
+    """Queue an upload for the content-addressed store, without waiting on the disk. Only for bytes that decoded."""
+    if UPLOAD_STORE is not None:
+        UPLOAD_STORE.submit(data, filename)
+
+async def score_image_bytes(mv: ModelVersion, data: bytes, options: PreprocessOptions, filename=None,
+                            deadline=None, digest=None, keep_upload=False):
+    """
+    Cache lookup, then preprocess + predict on a miss. `digest` is content_key() if already computed.
+    With `keep_upload`, the bytes go to the upload store once they are known to be an image.
+    """
+    key = None if CACHE is None else (digest or content_key(mv, data, options))
+    hit = await cache_lookup(key, filename)
+    if hit is not None:
+        # only decodable images are ever cached
+        if keep_upload:
+            store_upload(data, filename)
+        return hit
+    check_deadline(deadline, "inference")
+    try:
+        rgb = await load_rgb_async(data, options)
+    except UngradableImage as e:
+        if keep_upload:
+            store_upload(data, filename)
+        # short-circuit: no inference (or shadow scoring) for images the gate rejects
+        resp = ungradable_response(e.report, mv, filename=filename)
+        await cache_store(key, resp)
+        return resp
+    if keep_upload:
+        store_upload(data, filename)
+    resp = await predict_async(mv, rgb, filename=filename, deadline=deadline)
+    REGISTRY.maybe_shadow(data, rgb, options.apply_clahe, resp.probabilities)
+    await cache_store(key, resp)
+    return resp
+
+async def score_url(mv: ModelVersion, url: str, options: PreprocessOptions, deadline=None):
+    with METRICS.stage("fetch"):
+        data = await with_deadline(deadline, "fetch", FETCHER.fetch, url)
+    return await score_image_bytes(mv, data, options, deadline=deadline)
+
+# Startup Event
+@app.on_event("startup")
+async def startup_event():
+    global MODEL_TASK
+    # load in the background so /healthz answers while the model is still coming up
+    MODEL_TASK = asyncio.ensure_future(load_startup_model())
+    MODEL_TASK.add_done_callback(lambda t: t.cancelled() or t.exception())
+    if BATCHING_ENABLED:
+        print(f"Micro-batching enabled (max_batch_size={BATCH_MAX_SIZE}, max_wait_ms={BATCH_MAX_WAIT_MS})")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    with _LOAD_LOCK:
+        SHUTTING_DOWN.set()
+    loads = [t for t in [MODEL_TASK, *BACKGROUND_TASKS] if t is not None and not t.done()]
+    for task in loads:
+        task.cancel()
+    # let their cancellation handlers close versions that loaded but never got registered
+    await asyncio.gather(*loads, return_exceptions=True)
+    if INFLIGHT is not None:
+        INFLIGHT.cancel_all()
+    REGISTRY.close()
+    for mv in REGISTRY.versions():
+        if mv.batcher is not None:
+            await mv.batcher.stop()
+    await FETCHER.aclose()
+    for mv in REGISTRY.versions():
+        close_model(mv.model)
+    if UPLOAD_STORE is not None:
+        UPLOAD_STORE.close()  # flush queued writes
+    METRICS.process_exit()
+    CPU_EXECUTOR.shutdown(wait=False)
 
 # Routes
 @app.post("/predict", response_model=PredictResponse)
-def predict(req: PredictRequest):
-    try:
-        if req.apply_clahe is not None:
-            global USE_CLAHE
-            USE_CLAHE = bool(req.apply_clahe)
-        if INPUT_SHAPE is None:
-            load_model()
-        img_batch = preprocess_image_from_url(req.image_url, INPUT_SHAPE)
-        return run_prediction(img_batch)
-    except requests.exceptions.RequestException as e:
+async def predict(req: PredictRequest, request: Request):
+    deadline, release = await admit(request)
+    try:
+        mv = await ensure_model()
+        url, options = str(req.image_url), preprocess_options(mv, req.apply_clahe)
+        return await coalesced("url", (url, mv.name, options), deadline, score_url, mv, url, options)
+    except HTTPException:
+        raise
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ImageTooLargeError as e:
+        METRICS.error("too_large")
+        raise HTTPException(status_code=413, detail=f"Failed to fetch image: {str(e)}")
+    except FetchError as e:
+        METRICS.error("fetch")
         raise HTTPException(status_code=502, detail=f"Failed to fetch image: {str(e)}")
+    except InvalidImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+    finally:
+        release()
 
 @app.post("/upload", response_model=PredictResponse)
-async def upload_and_predict(file: UploadFile = File(...)):
-    try:
-        # Save file
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        # Predict immediately
-        if INPUT_SHAPE is None:
-            load_model()
-        img_batch = preprocess_image_from_path(file_path, INPUT_SHAPE)
-        return run_prediction(img_batch, filename=file.filename)
+async def upload_and_predict(request: Request, file: UploadFile = File(...)):
+    deadline, release = await admit(request)
+    try:
+        # same cap as fetched URLs; read one byte past it to tell "exactly at" from "over"
+        data = await file.read(MAX_IMAGE_BYTES + 1)
+        if len(data) > MAX_IMAGE_BYTES:
+            METRICS.error("too_large")
+            raise HTTPException(status_code=413, detail=f"Uploaded image exceeds {MAX_IMAGE_BYTES} bytes")
+
+        # Predict straight from memory; a deduplicated copy is kept once the bytes decode
+        mv = await ensure_model()
+        options = preprocess_options(mv)
+        if INFLIGHT is None:
+            return await score_image_bytes(mv, data, options, filename=file.filename, deadline=deadline,
+                                           keep_upload=True)
+        digest = content_key(mv, data, options)
+        resp = await coalesced("upload", digest, deadline, score_image_bytes, mv, data, options,
+                               filename=file.filename, digest=digest, keep_upload=True)
+        # a shared result carries the filename of the request that started it
+        return resp if resp.filename == file.filename else resp.copy(update={"filename": file.filename})
+    except HTTPException:
+        raise
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except InvalidImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"File upload/predict failed: {e}")
+    finally:
+        release()
+
+async def _stream_batch(mv: ModelVersion, sources, loader, options: PreprocessOptions,
+                        deadline=None, release=None):
+    """
+    Preprocess `sources` concurrently and yield one NDJSON line per image.
+
+    `loader(source)` is a coroutine returning the raw image bytes. Cache hits are
+    written immediately; the rest are scored in chunks of BATCH_CHUNK_SIZE and
+    each result is written as soon as its chunk is done. Images still unscored
+    when `deadline` passes get an error line instead. `release` frees the
+    request's admission slot when the stream ends.
+    """
+    sem = asyncio.Semaphore(BATCH_FETCH_CONCURRENCY)
+
+    def filename_of(index):
+        return sources[index]["label"] if sources[index]["kind"] == "filename" else None
+
+    async def load(index, source):
+        async with sem:
+            try:
+                data = await with_deadline(deadline, "fetch", loader, source)
+            except DeadlineExceeded as e:
+                return index, None, None, e
+            except ImageTooLargeError as e:
+                METRICS.error("too_large")
+                return index, None, None, e
+            except FetchError as e:
+                METRICS.error("fetch")
+                return index, None, None, e
+            # uploaded files are kept once they're known to be images (cached, or decoded here)
+            upload = sources[index]["kind"] == "filename"
+            try:
+                key = cache_key(mv, data, options)
+                hit = await cache_lookup(key, filename_of(index))
+                if hit is not None:
+                    if upload:
+                        store_upload(data, filename_of(index))
+                    return index, hit, key, None
+                rgb = await load_rgb_async(data, options)
+                if upload:
+                    store_upload(data, filename_of(index))
+                return index, rgb, key, None
+            except UngradableImage as e:
+                if upload:
+                    store_upload(data, filename_of(index))
+                resp = ungradable_response(e.report, mv, filename=filename_of(index))
+                await cache_store(key, resp)
+                return index, resp, key, None
+            except Exception as e:
+                return index, None, None, e
+
+    def line(payload):
+        return json.dumps(payload) + "\n"
+
+    def describe(index):
+        label = sources[index]["label"]
+        return {"index": index, sources[index]["kind"]: label}
+
+    tasks = [asyncio.ensure_future(load(i, src["value"])) for i, src in enumerate(sources)]
+    pending = []
+
+    async def flush():
+        indexes = [i for i, _, _ in pending]
+        keys = [k for _, _, k in pending]
+        images = [img for _, img, _ in pending]
+        pending.clear()
+        try:
+            check_deadline(deadline, "inference")
+        except DeadlineExceeded as e:
+            return [line({**describe(i), "error": str(e)}) for i in indexes]
+        try:
+            preds = await run_cpu(predict_images, mv, images)
+        except Exception as e:
+            METRICS.error("inference")
+            return [line({**describe(i), "error": f"Prediction error: {e}"}) for i in indexes]
+        out = []
+        for row, i, key in zip(preds, indexes, keys):
+            resp = build_response(row, mv, filename=filename_of(i))
+            await cache_store(key, resp)
+            out.append(line({**describe(i), **resp.dict()}))
+        return out
+
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, result, key, err = await next_done
+            if err is not None:
+                yield line({**describe(index), "error": f"Failed to process image: {err}"})
+                continue
+            if isinstance(result, PredictResponse):
+                yield line({**describe(index), **result.dict()})
+                continue
+            pending.append((index, result, key))
+            if len(pending) >= BATCH_CHUNK_SIZE:
+                for out in await flush():
+                    yield out
+        if pending:
+            for out in await flush():
+                yield out
+    finally:
+        # client went away or we finished; don't leave fetches running
+        for t in tasks:
+            t.cancel()
+        if release is not None:
+            release()
+
+@app.post("/predict/batch")
+async def predict_batch_stream(request: Request):
+    """
+    Score a screening session in one call.
+
+    Accepts either JSON `{"image_urls": [...], "apply_clahe": bool}` or a multipart
+    form with repeated `files` fields. Responds with newline-delimited JSON, one
+    PredictResponse per image (plus its `index`), in completion order.
+    """
+    deadline, release = await admit(request)
+    try:
+        return await _start_batch(request, deadline, release)
+    except BaseException:
+        release()
+        raise
+
+async def _start_batch(request: Request, deadline, release):
+    mv = await ensure_model()
+
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        uploads = [f for f in form.getlist("files") if hasattr(f, "read")]
+        apply_clahe = form.get("apply_clahe")
+        apply_clahe = None if apply_clahe is None else str(apply_clahe).lower() in ("1", "true", "yes")
+        sources = []
+        for f in uploads:
+            data = await f.read(MAX_IMAGE_BYTES + 1)
+            if len(data) > MAX_IMAGE_BYTES:
+                data = None  # reported on its own line, like an oversized URL
+            sources.append({"kind": "filename", "label": f.filename, "value": data})
+
+        async def loader(data):
+            if data is None:
+                raise ImageTooLargeError(f"Image exceeds {MAX_IMAGE_BYTES} bytes")
+            return data
+    else:
+        try:
+            req = BatchPredictRequest.parse_obj(await request.json())
+        except (ValueError, ValidationError) as e:
+            raise HTTPException(status_code=422, detail=f"Invalid batch request: {e}")
+        sources = [{"kind": "image_url", "label": str(u), "value": u} for u in req.image_urls]
+        apply_clahe = req.apply_clahe
+        loader = FETCHER.fetch
+
+    if not sources:
+        raise HTTPException(status_code=400, detail="No images supplied")
+    if len(sources) > BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=413, detail=f"Too many images (max {BATCH_MAX_IMAGES})")
+
+    # release() is idempotent; the background task covers a stream that never starts
+    return StreamingResponse(_stream_batch(mv, sources, loader, preprocess_options(mv, apply_clahe),
+                                           deadline=deadline, release=release),
+                             media_type="application/x-ndjson", background=BackgroundTask(release))
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving HTTP, whether or not the model is ready."""
+    return {"status": "ok", "uptime_seconds": round(time.time() - STARTED_AT, 3)}
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: the model is loaded and warmed up. 503 until then (or if loading failed)."""
+    mv = REGISTRY.active
+    ready = mv is not None
+    body = {
+        "status": "ready" if ready else ("failed" if READINESS["error"] else "loading"),
+        "model_version": mv.name if mv else None,
+        "backend": mv.model.kind if mv else MODEL_BACKEND,
+        "model_input_shape": list(mv.input_shape) if mv else None,
+        "uptime_seconds": round(time.time() - STARTED_AT, 3),
+        **READINESS,
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition (aggregated across processes when PROMETHEUS_MULTIPROC_DIR is set)."""
+    if not METRICS.enabled:
+        raise HTTPException(status_code=503, detail="Metrics disabled (ICARE_METRICS=false or prometheus_client not installed)")
+    body, content_type = METRICS.render()
+    return Response(content=body, headers={"Content-Type": content_type})
+
+@app.get("/stats/admission")
+def admission_stats():
+    if ADMISSION is None:
+        return {"enabled": False}
+    return {"enabled": True, "default_timeout_ms": REQUEST_TIMEOUT_MS, **ADMISSION.stats()}
+
+@app.get("/stats/inflight")
+def inflight_stats():
+    if INFLIGHT is None:
+        return {"enabled": False}
+    return {"enabled": True, **INFLIGHT.stats()}
+
+@app.get("/stats/batcher")
+def batcher_stats():
+    mv = REGISTRY.active
+    if mv is None or mv.batcher is None:
+        return {"enabled": False}
+    return {"enabled": True, "model_version": mv.name, **mv.batcher.stats()}
+
+@app.get("/stats/workers")
+def worker_stats():
+    mv = REGISTRY.active
+    if mv is None or not isinstance(mv.model, WorkerPool):
+        return {"enabled": False}
+    return {"enabled": True, "model_version": mv.name, **mv.model.stats()}
+
+@app.get("/stats/cache")
+def cache_stats():
+    if CACHE is None:
+        return {"enabled": False}
+    mv = REGISTRY.active
+    return {"enabled": True, "model_id": mv.model_id if mv else None, **CACHE.stats()}
+
+@app.get("/stats/uploads")
+def upload_store_stats():
+    if UPLOAD_STORE is None:
+        return {"enabled": False}
+    return {"enabled": True, **UPLOAD_STORE.stats()}
+
+# Model admin
+def require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API disabled (set ICARE_ADMIN_TOKEN)")
+    if request.headers.get("x-admin-token") != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+def _admin_error(e: Exception):
+    if isinstance(e, KeyError):
+        return HTTPException(status_code=404, detail=str(e.args[0]) if e.args else str(e))
+    if isinstance(e, LookupError):
+        return HTTPException(status_code=409, detail=str(e))
+    return HTTPException(status_code=400, detail=str(e))
+
+async def _load_in_background(mv: ModelVersion, req: LoadModelRequest):
+    try:
+        await load_and_install(mv, activate=req.activate)
+        if req.shadow_sample_rate is not None and not req.activate:
+            REGISTRY.set_shadow(mv.name, req.shadow_sample_rate)
+        LOADING.pop(mv.name, None)
+    except Exception as e:
+        # keep the failed entry so GET /admin/models shows why
+        mv.status, mv.error = "failed", mv.error or str(e)
+
+@app.get("/admin/models", dependencies=[Depends(require_admin)])
+def list_models():
+    return {**REGISTRY.stats(), "loading": [mv.describe() for mv in LOADING.values()]}
+
+@app.post("/admin/models", status_code=202, dependencies=[Depends(require_admin)])
+async def load_model_version(req: LoadModelRequest):
+    """Load and warm a new version in the background; poll GET /admin/models for its status."""
+    loading = LOADING.get(req.name)
+    if REGISTRY.get(req.name) is not None or (loading is not None and loading.status == "loading"):
+        raise HTTPException(status_code=409, detail=f"Model version '{req.name}' already exists")
+    mv = ModelVersion(req.name, req.path, (req.backend or MODEL_BACKEND).lower())
+    LOADING[req.name] = mv
+    task = asyncio.ensure_future(_load_in_background(mv, req))
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
+    return mv.describe()
+
+@app.post("/admin/models/rollback", dependencies=[Depends(require_admin)])
+def rollback_model():
+    try:
+        mv = REGISTRY.rollback()
+    except LookupError as e:
+        raise _admin_error(e)
+    METRICS.model_loaded(mv.name, mv.model.kind, mv.model_id, mv.load_seconds, mv.warmup_seconds)
+    print(f"Rolled back to model '{mv.name}'")
+    return REGISTRY.stats()
+
+@app.post("/admin/models/{name}/activate", dependencies=[Depends(require_admin)])
+def activate_model(name: str):
+    try:
+        activate_version(name)
+    except (KeyError, ValueError) as e:
+        raise _admin_error(e)
+    return REGISTRY.stats()
+
+@app.put("/admin/models/{name}/shadow", dependencies=[Depends(require_admin)])
+def shadow_model(name: str, req: ShadowRequest):
+    try:
+        REGISTRY.set_shadow(name, req.sample_rate)
+    except (KeyError, ValueError) as e:
+        raise _admin_error(e)
+    return REGISTRY.stats()["shadow"]
+
+@app.delete("/admin/models/shadow", dependencies=[Depends(require_admin)])
+def stop_shadow():
+    REGISTRY.clear_shadow()
+    return REGISTRY.stats()["shadow"]
+
+@app.delete("/admin/models/{name}", dependencies=[Depends(require_admin)])
+async def unload_model(name: str):
+    try:
+        mv = REGISTRY.remove(name)
+    except (KeyError, ValueError) as e:
+        raise _admin_error(e)
+    await retire_version(mv)
+    return REGISTRY.stats()
+
+# Metrics middleware (request counts, in-flight gauges, Server-Timing)
+app.add_middleware(MetricsMiddleware, metrics=METRICS,
+                   paths=("/predict", "/upload", "/predict/batch"), server_timing=SERVER_TIMING)
 
 # CORS setup
 app.add_middleware(
@@ -0,0 +1,147 @@
+# backend/predict_storage.py
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+
+
+def image_extension(filename: Optional[str]) -> str:
+    """Lower-cased extension of an uploaded filename, or "" if it isn't a known image type."""
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if ext in IMAGE_EXTS else ""
+
+
+class ImageStore:
+    """
+    Content-addressed, size-capped store for uploaded images.
+
+    Files are named by the SHA-256 of their bytes (`<root>/<hh>/<digest><ext>`),
+    so re-uploads of the same image are written once and same-named uploads from
+    different users can't overwrite each other. When the store grows past
+    `max_bytes`, least-recently-stored/seen files are evicted. Writes happen on
+    a single background thread; `submit()` never blocks the caller on disk I/O.
+    """
+
+    def __init__(self, root: str, max_bytes: int = 1024 * 1024 * 1024, max_pending: int = 64):
+        self.root = root
+        self.max_bytes = max(0, int(max_bytes))
+        self.max_pending = max(1, int(max_pending))
+        self._files: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()  # digest -> (path, size), LRU order
+        self._bytes = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="icare-store")
+        self.writes = 0
+        self.duplicates = 0
+        self.dropped = 0
+        self.evictions = 0
+        os.makedirs(root, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        # rebuild the LRU index from disk, oldest mtime first
+        found = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, os.path.splitext(name)[0], path, st.st_size))
+        for _, digest, path, size in sorted(found):
+            self._files[digest] = (path, size)
+            self._bytes += size
+
+    def _path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest}{ext}")
+
+    def submit(self, data: bytes, filename: Optional[str] = None) -> bool:
+        """Queue `data` for background persistence. Returns False if the write queue is full."""
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            token = object()
+            self._pending.add(token)
+        self._executor.submit(self._put_pending, token, data, image_extension(filename))
+        return True
+
+    def _put_pending(self, token, data: bytes, ext: str):
+        try:
+            self.put(data, ext)
+        except Exception as e:
+            print("Upload store write failed:", str(e))
+        finally:
+            with self._lock:
+                self._pending.discard(token)
+
+    def put(self, data: bytes, ext: str = "") -> str:
+        """Store `data` synchronously and return its digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            known = self._files.get(digest)
+            if known is not None:
+                self._files.move_to_end(digest)
+                self.duplicates += 1
+        if known is not None:
+            try:
+                os.utime(known[0])  # keep the on-disk order in step for the next _scan
+            except OSError:
+                pass
+            return digest
+
+        path = self._path(digest, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._files[digest] = (path, len(data))
+            self._bytes += len(data)
+            self.writes += 1
+            victims = self._evict()
+        for victim in victims:
+            try:
+                os.remove(victim)
+            except OSError:
+                pass
+        return digest
+
+    def _evict(self):
+        # caller holds the lock; never evicts the entry that was just added
+        victims = []
+        while self.max_bytes and self._bytes > self.max_bytes and len(self._files) > 1:
+            _, (path, size) = self._files.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            victims.append(path)
+        return victims
+
+    def path_for(self, digest: str) -> Optional[str]:
+        with self._lock:
+            entry = self._files.get(digest)
+        return entry[0] if entry else None
+
+    def close(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def stats(self) -> dict:
+        return {
+            "root": self.root,
+            "files": len(self._files),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "pending": len(self._pending),
+            "writes": self.writes,
+            "duplicates": self.duplicates,
+            "dropped": self.dropped,
+            "evictions": self.evictions,
+        }
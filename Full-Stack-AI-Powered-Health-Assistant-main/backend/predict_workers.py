@@ -0,0 +1,253 @@
+# backend/predict_workers.py
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import List, Optional
+
+import numpy as np
+
+
+def _pin_threads(threads: int, cpus: Optional[List[int]]):
+    # must run before TensorFlow is imported in the worker
+    for var in ("OMP_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"):
+        os.environ[var] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    if cpus and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError:
+            pass
+
+
+def _worker_main(index: int, kind: str, model_path: str, threads: int, cpus, warmup_sizes, options, conn):
+    """Inference worker: owns one model, reads batches from shared memory."""
+    _pin_threads(threads, cpus)
+    try:
+        from predict_backends import load_backend
+        # TF backends: `threads` intra-op threads, a single inter-op thread
+        backend = load_backend(kind, model_path, num_threads=threads, inter_op_threads=1, **(options or {}))
+        # trace/allocate for the batch sizes we serve before reporting ready
+        for size in warmup_sizes or ():
+            backend.predict(np.zeros((size,) + tuple(backend.input_shape), dtype=np.float32))
+    except Exception as e:
+        conn.send(("failed", f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("ready", backend.input_shape))
+
+    shm = None
+    inputs = None
+    try:
+        while True:
+            msg = conn.recv()
+            if msg is None:
+                break
+            if msg[0] == "attach":
+                _, name, max_batch = msg
+                shm = shared_memory.SharedMemory(name=name)
+                inputs = np.ndarray((max_batch,) + tuple(backend.input_shape), dtype=np.float32, buffer=shm.buf)
+            elif msg[0] == "predict":
+                n = msg[1]
+                try:
+                    conn.send(("ok", np.asarray(backend.predict(inputs[:n]), dtype=np.float32)))
+                except Exception as e:
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        inputs = None
+        if shm is not None:
+            shm.close()
+
+
+class _Worker:
+    def __init__(self, index: int, cpus):
+        self.index = index
+        self.cpus = cpus
+        self.proc = None
+        self.conn = None
+        self.shm = None
+        self.inputs = None
+        self.lock = threading.Lock()
+        self.jobs = 0
+        self.restarts = 0
+
+
+class WorkerPool:
+    """
+    Run inference in N separate processes, each owning one model copy.
+
+    The front process keeps HTTP handling and preprocessing; batches are written
+    into a per-worker shared-memory block (no pickling of image tensors) and
+    only the small output array comes back over the pipe. Each worker's
+    intra-op threads are capped (and optionally pinned to its own cores) so N
+    workers don't oversubscribe the box. Dead or hung workers are replaced.
+
+    Exposes the same `predict(batch)` / `input_shape` / `kind` surface as the
+    backends in predict_backends, so the service can use it as MODEL.
+    """
+
+    kind = "workers"
+
+    def __init__(self, backend_kind: str, model_path: str, num_workers: int,
+                 threads_per_worker: int = 0, max_batch_size: int = 8,
+                 pin_cpus: bool = True, timeout: float = 60.0, start_timeout: float = 300.0,
+                 warmup_batch_sizes=(), backend_options=None):
+        self.backend_kind = backend_kind
+        self.path = model_path
+        self.num_workers = max(1, int(num_workers))
+        available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+        self.threads = int(threads_per_worker) or max(1, len(available) // self.num_workers)
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.warmup_batch_sizes = tuple(b for b in warmup_batch_sizes if 0 < b <= self.max_batch_size)
+        self.backend_options = dict(backend_options or {})  # extra load_backend() kwargs
+        self.input_shape = None
+        self._ctx = mp.get_context("spawn")  # TensorFlow is not fork-safe
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._closed = False
+
+        can_pin = pin_cpus and len(available) >= self.num_workers * self.threads
+        self.workers = [
+            _Worker(i, available[i * self.threads:(i + 1) * self.threads] if can_pin else None)
+            for i in range(self.num_workers)
+        ]
+        self._monitor = None
+
+    # lifecycle
+    def start(self):
+        for w in self.workers:
+            self._spawn(w)
+            self._idle.put(w)
+        self._monitor = threading.Thread(target=self._watch, name="icare-worker-monitor", daemon=True)
+        self._monitor.start()
+        return self
+
+    def _spawn(self, w: _Worker):
+        parent, child = self._ctx.Pipe()
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(w.index, self.backend_kind, self.path, self.threads, w.cpus, self.warmup_batch_sizes,
+                  self.backend_options, child),
+            name=f"icare-infer-{w.index}",
+            daemon=True,
+        )
+        proc.start()
+        child.close()
+        if not parent.poll(self.start_timeout):
+            proc.kill()
+            raise RuntimeError(f"Inference worker {w.index} did not start within {self.start_timeout}s")
+        msg = parent.recv()
+        if msg[0] != "ready":
+            proc.join(5)
+            raise RuntimeError(f"Inference worker {w.index} failed to load model: {msg[1]}")
+        shape = tuple(msg[1])
+        if self.input_shape is None:
+            self.input_shape = shape
+        if w.shm is None:
+            size = int(self.max_batch_size * np.prod(shape)) * 4
+            w.shm = shared_memory.SharedMemory(create=True, size=size)
+            w.inputs = np.ndarray((self.max_batch_size,) + shape, dtype=np.float32, buffer=w.shm.buf)
+        parent.send(("attach", w.shm.name, self.max_batch_size))
+        w.proc, w.conn = proc, parent
+
+    def _restart(self, w: _Worker, reason: str):
+        print(f"Restarting inference worker {w.index}: {reason}")
+        if w.proc is not None and w.proc.is_alive():
+            w.proc.kill()
+        if w.proc is not None:
+            w.proc.join(5)
+        if w.conn is not None:
+            w.conn.close()
+        w.restarts += 1
+        self._spawn(w)
+
+    def _watch(self):
+        # replace workers that died while idle, so capacity comes back without a failed request
+        while not self._closed:
+            time.sleep(1.0)
+            for w in self.workers:
+                if self._closed:
+                    return
+                if w.proc is not None and not w.proc.is_alive() and w.lock.acquire(blocking=False):
+                    try:
+                        if not self._closed and not w.proc.is_alive():
+                            self._restart(w, f"exit code {w.proc.exitcode}")
+                    except Exception as e:
+                        print("Worker restart failed:", str(e))
+                    finally:
+                        w.lock.release()
+
+    def close(self):
+        self._closed = True
+        for w in self.workers:
+            with w.lock:
+                try:
+                    if w.conn is not None:
+                        w.conn.send(None)
+                except (OSError, BrokenPipeError):
+                    pass
+                if w.proc is not None:
+                    w.proc.join(5)
+                    if w.proc.is_alive():
+                        w.proc.kill()
+                w.inputs = None
+                if w.shm is not None:
+                    w.shm.close()
+                    w.shm.unlink()
+                    w.shm = None
+
+    # inference
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        batch = np.asarray(batch, dtype=np.float32)
+        if batch.shape[0] > self.max_batch_size:
+            return np.concatenate([self.predict(batch[i:i + self.max_batch_size])
+                                   for i in range(0, batch.shape[0], self.max_batch_size)], axis=0)
+        w = self._idle.get()
+        try:
+            with w.lock:
+                return self._run_on(w, batch)
+        finally:
+            self._idle.put(w)
+
+    def _run_on(self, w: _Worker, batch: np.ndarray) -> np.ndarray:
+        if self._closed:
+            raise RuntimeError("Worker pool is closed")
+        if not w.proc.is_alive():
+            self._restart(w, f"exit code {w.proc.exitcode}")
+        n = batch.shape[0]
+        np.copyto(w.inputs[:n], batch)
+        try:
+            w.conn.send(("predict", n))
+            if not w.conn.poll(self.timeout):
+                self._restart(w, f"no reply within {self.timeout}s")
+                raise RuntimeError(f"Inference worker {w.index} timed out")
+            status, payload = w.conn.recv()
+        except (EOFError, OSError, BrokenPipeError):
+            self._restart(w, "crashed during inference")
+            raise RuntimeError(f"Inference worker {w.index} crashed")
+        if status != "ok":
+            raise RuntimeError(f"Inference worker {w.index}: {payload}")
+        w.jobs += 1
+        return payload
+
+    def stats(self) -> dict:
+        return {
+            "workers": [
+                {
+                    "index": w.index,
+                    "pid": w.proc.pid if w.proc is not None else None,
+                    "alive": bool(w.proc is not None and w.proc.is_alive()),
+                    "cpus": w.cpus,
+                    "jobs": w.jobs,
+                    "restarts": w.restarts,
+                }
+                for w in self.workers
+            ],
+            "threads_per_worker": self.threads,
+            "max_batch_size": self.max_batch_size,
+            "idle": self._idle.qsize(),
+        }
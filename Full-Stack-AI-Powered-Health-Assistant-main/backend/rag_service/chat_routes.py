@@ -1,16 +1,21 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from typing import Optional, List
 from auth import get_current_user
 from models import ChatRequest, ChatResponse, IngestURLRequest
 from db import chats_col, messages_col, documents_col, delete_chat_and_messages
 from ingest import ingest_url, ingest_pdf_bytes
-from vectorstore_mongo import search_similar_local
+from vectorstore_mongo import (search_similar, delete_document_chunks, run_blocking, index_models,
+                               active_embedding_model, INDEX)
+from embeddings import embed_query, get_cache
 from config import GOOGLE_GENAI_MODEL, TOP_K
 from bson import ObjectId
 from google import genai
 from datetime import datetime, timedelta
 import html as html_escape
+import asyncio
+import json
+import threading
 import secrets
 import config
 import pytz
@@ -20,26 +25,9 @@ import re
 
 router = APIRouter()
 
-# Add this function at the top of chat_routes.py
 async def get_embedding(text: str):
-    try:
-        # Import genai directly, not the client
-        import google.generativeai as genai
-        from config import GOOGLE_GENAI_API_KEY
-        
-        # Configure genai with API key
-        genai.configure(api_key=GOOGLE_GENAI_API_KEY)
-        
-        # Generate embedding using the correct API
-        result = genai.embed_content(
-            model="models/embedding-001",
-            content=text
-        )
-        return result['embedding']
-    except Exception as e:
-        print(f"Embedding error: {e}")
-        # Return a zero vector as fallback
-        return [0.0] * 768
+    # raises on failure: a made-up vector would "retrieve" arbitrary chunks
+    return await embed_query(text)
 
 
 def get_client_time(timezone_str: str = 'UTC'):
@@ -107,6 +95,23 @@ async def get_document(doc_id: str, user=Depends(get_current_user)):
         raise HTTPException(status_code=404, detail="Document not found")
     return doc
 
+# Authenticated: embedding cache hit rates
+@router.get("/stats/embedding-cache")
+async def embedding_cache_stats(user=Depends(get_current_user)):
+    return get_cache().stats()
+
+# Authenticated: vector index state, including embedding models present in the collection
+@router.get("/stats/vector-index")
+async def vector_index_stats(user=Depends(get_current_user)):
+    models = await run_blocking(index_models)
+    active = active_embedding_model()
+    return {
+        "index": INDEX.stats(),
+        "active_model": active,
+        "models": models,
+        "mixed": any(m != active for m in models),
+    }
+
 # Admin-only: delete document (metadata + vectors)
 @router.delete("/documents/{doc_id}")
 async def delete_document(doc_id: str, user=Depends(get_current_user)):
@@ -114,99 +119,93 @@ async def delete_document(doc_id: str, user=Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Admin privileges required to delete documents.")
     # remove metadata from Mongo
     delete_result = await documents_col.delete_one({"_id": doc_id})
-    # try to remove points from Qdrant / vectorstore
+    # remove its chunks from Mongo and the in-memory search index
     try:
-        from vectorstore import _qclient, COLLECTION_NAME
-        # delete all points with payload.doc_id == doc_id (use filter)
-        # qdrant client supports delete with filter
-        from qdrant_client.http import models as qmodels
-        filt = qmodels.Filter(
-            must=[qmodels.FieldCondition(key="doc_id", match=qmodels.MatchValue(value=doc_id))]
-        )
-        _qclient.delete(collection_name=COLLECTION_NAME, points_selector=qmodels.PointIdsSelector(ids=[]), wait=True, filter=filt)
-    except Exception:
+        chunks_deleted = await run_blocking(delete_document_chunks, doc_id)
+    except Exception as e:
         # best-effort; do not fail deletion if vector removal fails
-        pass
-    return {"status": "deleted", "deleted_count": delete_result.deleted_count}
+        print(f"Chunk removal failed for {doc_id}: {e}")
+        chunks_deleted = 0
+    return {"status": "deleted", "deleted_count": delete_result.deleted_count, "chunks_deleted": chunks_deleted}
 
-# Chat endpoint (RAG)
-# Replace the chat_endpoint function with this version that has better error handling:
+async def prepare_chat_turn(req: ChatRequest, user) -> dict:
+    """
+    Everything a chat turn does before calling the model: create or reuse
+    the chat, store the user message, retrieve context and build the prompt.
+    """
+    print(f"DEBUG: Starting chat for user {user['_id']}")
 
-@router.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(req: ChatRequest, user=Depends(get_current_user)):
-    try:
-        print(f"DEBUG: Starting chat for user {user['_id']}")
-        
-        # create or reuse chat
-        # Get client timezone from request
-        client_timezone = getattr(req, 'timezone', 'UTC')
-        current_time = get_client_time(client_timezone)
-        
-        # Use current_time instead of datetime.utcnow()
-        chat_id = req.chat_id or str(uuid.uuid4())
-        print(f"DEBUG: Chat ID: {chat_id}")
-        
-        if not req.chat_id:
-            await chats_col.insert_one({
-                "_id": chat_id,
-                "user_id": user["_id"],
-                "created_at": current_time,
-                "updated_at": current_time
-            })
-            print("DEBUG: Created new chat")
-
-        # store user message
-        user_msg = {
-            "chat_id": chat_id,
+    # create or reuse chat
+    # Get client timezone from request
+    client_timezone = getattr(req, 'timezone', 'UTC')
+    current_time = get_client_time(client_timezone)
+
+    # Use current_time instead of datetime.utcnow()
+    chat_id = req.chat_id or str(uuid.uuid4())
+    print(f"DEBUG: Chat ID: {chat_id}")
+
+    if not req.chat_id:
+        await chats_col.insert_one({
+            "_id": chat_id,
             "user_id": user["_id"],
-            "role": "user",
-            "text": req.message,
-            "timestamp": current_time
-        }
-        await messages_col.insert_one(user_msg)
-        print("DEBUG: Stored user message")
+            "created_at": current_time,
+            "updated_at": current_time
+        })
+        print("DEBUG: Created new chat")
 
-        # retrieval from vectorstore
-        topk = req.top_k or TOP_K
-        print(f"DEBUG: Getting embedding for: {req.message[:50]}...")
-        
-        try:
-            query_embedding = await get_embedding(req.message)
-            print(f"DEBUG: Got embedding, length: {len(query_embedding)}")
-        except Exception as e:
-            print(f"DEBUG: Embedding failed: {e}")
-            # Use mock embedding for now
-            query_embedding = [0.1] * 768
-        
+    # store user message
+    user_msg = {
+        "chat_id": chat_id,
+        "user_id": user["_id"],
+        "role": "user",
+        "text": req.message,
+        "timestamp": current_time
+    }
+    await messages_col.insert_one(user_msg)
+    print("DEBUG: Stored user message")
+
+    # retrieval from vectorstore
+    topk = req.top_k or TOP_K
+    print(f"DEBUG: Getting embedding for: {req.message[:50]}...")
+
+    try:
+        query_embedding = await get_embedding(req.message)
+        print(f"DEBUG: Got embedding, length: {len(query_embedding)}")
+    except Exception as e:
+        # answer without retrieved context rather than with wrong context
+        print(f"DEBUG: Embedding failed: {e}")
+        query_embedding = None
+
+    hits = []
+    if query_embedding is not None:
         try:
-            hits = search_similar_local(query_embedding, top_k=topk)
+            hits = await search_similar(query_embedding, top_k=topk)
             print(f"DEBUG: Found {len(hits)} similar chunks")
         except Exception as e:
             print(f"DEBUG: Search failed: {e}")
-            hits = []
 
-        context_snippets = []
-        for h in hits:
-            txt = (h.get("text") or "")[:1200]
-            context_snippets.append({"doc_id": h.get("doc_id"), "text": txt, "score": h.get("score")})
+    context_snippets = []
+    for h in hits:
+        txt = (h.get("text") or "")[:1200]
+        context_snippets.append({"doc_id": h.get("doc_id"), "text": txt, "score": h.get("score")})
 
-        # system prompt
-        system_prompt = build_system_prompt()
+    # system prompt
+    system_prompt = build_system_prompt()
 
-        # gather recent messages (memory)
-        try:
-            recent_cursor = messages_col.find({"chat_id": chat_id}).sort("timestamp", -1).limit(12)
-            recent = [m async for m in recent_cursor]
-            recent.reverse()
-            conversation_context = "\n".join([f"{m['role'].capitalize()}: {m['text']}" for m in recent if m.get("text")])
-            print("DEBUG: Got conversation history")
-        except Exception as e:
-            print(f"DEBUG: History failed: {e}")
-            conversation_context = ""
+    # gather recent messages (memory)
+    try:
+        recent_cursor = messages_col.find({"chat_id": chat_id}).sort("timestamp", -1).limit(12)
+        recent = [m async for m in recent_cursor]
+        recent.reverse()
+        conversation_context = "\n".join([f"{m['role'].capitalize()}: {m['text']}" for m in recent if m.get("text")])
+        print("DEBUG: Got conversation history")
+    except Exception as e:
+        print(f"DEBUG: History failed: {e}")
+        conversation_context = ""
 
-        # Prepare the final prompt
-        retrieved_text = "\n\n".join([f"[doc:{s['doc_id']}] {s['text']}" for s in context_snippets]) if context_snippets else "No retrieved external content."
-        final_prompt = f"""{system_prompt}
+    # Prepare the final prompt
+    retrieved_text = "\n\n".join([f"[doc:{s['doc_id']}] {s['text']}" for s in context_snippets]) if context_snippets else "No retrieved external content."
+    final_prompt = f"""{system_prompt}
 
 Retrieved content (use only if relevant):
 {retrieved_text}
@@ -219,14 +218,40 @@ User question:
 
 Answer concisely, cite sources like [doc:ID] if you used retrieved content, and include a short recommendation about next steps (e.g., see a retina specialist). Include a brief disclaimer that this is informational only.
 """
-        
+
+    return {"chat_id": chat_id, "current_time": current_time,
+            "sources": context_snippets, "prompt": final_prompt}
+
+
+async def save_assistant_message(chat_id: str, user, answer_text: str, current_time, sources,
+                                 extra_meta: Optional[dict] = None):
+    assistant_msg = {
+        "chat_id": chat_id,
+        "user_id": user["_id"],
+        "role": "assistant",
+        "text": answer_text,
+        "timestamp": current_time,
+        "meta": {"sources": sources, **(extra_meta or {})}
+    }
+    await messages_col.insert_one(assistant_msg)
+    await chats_col.update_one({"_id": chat_id}, {"$set": {"updated_at": datetime.utcnow()}})
+    print("DEBUG: Stored assistant message")
+
+
+# Chat endpoint (RAG)
+@router.post("/chat", response_model=ChatResponse)
+async def chat_endpoint(req: ChatRequest, user=Depends(get_current_user)):
+    try:
+        turn = await prepare_chat_turn(req, user)
+        chat_id, context_snippets = turn["chat_id"], turn["sources"]
+
         print("DEBUG: About to call Gemini...")
 
         # call Gemini
         try:
             from main import genai_client
             print("DEBUG: Got genai_client")
-            resp = genai_client.generate_content(final_prompt)
+            resp = genai_client.generate_content(turn["prompt"])
             print("DEBUG: Got response from Gemini")
             answer_text = resp.text
             print(f"DEBUG: Response text length: {len(answer_text)}")
@@ -235,17 +260,7 @@ Answer concisely, cite sources like [doc:ID] if you used retrieved content, and
             answer_text = "I apologize, but I'm having technical difficulties right now. Please try again in a moment."
 
         # persist assistant reply
-        assistant_msg = {
-            "chat_id": chat_id,
-            "user_id": user["_id"],
-            "role": "assistant",
-            "text": answer_text,
-            "timestamp": current_time,
-            "meta": {"sources": context_snippets}
-        }
-        await messages_col.insert_one(assistant_msg)
-        await chats_col.update_one({"_id": chat_id}, {"$set": {"updated_at": datetime.utcnow()}})
-        print("DEBUG: Stored assistant message")
+        await save_assistant_message(chat_id, user, answer_text, turn["current_time"], context_snippets)
 
         return {
             "chat_id": chat_id,
@@ -260,6 +275,107 @@ Answer concisely, cite sources like [doc:ID] if you used retrieved content, and
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
 
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _put(loop, queue: asyncio.Queue, item):
+    try:
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+    except RuntimeError:
+        # event loop already closed (shutdown mid-stream); nobody is listening
+        pass
+
+
+def _stream_model(prompt: str, loop, queue: asyncio.Queue, stop: threading.Event):
+    """Producer thread: iterate Gemini's blocking stream and hand text pieces to the event loop."""
+    try:
+        from main import genai_client
+        for chunk in genai_client.generate_content(prompt, stream=True):
+            if stop.is_set():
+                break
+            try:
+                text = chunk.text
+            except ValueError:
+                # a chunk without text parts (e.g. only safety ratings)
+                continue
+            if text:
+                _put(loop, queue, ("token", text))
+        _put(loop, queue, ("end", None))
+    except Exception as e:
+        _put(loop, queue, ("error", e))
+
+
+# persistence tasks started from a stream's cleanup; held here so they aren't garbage-collected
+_background_tasks = set()
+
+
+@router.post("/chat/stream")
+async def chat_stream_endpoint(req: ChatRequest, request: Request, user=Depends(get_current_user)):
+    """
+    Server-sent-event variant of /chat.
+
+    Emits `sources` as soon as retrieval is done, then a `token` event per
+    piece of model output as it arrives, then `done` (after an `error` if
+    the model call failed). The assistant message is persisted when the
+    stream ends - including when the client disconnects mid-answer, in which
+    case what was generated so far is saved with meta.partial = true.
+    """
+    try:
+        turn = await prepare_chat_turn(req, user)
+    except Exception as e:
+        print(f"ERROR in chat_stream_endpoint: {e}")
+        raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
+    chat_id, current_time, context_snippets = turn["chat_id"], turn["current_time"], turn["sources"]
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        parts = []
+        status = "disconnected"
+        try:
+            yield _sse("sources", {"chat_id": chat_id, "sources": context_snippets})
+            loop.run_in_executor(None, _stream_model, turn["prompt"], loop, queue, stop)
+            while True:
+                try:
+                    kind, value = await asyncio.wait_for(queue.get(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    continue
+                if kind == "token":
+                    parts.append(value)
+                    yield _sse("token", {"text": value})
+                elif kind == "end":
+                    status = "complete"
+                    break
+                else:
+                    status = "error"
+                    print(f"DEBUG: Gemini stream failed: {value}")
+                    yield _sse("error", {"detail": "Model call failed"})
+                    if not parts:
+                        # same fallback answer /chat stores
+                        parts.append("I apologize, but I'm having technical difficulties right now. Please try again in a moment.")
+                        yield _sse("token", {"text": parts[0]})
+                    break
+            yield _sse("done", {"chat_id": chat_id, "status": status, "timestamp": datetime.utcnow()})
+        finally:
+            # runs on completion, error and client disconnect (cancellation) alike
+            stop.set()
+            answer_text = "".join(parts)
+            if answer_text:
+                meta = None if status == "complete" else {"partial": True, "stream_status": status}
+                # this task may be being cancelled, so the write gets a task of its own
+                task = asyncio.ensure_future(
+                    save_assistant_message(chat_id, user, answer_text, current_time, context_snippets, meta))
+                _background_tasks.add(task)
+                task.add_done_callback(_background_tasks.discard)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 def fix_mongo_ids(doc):
     """Convert ObjectId fields to strings for JSON response"""
     if not doc:
@@ -8,9 +8,42 @@ QDRANT_HOST = os.getenv("QDRANT_HOST", "http://localhost:6333")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY", "")
 GOOGLE_GENAI_API_KEY = os.getenv("GOOGLE_GENAI_API_KEY", "")
 GOOGLE_GENAI_MODEL = os.getenv("GOOGLE_GENAI_MODEL", "gemini-2.5-pro")
-EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "gemini-embedding-001")
+# the model the stored vectors were built with; changing it means re-ingesting
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "embedding-001")
+# "gemini" (remote API), "local" (sentence-transformers on CPU) or "hash" (deterministic, offline)
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "gemini").lower()
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+LOCAL_EMBED_THREADS = int(os.getenv("LOCAL_EMBED_THREADS", 0))  # torch intra-op threads; 0 = torch default
+LOCAL_EMBED_BATCH = int(os.getenv("LOCAL_EMBED_BATCH", 32))
+LOCAL_EMBED_DEVICE = os.getenv("LOCAL_EMBED_DEVICE", "cpu")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 100))  # capped at the provider's own batch limit
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", 4))  # batches in flight per process
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", 5))
+EMBED_DIM = int(os.getenv("EMBED_DIM", 768))  # hash provider only
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", 10000))  # in-process LRU entries (~3 KB each at 768 dims)
+EMBED_CACHE_MONGO = os.getenv("EMBED_CACHE_MONGO", "true").lower() in ("1", "true", "yes")
+EMBED_CACHE_COLLECTION = os.getenv("EMBED_CACHE_COLLECTION", "embedding_cache")
 JWT_SECRET = os.getenv("JWT_SECRET_KEY", "clarity_retina_care_jwt_secret_key_2024_secure_32_chars")
 PORT = int(os.getenv("PORT", 8600))
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 800))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 100))
 TOP_K = int(os.getenv("TOP_K", 5))
+
+# Vector index: "exact" (brute-force matrix) or "ivf" (approximate, see vector_index.IVFIndex)
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "exact").lower()
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "")  # snapshot directory; empty = rebuild from Mongo on start
+IVF_NLIST = int(os.getenv("IVF_NLIST", 0))  # 0 = sqrt(chunks)
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 8))
+IVF_MIN_ROWS = int(os.getenv("IVF_MIN_ROWS", 20000))  # exhaustive search below this many chunks
+SEARCH_THREADS = int(os.getenv("SEARCH_THREADS", 4))  # executor that keeps vector search off the event loop
+# Each worker process holds its own index; searches re-check Mongo at most this often (seconds) and reload
+# when another worker has ingested or deleted chunks. 0 = never (only safe with a single worker).
+INDEX_REFRESH_SECONDS = float(os.getenv("INDEX_REFRESH_SECONDS", 5))
+# Snapshot rewrites after ingest/delete are batched: written at most this many seconds after the first change
+# (and at shutdown). 0 = write after every change.
+SNAPSHOT_DELAY = float(os.getenv("SNAPSHOT_DELAY", 30))
+# How chunk embeddings are stored in Mongo: "float32" (default), "float16" or "int8" (packed binary)
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "float32").lower()
+# In-memory scan precision: "float32" or "int8" (int8 shortlist, then exact rescoring of RESCORE_FACTOR * top_k)
+INDEX_PRECISION = os.getenv("INDEX_PRECISION", "float32").lower()
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR", 4))
@@ -0,0 +1,111 @@
+# rag_service/embedding_cache.py
+import hashlib
+import re
+import threading
+import unicodedata
+import numpy as np
+from collections import Counter, OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+from pymongo import UpdateOne
+from bson.binary import Binary
+
+_spaces = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """What counts as "the same text": NFKC, case-folded, whitespace collapsed."""
+    return _spaces.sub(" ", unicodedata.normalize("NFKC", text)).strip().casefold()
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache: an in-process LRU in front of a Mongo collection.
+
+    Keys are sha256(model tag + normalized text), so a repeated FAQ-style
+    question or an unchanged chunk on re-ingest never reaches the provider,
+    and switching models can't return a stale vector. Mongo entries hold
+    packed float32 and survive restarts; a Mongo error only costs the hit,
+    never the request.
+    """
+
+    def __init__(self, capacity: int = 10000, collection=None):
+        self.capacity = capacity
+        self.collection = collection  # motor collection, or None for memory only
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = Counter()  # by tier: "memory", "mongo"
+        self.misses = 0
+        self.errors = 0
+
+    @staticmethod
+    def key(model_tag: str, text: str) -> str:
+        return hashlib.sha256(f"{model_tag}\n{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        with self._lock:
+            self._lru[key] = vector
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.capacity:
+                self._lru.popitem(last=False)
+
+    async def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        with self._lock:
+            for k in keys:
+                v = self._lru.get(k)
+                if v is not None:
+                    self._lru.move_to_end(k)
+                    found[k] = v
+        self.hits["memory"] += len(found)
+        wanted = [k for k in dict.fromkeys(keys) if k not in found]
+        if wanted and self.collection is not None:
+            try:
+                async for doc in self.collection.find({"_id": {"$in": wanted}}, {"embedding": 1}):
+                    v = np.frombuffer(doc["embedding"], dtype="<f4").astype(np.float32)
+                    found[doc["_id"]] = v
+                    self._remember(doc["_id"], v)
+                    self.hits["mongo"] += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"Embedding cache lookup failed: {e}")
+        self.misses += len([k for k in wanted if k not in found])
+        return found
+
+    async def put_many(self, model_tag: str, items: Dict[str, np.ndarray]):
+        for k, v in items.items():
+            self._remember(k, v)
+        if not items or self.collection is None:
+            return
+        now = datetime.utcnow()
+        ops = [
+            UpdateOne({"_id": k}, {"$setOnInsert": {
+                "model": model_tag,
+                "dim": int(v.shape[0]),
+                "embedding": Binary(np.asarray(v, dtype="<f4").tobytes()),
+                "created_at": now,
+            }}, upsert=True)
+            for k, v in items.items()
+        ]
+        try:
+            await self.collection.bulk_write(ops, ordered=False)
+        except Exception as e:
+            self.errors += 1
+            print(f"Embedding cache write failed: {e}")
+
+    def clear_memory(self):
+        with self._lock:
+            self._lru.clear()
+
+    def stats(self) -> dict:
+        hits = sum(self.hits.values())
+        lookups = hits + self.misses
+        return {
+            "memory_entries": len(self._lru),
+            "capacity": self.capacity,
+            "persistent": self.collection is not None,
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "errors": self.errors,
+        }
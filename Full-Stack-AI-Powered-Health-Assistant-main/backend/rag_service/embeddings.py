@@ -0,0 +1,314 @@
+# rag_service/embeddings.py
+import asyncio
+import hashlib
+import random
+import re
+import threading
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+from config import (GOOGLE_GENAI_API_KEY, EMBEDDING_MODEL, EMBEDDING_PROVIDER, EMBED_BATCH_SIZE,
+                    EMBED_CONCURRENCY, EMBED_MAX_RETRIES, EMBED_DIM,
+                    EMBED_CACHE_SIZE, EMBED_CACHE_MONGO, EMBED_CACHE_COLLECTION,
+                    LOCAL_EMBEDDING_MODEL, LOCAL_EMBED_THREADS, LOCAL_EMBED_BATCH, LOCAL_EMBED_DEVICE)
+from embedding_cache import EmbeddingCache
+
+
+class EmbeddingError(Exception):
+    """Embedding failed for good (after retries); callers must not substitute vectors."""
+
+
+class EmbeddingProvider:
+    """
+    Turns texts into vectors, one provider-sized batch per call.
+
+    embed_batch() is blocking and is always called from the embedding
+    executor, never on the event loop; it returns one vector per input text
+    in order, or raises.
+    """
+    name = "base"
+    max_batch = 1
+
+    def __init__(self, model: str):
+        self.model = model
+
+    @property
+    def tag(self) -> str:
+        """Identifies the vector space: cache keys (and stored vectors) carry it."""
+        return f"{self.name}:{self.model}"
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    def warm_up(self):
+        """Load whatever the first real request would otherwise wait for (blocking)."""
+
+    def is_rate_limit(self, exc: Exception) -> bool:
+        return False
+
+    def is_retryable(self, exc: Exception) -> bool:
+        return False
+
+
+class GeminiEmbeddingProvider(EmbeddingProvider):
+    name = "gemini"
+    max_batch = 100  # batchEmbedContents request limit
+
+    # google.api_core exception classes, matched by name so the import stays lazy
+    _RATE_LIMITED = {"ResourceExhausted", "TooManyRequests"}
+    _TRANSIENT = {"ServiceUnavailable", "DeadlineExceeded", "InternalServerError", "GatewayTimeout",
+                  "Aborted", "ConnectionError", "Timeout", "ReadTimeout"}
+
+    def __init__(self, model: str = EMBEDDING_MODEL, api_key: str = GOOGLE_GENAI_API_KEY):
+        super().__init__(model if model.startswith("models/") else f"models/{model}")
+        import google.generativeai as genai
+        # configure once per process, not once per chunk
+        genai.configure(api_key=api_key)
+        self._genai = genai
+
+    def embed_batch(self, texts):
+        result = self._genai.embed_content(model=self.model, content=list(texts))
+        vectors = result["embedding"]
+        if len(texts) == 1 and vectors and not isinstance(vectors[0], (list, tuple)):
+            vectors = [vectors]
+        if len(vectors) != len(texts):
+            raise EmbeddingError(f"{self.model} returned {len(vectors)} embeddings for {len(texts)} texts")
+        return vectors
+
+    def is_rate_limit(self, exc):
+        return type(exc).__name__ in self._RATE_LIMITED or getattr(exc, "code", None) == 429
+
+    def is_retryable(self, exc):
+        return (self.is_rate_limit(exc) or type(exc).__name__ in self._TRANSIENT
+                or getattr(exc, "code", None) in (500, 502, 503, 504))
+
+
+class HashEmbeddingProvider(EmbeddingProvider):
+    """
+    Deterministic local stand-in: signed feature hashing of word unigrams and
+    bigrams into `dim` buckets, L2-normalized. No network, same text -> same
+    vector, and texts sharing words land close together, so retrieval tests
+    behave sensibly without an API key.
+    """
+    name = "hash"
+    max_batch = 512
+
+    def __init__(self, model: str = "hash-v1", dim: int = EMBED_DIM):
+        super().__init__(model)
+        self.dim = dim
+
+    def _vector(self, text: str) -> List[float]:
+        words = re.findall(r"\w+", text.lower())
+        v = np.zeros(self.dim, dtype=np.float32)
+        for token in words + [a + " " + b for a, b in zip(words, words[1:])]:
+            h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            v[h % self.dim] += 1.0 if (h >> 63) else -1.0
+        norm = np.linalg.norm(v)
+        return (v / norm if norm else v).tolist()
+
+    def embed_batch(self, texts):
+        return [self._vector(t) for t in texts]
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """
+    sentence-transformers model on this box's CPU: no network hop per query.
+
+    The model loads on first use (or warm_up() at startup), torch is pinned
+    to LOCAL_EMBED_THREADS, and calls are serialized so concurrent batches
+    queue instead of oversubscribing the cores; each call encodes its texts
+    LOCAL_EMBED_BATCH at a time.
+    """
+    name = "local"
+    max_batch = 256
+
+    def __init__(self, model: str = LOCAL_EMBEDDING_MODEL, threads: int = LOCAL_EMBED_THREADS,
+                 batch_size: int = LOCAL_EMBED_BATCH, device: str = LOCAL_EMBED_DEVICE):
+        super().__init__(model)
+        self.threads = threads
+        self.batch_size = batch_size
+        self.device = device
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._model is None:
+            try:
+                import torch
+                from sentence_transformers import SentenceTransformer
+            except ImportError as e:
+                raise RuntimeError(
+                    "EMBEDDING_PROVIDER=local needs sentence-transformers (pip install sentence-transformers)"
+                ) from e
+            if self.threads > 0:
+                torch.set_num_threads(self.threads)
+            t0 = time.perf_counter()
+            self._model = SentenceTransformer(self.model, device=self.device)
+            print(f"Loaded {self.model} on {self.device} in {time.perf_counter() - t0:.1f}s "
+                  f"({torch.get_num_threads()} threads, dim {self._model.get_sentence_embedding_dimension()})")
+        return self._model
+
+    def embed_batch(self, texts):
+        with self._lock:
+            model = self._load()
+            vectors = model.encode(list(texts), batch_size=self.batch_size, normalize_embeddings=True,
+                                   convert_to_numpy=True, show_progress_bar=False)
+        return list(vectors)
+
+    def warm_up(self):
+        t0 = time.perf_counter()
+        self.embed_batch(["diabetic retinopathy warm-up"])
+        print(f"Local embedding model warm in {time.perf_counter() - t0:.1f}s")
+
+
+PROVIDERS = {"gemini": GeminiEmbeddingProvider, "local": LocalEmbeddingProvider, "hash": HashEmbeddingProvider}
+
+_provider: Optional[EmbeddingProvider] = None
+_executor = ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY, thread_name_prefix="rag-embed")
+_slots: Optional[asyncio.Semaphore] = None
+_cache: Optional[EmbeddingCache] = None
+
+
+def get_provider() -> EmbeddingProvider:
+    """The deployment's provider (EMBEDDING_PROVIDER), created on first use."""
+    global _provider
+    if _provider is None:
+        cls = PROVIDERS.get(EMBEDDING_PROVIDER)
+        if cls is None:
+            raise ValueError(f"Unknown EMBEDDING_PROVIDER {EMBEDDING_PROVIDER!r}; expected one of {sorted(PROVIDERS)}")
+        _provider = cls()
+    return _provider
+
+
+def set_provider(provider: EmbeddingProvider):
+    """Swap the process-wide provider (tests, tools)."""
+    global _provider
+    _provider = provider
+
+
+def get_cache() -> EmbeddingCache:
+    """Process-wide cache; the Mongo tier lives in EMBED_CACHE_COLLECTION."""
+    global _cache
+    if _cache is None:
+        collection = None
+        if EMBED_CACHE_MONGO:
+            from db import db
+            collection = db[EMBED_CACHE_COLLECTION]
+        _cache = EmbeddingCache(EMBED_CACHE_SIZE, collection)
+    return _cache
+
+
+async def warm_up():
+    """Create the provider and run its warm-up off the event loop (app startup)."""
+    provider = get_provider()
+    await asyncio.get_running_loop().run_in_executor(_executor, provider.warm_up)
+    return provider
+
+
+def _backoff(attempt: int, rate_limited: bool) -> float:
+    # full jitter; a 429 backs off harder than a flaky connection
+    base, cap = (2.0, 60.0) if rate_limited else (0.5, 10.0)
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+async def _embed_one_batch(provider: EmbeddingProvider, texts: List[str], max_retries: int) -> List[List[float]]:
+    global _slots
+    if _slots is None:
+        # shared by every caller in the process, so concurrent ingests don't multiply the load
+        _slots = asyncio.Semaphore(EMBED_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    attempt = 0
+    while True:
+        async with _slots:
+            try:
+                return await loop.run_in_executor(_executor, provider.embed_batch, texts)
+            except EmbeddingError:
+                raise
+            except Exception as e:
+                if attempt >= max_retries or not provider.is_retryable(e):
+                    raise EmbeddingError(f"{provider.name} embedding failed after {attempt + 1} attempt(s): {e}") from e
+                delay = _backoff(attempt, provider.is_rate_limit(e))
+                print(f"Embedding batch of {len(texts)} failed ({type(e).__name__}: {e}); retrying in {delay:.1f}s")
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+async def embed_texts(texts: List[str], provider: Optional[EmbeddingProvider] = None,
+                      batch_size: int = EMBED_BATCH_SIZE, max_retries: int = EMBED_MAX_RETRIES,
+                      progress: Optional[Callable[[int, int], None]] = None,
+                      cache: Optional[EmbeddingCache] = None, use_cache: bool = True) -> List[np.ndarray]:
+    """
+    Embed `texts` (float32 vectors, in order), consulting the embedding cache first.
+
+    Only texts missing from both cache tiers - each distinct one once - go
+    to the provider, in provider-sized batches, EMBED_CONCURRENCY at a time.
+    Transient and rate-limit errors are retried with exponential backoff;
+    anything else, or running out of retries, raises EmbeddingError for the
+    whole call - no vector is ever made up. `progress(done, total)` is
+    called as batches complete.
+    """
+    provider = provider or get_provider()
+    if not texts:
+        return []
+    if not use_cache:
+        vectors = await _embed_uncached(texts, provider, batch_size, max_retries, progress)
+        return [np.asarray(v, dtype=np.float32) for v in vectors]
+
+    cache = cache or get_cache()
+    keys = [cache.key(provider.tag, t) for t in texts]
+    found = await cache.get_many(keys)
+    missing = {}
+    for k, t in zip(keys, texts):
+        if k not in found and k not in missing:
+            missing[k] = t
+    if missing:
+        fresh = await _embed_uncached(list(missing.values()), provider, batch_size, max_retries, progress)
+        fresh = {k: np.asarray(v, dtype=np.float32) for k, v in zip(missing, fresh)}
+        await cache.put_many(provider.tag, fresh)
+        found.update(fresh)
+    return [found[k] for k in keys]
+
+
+async def _embed_uncached(texts: List[str], provider: EmbeddingProvider, batch_size: int, max_retries: int,
+                          progress: Optional[Callable[[int, int], None]]) -> List[List[float]]:
+    size = max(1, min(batch_size, provider.max_batch))
+    batches = [texts[i:i + size] for i in range(0, len(texts), size)]
+    done = 0
+
+    async def run(batch):
+        nonlocal done
+        vectors = await _embed_one_batch(provider, batch, max_retries)
+        done += len(batch)
+        if progress is not None:
+            progress(done, len(texts))
+        return vectors
+
+    tasks = [asyncio.ensure_future(run(b)) for b in batches]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        # one batch failed for good: don't leave the rest burning quota
+        for t in tasks:
+            t.cancel()
+        raise
+    return [v for batch in results for v in batch]
+
+
+async def embed_query(text: str, provider: Optional[EmbeddingProvider] = None) -> np.ndarray:
+    return (await embed_texts([text], provider=provider))[0]
+
+
+def progress_printer(label: str, every: float = 0.1) -> Callable[[int, int], None]:
+    """progress() callback that prints roughly every `every` of the total, with a rate."""
+    t0 = time.perf_counter()
+    state = {"next": 0.0}
+
+    def report(done: int, total: int):
+        if done < total and done / total < state["next"]:
+            return
+        state["next"] = done / total + every
+        elapsed = time.perf_counter() - t0
+        print(f"{label}: embedded {done}/{total} chunks in {elapsed:.1f}s ({done / max(elapsed, 1e-9):.0f}/s)")
+
+    return report
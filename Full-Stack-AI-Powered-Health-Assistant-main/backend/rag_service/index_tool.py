@@ -0,0 +1,151 @@
+# rag_service/index_tool.py
+"""
+Build, inspect and evaluate the RAG vector index.
+
+    # rebuild from Mongo and rewrite the snapshot in VECTOR_INDEX_DIR
+    python index_tool.py build
+
+    # recall@k of IVF search vs exact search, for several nprobe values
+    python index_tool.py recall --k 5 --nprobe 1 4 8 16 32 --queries 200
+
+    python index_tool.py stats
+
+    # rewrite stored embeddings as packed binary (float32 / float16 / int8), in place
+    python index_tool.py migrate --format float32
+
+Serve it with VECTOR_INDEX=ivf (IVF_NLIST / IVF_NPROBE / IVF_MIN_ROWS tune
+it) and VECTOR_INDEX_DIR=<dir> so restarts map the snapshot instead of
+re-reading every embedding from Mongo.
+"""
+import argparse
+import json
+import sys
+import time
+
+import bson
+from pymongo import UpdateOne
+
+from config import IVF_NLIST, IVF_NPROBE, EMBEDDING_STORAGE
+from vector_index import IVFIndex
+import vectorstore_mongo as vs
+
+
+def build(args):
+    t0 = time.perf_counter()
+    vs.load_index(rebuild=True)
+    print(f"Built in {time.perf_counter() - t0:.2f}s: {vs.INDEX.stats()}")
+    if not vs.VECTOR_INDEX_DIR:
+        print("VECTOR_INDEX_DIR is not set; nothing was written")
+    return 0
+
+
+def stats(args):
+    t0 = time.perf_counter()
+    vs.load_index()
+    print(f"Ready in {time.perf_counter() - t0:.2f}s")
+    print(json.dumps(vs.INDEX.stats(), indent=2))
+    print(f"active embedding model: {vs.active_embedding_model()}")
+    for model, count in sorted(vs.index_models().items()):
+        print(f"  {model}: {count} chunks")
+    return 0
+
+
+def recall(args):
+    if isinstance(vs.INDEX, IVFIndex) and not args.nlist:
+        vs.load_index()
+        index = vs.INDEX
+    else:
+        # evaluate IVF on the live corpus without touching the serving config
+        index = IVFIndex(nlist=args.nlist or IVF_NLIST, nprobe=IVF_NPROBE, min_rows=0)
+        query = vs._model_query(vs.active_embedding_model())
+        index.load(vs._vector_rows(vs.chunks_col.find(query, vs.VECTOR_FIELDS)))
+    if index.centroids is None:
+        print(f"Index is untrained ({len(index)} chunks < IVF_MIN_ROWS); every search is exact")
+        return 1
+
+    rows = [index.recall_at_k(k=args.k, queries=args.queries, nprobe=p) for p in args.nprobe]
+    print(f"{rows[0]['rows']} chunks, nlist={rows[0]['nlist']}, {rows[0]['queries']} queries, k={args.k}")
+    print(f"{'nprobe':>8}{'recall':>9}{'scanned':>9}{'ivf ms':>9}{'exact ms':>10}")
+    for r in rows:
+        print(f"{r['nprobe']:>8}{r['recall']:>9.3f}{r['scanned_fraction']:>9.3f}"
+              f"{r['ivf_ms']:>9.2f}{r['exact_ms']:>10.2f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+    return 0
+
+
+def migrate(args):
+    """Re-encode every chunk not already in the target format, in bulk batches."""
+    query = {"embedding": {"$exists": True}, "embedding_format": {"$ne": args.format}}
+    total = vs.chunks_col.count_documents(query)
+    print(f"{total} chunks to convert to {args.format}{' (dry run)' if args.dry_run else ''}")
+    fields = {"_id": 1, "embedding": 1, "embedding_format": 1, "embedding_scale": 1}
+    before = after = done = 0
+    ops = []
+    t0 = time.perf_counter()
+
+    def flush():
+        if ops and not args.dry_run:
+            vs.chunks_col.bulk_write(ops, ordered=False)
+        ops.clear()
+
+    # page by _id: rewritten documents keep theirs, so nothing is skipped or revisited
+    last_id = None
+    while True:
+        page = dict(query, **({"_id": {"$gt": last_id}} if last_id is not None else {}))
+        docs = list(vs.chunks_col.find(page, fields).sort("_id", 1).limit(args.batch_size))
+        if not docs:
+            break
+        for doc in docs:
+            vector = vs.unpack_embedding(doc)
+            update = vs.pack_embedding(vector, args.format)
+            unset = {} if args.format == "int8" else {"embedding_scale": ""}
+            before += len(bson.encode({"embedding": doc["embedding"]}))
+            after += len(bson.encode({"embedding": update["embedding"]}))
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": update, **({"$unset": unset} if unset else {})}))
+        last_id = docs[-1]["_id"]
+        done += len(docs)
+        flush()
+        rate = done / max(time.perf_counter() - t0, 1e-9)
+        print(f"  {done}/{total} ({rate:.0f} chunks/s)")
+    flush()
+    if done:
+        print(f"embedding bytes: {before / 1e6:.2f} MB -> {after / 1e6:.2f} MB ({before / max(after, 1):.1f}x smaller)")
+    if done and not args.dry_run:
+        # stored values changed (for lossy formats), so don't trust the old snapshot
+        vs.load_index(rebuild=True)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("build", help="rebuild the index from Mongo and save the snapshot").set_defaults(func=build)
+    sub.add_parser("stats", help="load the index and print its stats").set_defaults(func=stats)
+
+    rec = sub.add_parser("recall", help="recall@k of IVF search against exact search")
+    rec.add_argument("--k", type=int, default=5)
+    rec.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    rec.add_argument("--queries", type=int, default=200, help="stored chunks used as held-out queries")
+    rec.add_argument("--nlist", type=int, default=0, help="train a throwaway index with this many lists")
+    rec.add_argument("--json", help="also write the results here")
+    rec.set_defaults(func=recall)
+
+    mig = sub.add_parser("migrate", help="convert stored embeddings to packed binary in place")
+    mig.add_argument("--format", choices=sorted(vs.EMBEDDING_FORMATS), default=EMBEDDING_STORAGE)
+    mig.add_argument("--batch-size", type=int, default=500)
+    mig.add_argument("--dry-run", action="store_true", help="report the size change without writing")
+    mig.set_defaults(func=migrate)
+
+    args = parser.parse_args(argv)
+    try:
+        return args.func(args)
+    finally:
+        # snapshot writes are debounced in the service; a one-shot tool writes before exiting
+        vs.flush_index_snapshot()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,40 +7,20 @@ import io
 from bs4 import BeautifulSoup
 from pypdf import PdfReader
 from db import documents_col
-from vectorstore_mongo import upsert_chunks, search_similar_local
+from vectorstore_mongo import upsert_chunks, run_blocking
 from config import CHUNK_SIZE, CHUNK_OVERLAP
-
-async def get_embedding_for_chunk(text: str):
-    """Generate embedding for a text chunk"""
-    try:
-        import google.generativeai as genai
-        from config import GOOGLE_GENAI_API_KEY
-        
-        genai.configure(api_key=GOOGLE_GENAI_API_KEY)
-        
-        result = genai.embed_content(
-            model="models/embedding-001",
-            content=text
-        )
-        return result['embedding']
-    except Exception as e:
-        print(f"Embedding error for chunk: {e}")
-        # Return a random vector as fallback
-        import random
-        return [random.uniform(-0.1, 0.1) for _ in range(768)]
+from embeddings import embed_texts, get_provider, progress_printer
 
 async def upsert_document_chunks(doc_id: str, chunks: list):
     """Convert chunks to embeddings and store them"""
     chunk_texts = [chunk["text"] for chunk in chunks]
-    
-    # Generate embeddings for each chunk
-    chunk_embeddings = []
-    for text in chunk_texts:
-        embedding = await get_embedding_for_chunk(text)
-        chunk_embeddings.append(embedding)
-    
-    # Store in vector database
-    upsert_chunks(doc_id, chunk_texts, chunk_embeddings)
+
+    # batched + concurrent; raises EmbeddingError rather than storing made-up vectors
+    provider = get_provider()
+    chunk_embeddings = await embed_texts(chunk_texts, provider=provider, progress=progress_printer(f"ingest {doc_id}"))
+
+    # Store in vector database, tagged with the model that produced the vectors
+    await run_blocking(upsert_chunks, doc_id, chunk_texts, chunk_embeddings, None, provider.tag)
     return len(chunks)
 
 def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP):
@@ -2,6 +2,8 @@
 import uvicorn
 from fastapi import FastAPI
 from chat_routes import router as chat_router
+from vectorstore_mongo import load_index, flush_index_snapshot
+from embeddings import warm_up as warm_up_embeddings
 from config import PORT, GOOGLE_GENAI_API_KEY
 from google import genai
 import google.generativeai as genai
@@ -36,6 +38,28 @@ genai_client = genai.GenerativeModel('gemini-2.5-pro')
 # Attach router
 app.include_router(chat_router, prefix="/api/rag", tags=["rag"])
 
+@app.on_event("startup")
+async def warm_up_embedding_model():
+    # a local model loads here instead of on the first chat turn
+    try:
+        provider = await warm_up_embeddings()
+        print(f"Embedding provider: {provider.tag}")
+    except Exception as e:
+        print(f"Embedding warm-up failed ({e}); queries will retry on demand")
+
+@app.on_event("startup")
+def load_vector_index():
+    # map the snapshot (or rebuild from Mongo) before the first chat needs it
+    try:
+        load_index()
+    except Exception as e:
+        print(f"Vector index not loaded at startup ({e}); will retry on first search")
+
+@app.on_event("shutdown")
+def save_vector_index():
+    # snapshot writes are batched; don't lose the last batch on restart
+    flush_index_snapshot()
+
 # simple root
 @app.get("/")
 def root():
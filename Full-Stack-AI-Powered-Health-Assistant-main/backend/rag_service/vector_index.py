@@ -0,0 +1,568 @@
+# rag_service/vector_index.py
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_GRACE = 60.0  # seconds a superseded generation survives pruning, for processes still loading it
+PRECISIONS = ("float32", "int8")
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    # zero vectors stay zero (they score 0 against everything)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize_rows(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8: returns (codes, scales) with row ~= codes * scale."""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class EmbeddingIndex:
+    """
+    Process-local copy of every chunk embedding, for brute-force cosine search.
+
+    Rows are L2-normalized once on the way in and kept in one contiguous
+    float32 matrix, with parallel arrays of chunk ids and integer doc codes,
+    so a search is a single matrix-vector product plus an argpartition for
+    the top-k instead of a Python loop over Mongo documents. The vectorstore
+    keeps it in step with Mongo incrementally (replace_document /
+    remove_document) and can snapshot it to disk with save().
+
+    With precision="int8" a second, int8 copy of the rows (per-row scale) is
+    what gets scanned; the best `rescore` * top_k rows are then rescored
+    against the float32 rows. Loaded from a snapshot, the float32 matrix is
+    a memory map, so only the int8 copy (a quarter of the size) has to stay
+    resident.
+    """
+    kind = "exact"
+    _row_arrays = ("_codes",)  # per-row arrays kept parallel to the matrix
+
+    def __init__(self, precision: str = "float32", rescore: int = 4):
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision must be one of {PRECISIONS}, got {precision!r}")
+        self.precision = precision
+        self.rescore = max(1, rescore)
+        if precision == "int8":
+            self._row_arrays = self._row_arrays + ("_scan", "_scan_scale")
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.loaded = False
+        self.dim = 0
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._codes = np.zeros(0, dtype=np.int32)  # doc code per row
+        self._scan = np.zeros((0, 0), dtype=np.int8)  # int8 precision only
+        self._scan_scale = np.zeros(0, dtype=np.float32)
+        self._chunk_ids: List[str] = []
+        self._n = 0
+        self._doc_codes: Dict[str, int] = {}
+        self._doc_names: List[str] = []
+
+    def __len__(self):
+        return self._n
+
+    def _code(self, doc_id: str) -> int:
+        code = self._doc_codes.get(doc_id)
+        if code is None:
+            code = self._doc_codes[doc_id] = len(self._doc_names)
+            self._doc_names.append(doc_id)
+        return code
+
+    def _reserve(self, rows: int):
+        # grow geometrically so ingesting chunk by chunk stays amortized O(1)
+        if rows <= self._matrix.shape[0]:
+            return
+        capacity = max(rows, 2 * self._matrix.shape[0], 256)
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[:self._n] = self._matrix[:self._n]
+        self._matrix = matrix
+        for name in self._row_arrays:
+            old = getattr(self, name)
+            new = np.zeros((capacity, self.dim) if old.ndim == 2 else capacity, dtype=old.dtype)
+            if self._n:
+                new[:self._n] = old[:self._n]
+            setattr(self, name, new)
+
+    def _append(self, doc_id: str, chunk_ids: List[str], embeddings: List[List[float]]) -> Optional[Tuple[int, int]]:
+        """Append a document's rows; returns the (start, end) row span written, if any."""
+        rows = [(cid, emb) for cid, emb in zip(chunk_ids, embeddings) if emb is not None and len(emb)]
+        if not rows:
+            return None
+        try:
+            vectors = np.asarray([emb for _, emb in rows], dtype=np.float32)
+        except ValueError:
+            print(f"EmbeddingIndex: skipping {doc_id}, embeddings have mixed lengths")
+            return None
+        if self.dim == 0:
+            self.dim = vectors.shape[1]
+            self._matrix = np.zeros((0, self.dim), dtype=np.float32)
+        if vectors.shape[1] != self.dim:
+            print(f"EmbeddingIndex: skipping {doc_id}, dim {vectors.shape[1]} != index dim {self.dim}")
+            return None
+        start, end = self._n, self._n + len(rows)
+        self._reserve(end)
+        self._matrix[start:end] = _normalize(vectors)
+        if self.precision == "int8":
+            self._scan[start:end], self._scan_scale[start:end] = quantize_rows(self._matrix[start:end])
+        self._codes[start:end] = self._code(doc_id)
+        self._chunk_ids.extend(cid for cid, _ in rows)
+        self._n = end
+        return start, end
+
+    def _remove(self, doc_id: str) -> int:
+        code = self._doc_codes.get(doc_id)
+        if code is None or self._n == 0:
+            return 0
+        keep = self._codes[:self._n] != code
+        kept = int(keep.sum())
+        removed = self._n - kept
+        if removed:
+            # compact in place; boolean indexing copies first, so overlap is safe
+            self._matrix[:kept] = self._matrix[:self._n][keep]
+            for name in self._row_arrays:
+                arr = getattr(self, name)
+                arr[:kept] = arr[:self._n][keep]
+            self._chunk_ids = [cid for cid, k in zip(self._chunk_ids, keep) if k]
+            self._n = kept
+        return removed
+
+    def _changed(self):
+        """Hook run (under the lock) after any load or mutation."""
+
+    def load(self, cursor):
+        """(Re)build from an iterable of {doc_id, chunk_id, embedding} documents."""
+        by_doc: Dict[str, Tuple[List[str], List[List[float]]]] = {}
+        for doc in cursor:
+            ids, embs = by_doc.setdefault(doc["doc_id"], ([], []))
+            ids.append(doc["chunk_id"])
+            embs.append(doc.get("embedding"))
+        total = sum(len(ids) for ids, _ in by_doc.values())
+        first = next((e for _, embs in by_doc.values() for e in embs if e is not None and len(e)), None)
+        with self._lock:
+            self._reset()
+            if first is not None:
+                # size the matrix once instead of growing it document by document
+                self.dim = len(first)
+                self._matrix = np.zeros((0, self.dim), dtype=np.float32)
+                self._reserve(total)
+            for doc_id, (ids, embs) in by_doc.items():
+                self._append(doc_id, ids, embs)
+            self.loaded = True
+            self._changed()
+
+    def replace_document(self, doc_id: str, chunk_ids: List[str], embeddings: List[List[float]]):
+        with self._lock:
+            self._remove(doc_id)
+            self._append(doc_id, chunk_ids, embeddings)
+            self._changed()
+
+    def remove_document(self, doc_id: str) -> int:
+        with self._lock:
+            removed = self._remove(doc_id)
+            if removed:
+                self._changed()
+            return removed
+
+    # Search
+    def _filter_rows(self, filter_doc_ids: Optional[List[str]]) -> Optional[np.ndarray]:
+        if not filter_doc_ids:
+            return None
+        wanted = [self._doc_codes[d] for d in filter_doc_ids if d in self._doc_codes]
+        return np.flatnonzero(np.isin(self._codes[:self._n], wanted))
+
+    def _candidates(self, q: np.ndarray, rows: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        """Rows worth scoring for `q` (None = all of them); exact search scores everything."""
+        return rows
+
+    def _scan_scores(self, q: np.ndarray, rows: Optional[np.ndarray], block: int = 4096) -> np.ndarray:
+        """Approximate scores from the int8 rows, widened to float32 a block at a time for BLAS."""
+        n = self._n if rows is None else rows.shape[0]
+        out = np.empty(n, dtype=np.float32)
+        buf = np.empty((min(block, n), self.dim), dtype=np.float32)
+        for i in range(0, n, block):
+            part = self._scan[i:min(i + block, n)] if rows is None else self._scan[rows[i:i + block]]
+            b = buf[:part.shape[0]]
+            b[...] = part
+            np.dot(b, q, out=out[i:i + part.shape[0]])
+        out *= self._scan_scale[:self._n] if rows is None else self._scan_scale[rows]
+        return out
+
+    @staticmethod
+    def _top(scores: np.ndarray, k: int) -> np.ndarray:
+        k = min(k, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top], kind="stable")]
+
+    def _score(self, q: np.ndarray, rows: Optional[np.ndarray], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Best-first (row indices, scores) of the top k among `rows`."""
+        count = self._n if rows is None else rows.shape[0]
+        if count == 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if self.precision == "int8" and count > k * self.rescore:
+            # shortlist on the int8 copy, then rescore the shortlist exactly
+            short = self._top(self._scan_scores(q, rows), k * self.rescore)
+            rows = rows[short] if rows is not None else short
+        matrix = self._matrix[:self._n] if rows is None else self._matrix[rows]
+        scores = matrix @ q
+        top = self._top(scores, k)
+        return (rows[top] if rows is not None else top), scores[top]
+
+    def search(self, query_embedding: List[float], top_k: int = 5,
+               filter_doc_ids: Optional[List[str]] = None, exact: bool = False) -> List[Tuple[str, str, float]]:
+        """Top-k (chunk_id, doc_id, cosine score), best first."""
+        q = np.asarray(query_embedding, dtype=np.float32).ravel()
+        q_norm = np.linalg.norm(q)
+        if q_norm == 0 or top_k <= 0:
+            return []
+        q = q / q_norm
+        with self._lock:
+            if self._n == 0:
+                return []
+            if q.shape[0] != self.dim:
+                raise ValueError(f"query embedding has dim {q.shape[0]}, index has {self.dim}")
+            rows = self._filter_rows(filter_doc_ids)
+            if not exact:
+                rows = self._candidates(q, rows)
+            top, scores = self._score(q, rows, top_k)
+            return [
+                (self._chunk_ids[r], self._doc_names[self._codes[r]], float(s))
+                for r, s in zip(top, scores)
+            ]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "loaded": self.loaded,
+                "chunks": self._n,
+                "documents": int(np.unique(self._codes[:self._n]).size),
+                "dim": self.dim,
+                "capacity": int(self._matrix.shape[0]),
+                "bytes": int(self._matrix.nbytes),
+                "precision": self.precision,
+                "scan_bytes": int(self._scan.nbytes) if self.precision == "int8" else int(self._matrix.nbytes),
+            }
+
+    # Snapshots
+    def _snapshot_arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {"matrix": self._matrix[:self._n], "codes": self._codes[:self._n]}
+        if self.precision == "int8":
+            arrays["scan"] = self._scan[:self._n]
+            arrays["scan_scale"] = self._scan_scale[:self._n]
+        return arrays
+
+    def _snapshot_meta(self) -> Dict[str, Any]:
+        return {}
+
+    def _restore(self, meta: Dict[str, Any], arrays: Dict[str, np.ndarray]):
+        """Hook for subclasses to pick up their extra snapshot state."""
+
+    def save(self, directory: str, stamp: Optional[Dict[str, Any]] = None, keep: int = 3) -> str:
+        """
+        Write a snapshot generation under `directory` and publish it.
+
+        Arrays are plain .npy files (memory-mapped on load); CURRENT names the
+        live generation and is swapped with os.replace, so a reader never
+        sees a half-written snapshot. `stamp` is stored as-is for the caller
+        to check freshness against its source of truth.
+
+        Several processes may share `directory`: each writes its own temp
+        pointer, and only generations older than the newest `keep` (and
+        than SNAPSHOT_GRACE seconds) are removed, so one that another
+        process is still writing or has mapped is left alone.
+
+        Only the in-memory copy happens under the index lock (removals
+        compact rows in place, so the arrays can't be written while shared);
+        searches run during the disk writes.
+        """
+        with self._lock:
+            arrays = {name: np.array(arr) for name, arr in self._snapshot_arrays().items()}
+            meta = {
+                "version": SNAPSHOT_VERSION,
+                "kind": self.kind,
+                "dim": self.dim,
+                "rows": self._n,
+                "chunk_ids": list(self._chunk_ids),
+                "doc_names": list(self._doc_names),
+                "stamp": stamp,
+                "saved_at": time.time(),
+                **self._snapshot_meta(),
+            }
+        os.makedirs(directory, exist_ok=True)
+        generation = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:6]}"
+        path = os.path.join(directory, generation)
+        os.makedirs(path)
+        for name, arr in arrays.items():
+            np.save(os.path.join(path, name + ".npy"), arr)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        tmp = os.path.join(directory, f"CURRENT.{os.getpid()}.{uuid.uuid4().hex}.tmp")
+        with open(tmp, "w") as f:
+            f.write(generation)
+        os.replace(tmp, os.path.join(directory, "CURRENT"))
+        self._prune(directory, keep=max(1, keep), protect={generation})
+        return path
+
+    @staticmethod
+    def _prune(directory: str, keep: int, protect: set):
+        try:
+            with open(os.path.join(directory, "CURRENT")) as f:
+                # possibly newer than ours, if another process published meanwhile
+                protect = protect | {f.read().strip()}
+        except OSError:
+            pass
+        cutoff = time.time() - SNAPSHOT_GRACE
+        names = os.listdir(directory)
+        for name in names:
+            # pointer temp files left by a process that died mid-publish
+            if name.startswith("CURRENT.") and name.endswith(".tmp"):
+                try:
+                    if os.path.getmtime(os.path.join(directory, name)) < cutoff:
+                        os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+        # generation names start with a millisecond timestamp, so they sort oldest first
+        generations = sorted(n for n in names if os.path.isdir(os.path.join(directory, n)))
+        for name in generations[:-keep]:
+            old = os.path.join(directory, name)
+            try:
+                recent = os.path.getmtime(old) > cutoff
+            except OSError:
+                continue
+            if name not in protect and not recent:
+                shutil.rmtree(old, ignore_errors=True)
+
+    def load_snapshot(self, directory: str) -> Optional[Dict[str, Any]]:
+        """Map the published snapshot in; returns its meta, or None if there is no usable one."""
+        try:
+            with open(os.path.join(directory, "CURRENT")) as f:
+                path = os.path.join(directory, f.read().strip())
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != SNAPSHOT_VERSION or meta.get("kind") != self.kind:
+            return None
+        arrays = {}
+        try:
+            for name in os.listdir(path):
+                if name.endswith(".npy"):
+                    # copy-on-write: in-place compaction after a delete never touches the file
+                    arrays[name[:-4]] = np.load(os.path.join(path, name), mmap_mode="c")
+        except (OSError, ValueError):
+            # pruned by another process between reading CURRENT and mapping it
+            return None
+        rows = meta["rows"]
+        matrix = arrays.get("matrix")
+        if matrix is None or matrix.shape[0] != rows or len(meta["chunk_ids"]) != rows:
+            return None
+        with self._lock:
+            self._reset()
+            self.dim = meta["dim"]
+            self._matrix = matrix
+            self._codes = np.array(arrays["codes"], dtype=np.int32)
+            self._chunk_ids = list(meta["chunk_ids"])
+            self._doc_names = list(meta["doc_names"])
+            self._doc_codes = {d: i for i, d in enumerate(self._doc_names)}
+            self._n = rows
+            if self.precision == "int8":
+                if "scan" in arrays:
+                    # the int8 copy is what gets scanned, so it lives in RAM
+                    self._scan = np.array(arrays["scan"], dtype=np.int8)
+                    self._scan_scale = np.array(arrays["scan_scale"], dtype=np.float32)
+                else:
+                    self._scan, self._scan_scale = quantize_rows(np.asarray(matrix))
+            self._restore(meta, arrays)
+            self.loaded = True
+        return meta
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray, block: int = 8192) -> np.ndarray:
+    """Index of the most similar centroid per row, in blocks to bound the score matrix."""
+    out = np.empty(vectors.shape[0], dtype=np.int32)
+    for i in range(0, vectors.shape[0], block):
+        out[i:i + block] = np.argmax(vectors[i:i + block] @ centroids.T, axis=1)
+    return out
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means over normalized rows; returns (nlist, dim) unit centroids."""
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[rng.choice(vectors.shape[0], nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _nearest(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        sorted_assign = assign[order]
+        starts = np.flatnonzero(np.r_[True, sorted_assign[1:] != sorted_assign[:-1]])
+        sums = np.zeros_like(centroids)
+        sums[sorted_assign[starts]] = np.add.reduceat(vectors[order], starts, axis=0)
+        empty = np.flatnonzero(np.bincount(assign, minlength=nlist) == 0)
+        if empty.size:
+            # reseed dead lists from random rows rather than losing them
+            sums[empty] = vectors[rng.choice(vectors.shape[0], empty.size, replace=False)]
+        centroids = _normalize(sums)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex(EmbeddingIndex):
+    """
+    Inverted-file (IVF-flat) approximate search on top of EmbeddingIndex.
+
+    Rows are clustered into `nlist` lists by spherical k-means; a query
+    scores the centroids, then only the rows of its `nprobe` closest lists
+    (exactly, at full precision). nprobe trades recall for speed; see
+    recall_at_k(). Below `min_rows` the index stays untrained and searches
+    exhaustively, which is faster at that size anyway. Inserts are assigned
+    to their nearest existing centroid; the centroids are retrained when the
+    index has grown `retrain_growth`-fold since they were fitted.
+    """
+    kind = "ivf"
+    _row_arrays = ("_codes", "_assign")
+
+    def __init__(self, nlist: int = 0, nprobe: int = 8, min_rows: int = 20000,
+                 retrain_growth: float = 4.0, exact_below: int = 4096,
+                 precision: str = "float32", rescore: int = 4):
+        self.nlist_setting = nlist  # 0 = sqrt(rows) at training time
+        self.nprobe = nprobe
+        self.min_rows = min_rows
+        self.retrain_growth = retrain_growth
+        self.exact_below = exact_below  # filtered searches this small skip the lists
+        super().__init__(precision, rescore)
+
+    def _reset(self):
+        super()._reset()
+        self._assign = np.zeros(0, dtype=np.int32)  # list per row
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_rows = 0
+        self._order = None  # rows grouped by list, rebuilt lazily after mutations
+        self._offsets = None
+
+    def _append(self, doc_id, chunk_ids, embeddings):
+        span = super()._append(doc_id, chunk_ids, embeddings)
+        if span is not None and self.centroids is not None:
+            start, end = span
+            self._assign[start:end] = _nearest(self._matrix[start:end], self.centroids)
+        return span
+
+    def _changed(self):
+        self._order = self._offsets = None
+        if self.centroids is None:
+            if self._n >= max(self.min_rows, 1):
+                self.train()
+        elif self._n >= self.retrain_growth * self.trained_rows:
+            self.train()
+
+    def train(self, nlist: Optional[int] = None, iterations: int = 10):
+        """(Re)fit the centroids on a sample of the rows and reassign every row. Caller holds the lock."""
+        n = self._n
+        nlist = min(nlist or self.nlist_setting or max(1, int(np.sqrt(n))), n)
+        t0 = time.perf_counter()
+        rng = np.random.default_rng(0)
+        sample = rng.choice(n, min(n, 64 * nlist), replace=False)
+        self.centroids = train_centroids(self._matrix[np.sort(sample)], nlist, iterations)
+        self._assign[:n] = _nearest(self._matrix[:n], self.centroids)
+        self.trained_rows = n
+        self._order = self._offsets = None
+        print(f"IVFIndex: trained {nlist} lists on {sample.size}/{n} rows in {time.perf_counter() - t0:.2f}s")
+
+    def _postings(self):
+        if self._order is None:
+            assign = self._assign[:self._n]
+            self._order = np.argsort(assign, kind="stable")
+            self._offsets = np.searchsorted(assign[self._order], np.arange(self.centroids.shape[0] + 1))
+        return self._order, self._offsets
+
+    def _candidates(self, q, rows, nprobe: Optional[int] = None):
+        if self.centroids is None:
+            return rows
+        if rows is not None and rows.size <= self.exact_below:
+            return rows
+        nlist = self.centroids.shape[0]
+        nprobe = min(nprobe or self.nprobe, nlist)
+        probe = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+        order, offsets = self._postings()
+        cand = np.concatenate([order[offsets[p]:offsets[p + 1]] for p in probe])
+        if rows is not None:
+            cand = np.intersect1d(cand, rows, assume_unique=True)
+        return cand
+
+    def recall_at_k(self, k: int = 5, queries: int = 200, nprobe: Optional[int] = None, seed: int = 0) -> dict:
+        """
+        Recall@k of the IVF search against exact search over the same rows.
+
+        Queries are `queries` stored vectors picked at random, each searched
+        with itself excluded from both result lists.
+        """
+        with self._lock:
+            if self.centroids is None:
+                return {"trained": False, "rows": self._n}
+            rng = np.random.default_rng(seed)
+            picks = rng.choice(self._n, min(queries, self._n), replace=False)
+            nprobe = min(nprobe or self.nprobe, self.centroids.shape[0])
+            found = scored = 0
+            exact_s = approx_s = 0.0
+            for row in picks:
+                q = np.array(self._matrix[row])
+                t0 = time.perf_counter()
+                truth, _ = self._score(q, None, k + 1)
+                t1 = time.perf_counter()
+                cand = self._candidates(q, None, nprobe)
+                approx, _ = self._score(q, cand, k + 1)
+                t2 = time.perf_counter()
+                truth = [r for r in truth if r != row][:k]
+                approx = [r for r in approx if r != row][:k]
+                found += len(set(truth) & set(approx))
+                scored += cand.size
+                exact_s += t1 - t0
+                approx_s += t2 - t1
+            return {
+                "trained": True,
+                "rows": self._n,
+                "nlist": int(self.centroids.shape[0]),
+                "nprobe": nprobe,
+                "k": k,
+                "queries": int(picks.size),
+                "recall": found / float(k * picks.size),
+                "scanned_fraction": scored / float(self._n * picks.size),
+                "exact_ms": 1000.0 * exact_s / picks.size,
+                "ivf_ms": 1000.0 * approx_s / picks.size,
+            }
+
+    def stats(self) -> dict:
+        out = super().stats()
+        out.update({
+            "trained": self.centroids is not None,
+            "nlist": int(self.centroids.shape[0]) if self.centroids is not None else 0,
+            "nprobe": self.nprobe,
+            "trained_rows": self.trained_rows,
+        })
+        return out
+
+    def _snapshot_arrays(self):
+        arrays = super()._snapshot_arrays()
+        if self.centroids is not None:
+            arrays["assign"] = self._assign[:self._n]
+            arrays["centroids"] = self.centroids
+        return arrays
+
+    def _snapshot_meta(self):
+        return {"trained_rows": self.trained_rows}
+
+    def _restore(self, meta, arrays):
+        if "centroids" in arrays:
+            self.centroids = np.array(arrays["centroids"], dtype=np.float32)
+            self._assign = np.array(arrays["assign"], dtype=np.int32)
+            self.trained_rows = meta.get("trained_rows", self._n)
@@ -1,8 +1,18 @@
 # rag_service/vectorstore_mongo.py
 import os
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+from bson.binary import Binary
+from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo import MongoClient, ASCENDING
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+from config import (VECTOR_INDEX, VECTOR_INDEX_DIR, IVF_NLIST, IVF_NPROBE, IVF_MIN_ROWS, SEARCH_THREADS,
+                    EMBEDDING_STORAGE, INDEX_PRECISION, RESCORE_FACTOR, INDEX_REFRESH_SECONDS,
+                    SNAPSHOT_DELAY)
+from vector_index import EmbeddingIndex, IVFIndex
 
 MONGO_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
 DB_NAME = os.getenv("MONGODB_DB", "icare")
@@ -15,65 +25,328 @@ db = client[DB_NAME]
 chunks_col = db[COL_CHUNKS]
 docs_col = db[COL_DOCS]
 
+# async handle on the same collection, for the request path
+async_chunks_col = AsyncIOMotorClient(MONGO_URI)[DB_NAME][COL_CHUNKS]
+
+# scoring (and the one-off index load) runs here, never on the event loop
+_search_executor = ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix="rag-search")
+_load_lock = threading.Lock()
+
+# phase-2 projection: everything a hit returns, minus the embedding
+HIT_FIELDS = {"_id": 0, "chunk_id": 1, "text": 1, "meta": 1}
+# index-load projection: ids plus the packed embedding
+VECTOR_FIELDS = {"_id": 0, "doc_id": 1, "chunk_id": 1, "embedding": 1, "embedding_format": 1, "embedding_scale": 1}
+
+# Embedding storage
+# Embeddings are stored as packed little-endian binary rather than a BSON
+# array of doubles (~10 KB of boxed floats per 768-dim chunk, decoded into a
+# Python list on every read): float32 is 3 KB and decodes with one
+# np.frombuffer; float16 halves that and int8 (per-vector scale) quarters it.
+EMBEDDING_FORMATS = {"float32": "<f4", "float16": "<f2", "int8": "i1"}
+
+def pack_embedding(vector, fmt: str = EMBEDDING_STORAGE) -> Dict[str, Any]:
+    """Mongo fields for one embedding in `fmt`."""
+    if fmt not in EMBEDDING_FORMATS:
+        raise ValueError(f"Unknown embedding format {fmt!r}; expected one of {sorted(EMBEDDING_FORMATS)}")
+    v = np.asarray(vector, dtype=np.float32).ravel()
+    fields = {"embedding_format": fmt, "embedding_dim": int(v.size)}
+    if fmt == "int8":
+        scale = float(np.abs(v).max() / 127.0) if v.size else 0.0
+        scale = scale or 1.0
+        fields["embedding_scale"] = scale
+        v = np.rint(v / scale)
+    fields["embedding"] = Binary(v.astype(EMBEDDING_FORMATS[fmt]).tobytes())
+    return fields
+
+def unpack_embedding(doc: Dict[str, Any]) -> Optional[np.ndarray]:
+    """float32 vector from a chunk document in any stored format (including legacy arrays)."""
+    emb = doc.get("embedding")
+    if emb is None:
+        return None
+    fmt = doc.get("embedding_format")
+    if fmt is None:
+        # pre-packing documents: a plain list of floats
+        return np.asarray(emb, dtype=np.float32)
+    v = np.frombuffer(emb, dtype=EMBEDDING_FORMATS[fmt]).astype(np.float32)
+    if fmt == "int8":
+        v *= doc.get("embedding_scale", 1.0)
+    return v
+
+# Vectors from different embedding models live in different spaces and must
+# never be scored against each other. Every chunk records the provider:model
+# that embedded it, the index only loads chunks from the active one, and
+# chunks written before this field existed came from the Gemini API.
+LEGACY_EMBEDDING_MODEL = "gemini:models/embedding-001"
+
+def active_embedding_model() -> str:
+    from embeddings import get_provider
+    return get_provider().tag
+
+def _model_query(model: str) -> Dict[str, Any]:
+    if model == LEGACY_EMBEDDING_MODEL:
+        return {"$or": [{"embedding_model": model}, {"embedding_model": {"$exists": False}}]}
+    return {"embedding_model": model}
+
+def index_models() -> Dict[str, int]:
+    """Chunk count per embedding model; more than one key means a mixed collection."""
+    counts = chunks_col.aggregate([{"$group": {"_id": {"$ifNull": ["$embedding_model", LEGACY_EMBEDDING_MODEL]}, "n": {"$sum": 1}}}])
+    return {c["_id"]: c["n"] for c in counts}
+
+def _vector_rows(cursor):
+    for doc in cursor:
+        yield {"doc_id": doc["doc_id"], "chunk_id": doc["chunk_id"], "embedding": unpack_embedding(doc)}
+
 # create indexes for faster retrieval (run once)
 def ensure_indexes():
     # chunk doc_id index
     chunks_col.create_index([("doc_id", ASCENDING)])
+    # search fetches the winning chunks' text by chunk_id
+    chunks_col.create_index([("chunk_id", ASCENDING)])
     docs_col.create_index([("added_at", ASCENDING)])
 
 def upsert_document(doc_id: str, title: str, metadata: Dict[str, Any]):
     docs_col.update_one({"_id": doc_id}, {"$set": {"title": title, "meta": metadata, "added_at": __now()}}, upsert=True)
 
-def upsert_chunks(doc_id: str, chunk_texts: List[str], chunk_embeddings: List[List[float]], meta: Optional[Dict[str, Any]] = None):
+def _make_index():
+    if VECTOR_INDEX == "ivf":
+        return IVFIndex(nlist=IVF_NLIST, nprobe=IVF_NPROBE, min_rows=IVF_MIN_ROWS,
+                        precision=INDEX_PRECISION, rescore=RESCORE_FACTOR)
+    return EmbeddingIndex(precision=INDEX_PRECISION, rescore=RESCORE_FACTOR)
+
+
+INDEX = _make_index()
+# the Mongo stamp INDEX reflects, and when it was last compared with Mongo's
+_index_stamp: Optional[Dict[str, Any]] = None
+_stamp_checked = 0.0
+# debounced snapshot writes: a timer flushes every change made within SNAPSHOT_DELAY in one generation
+_snapshot_timer: Optional[threading.Timer] = None
+_snapshot_dirty = False
+_snapshot_lock = threading.Lock()
+_snapshot_write_lock = threading.Lock()
+
+
+def _ensure_index_current():
+    """
+    Load the index on first use, then every INDEX_REFRESH_SECONDS compare
+    Mongo's stamp with the one the index was built from: under several
+    uvicorn workers only the one that ran an ingest/delete updated its own
+    copy, so the others reload when the stamp moves.
+    """
+    global _stamp_checked
+    if not INDEX.loaded:
+        with _load_lock:
+            # concurrent first searches load once
+            if not INDEX.loaded:
+                load_index()
+        return
+    if INDEX_REFRESH_SECONDS <= 0 or time.monotonic() - _stamp_checked < INDEX_REFRESH_SECONDS:
+        return
+    # one search does the check; the rest keep using the current index meanwhile
+    if not _load_lock.acquire(blocking=False):
+        return
+    try:
+        if time.monotonic() - _stamp_checked < INDEX_REFRESH_SECONDS:
+            return
+        _stamp_checked = time.monotonic()
+        try:
+            stamp = _mongo_stamp()
+        except Exception as e:
+            print(f"Vector index freshness check failed ({e}); serving the loaded index")
+            return
+        if stamp != _index_stamp:
+            print("Vector index is behind Mongo (written by another process); reloading")
+            load_index()
+    finally:
+        _load_lock.release()
+
+
+def _mongo_stamp(model: Optional[str] = None) -> Dict[str, Any]:
+    # chunk _ids are ObjectIds, so count + newest _id changes on every insert/delete;
+    # the model is part of it so switching providers never reuses the old snapshot
+    last = chunks_col.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    return {"count": chunks_col.count_documents({}), "last_id": str(last["_id"]) if last else None,
+            "model": model or active_embedding_model()}
+
+
+def load_index(rebuild: bool = False):
+    """
+    Make the in-memory index current.
+
+    With VECTOR_INDEX_DIR set, a snapshot whose stamp still matches Mongo is
+    memory-mapped instead of re-reading every embedding; otherwise the index
+    is rebuilt from Mongo (only ids and embeddings cross the wire) and the
+    snapshot rewritten. Only chunks embedded by the active model are
+    indexed; any others are reported (re-ingest them to include them).
+    """
+    global _index_stamp, _stamp_checked
+    model = active_embedding_model()
+    stamp = _mongo_stamp(model)
+    _stamp_checked = time.monotonic()
+    if VECTOR_INDEX_DIR and not rebuild:
+        meta = INDEX.load_snapshot(VECTOR_INDEX_DIR)
+        if meta is not None and meta.get("stamp") == stamp:
+            _index_stamp = stamp
+            print(f"Vector index mapped from {VECTOR_INDEX_DIR}: {INDEX.stats()}")
+            return INDEX
+        if meta is not None:
+            print("Vector index snapshot is stale; rebuilding from Mongo")
+    INDEX.load(_vector_rows(chunks_col.find(_model_query(model), VECTOR_FIELDS)))
+    _index_stamp = stamp
+    print(f"Vector index loaded from Mongo: {INDEX.stats()}")
+    others = {m: n for m, n in index_models().items() if m != model}
+    if others:
+        print(f"WARNING: mixed embedding models in {COL_CHUNKS}; indexed {model} only, "
+              f"skipped {sum(others.values())} chunks from {others}")
+    save_index()
+    return INDEX
+
+
+def _index_written(deleted: int, inserted_ids: List[Any]):
+    """
+    This process changed Mongo and INDEX in step. Adopt Mongo's new stamp
+    only if it is exactly what our own write predicts from the stamp INDEX
+    was built from; anything else means another process wrote too (before
+    or during ours), and its chunks were never loaded - so reload.
+    """
+    global _index_stamp
+    base = _index_stamp or {}
+    expected = {
+        "count": base.get("count", 0) - deleted + len(inserted_ids),
+        # a delete that removed the newest chunk moves last_id unpredictably; that just costs a reload
+        "last_id": str(max(inserted_ids)) if inserted_ids else base.get("last_id"),
+        "model": base.get("model"),
+    }
+    stamp = _mongo_stamp()
+    if stamp == expected:
+        _index_stamp = stamp
+        save_index()
+        return
+    print("Vector index: Mongo changed beyond this write (another process?); reloading")
+    with _load_lock:
+        load_index()
+
+
+def save_index():
+    """Schedule a snapshot of INDEX; changes within SNAPSHOT_DELAY share one write."""
+    global _snapshot_timer, _snapshot_dirty
+    if not VECTOR_INDEX_DIR or not INDEX.loaded:
+        return
+    with _snapshot_lock:
+        _snapshot_dirty = True
+    if SNAPSHOT_DELAY <= 0:
+        flush_index_snapshot()
+        return
+    with _snapshot_lock:
+        if _snapshot_timer is None:
+            _snapshot_timer = threading.Timer(SNAPSHOT_DELAY, flush_index_snapshot)
+            _snapshot_timer.daemon = True
+            _snapshot_timer.start()
+
+
+def flush_index_snapshot():
+    """Write the pending snapshot, if any, now (timer, shutdown, index_tool)."""
+    global _snapshot_timer, _snapshot_dirty
+    with _snapshot_lock:
+        if _snapshot_timer is not None:
+            _snapshot_timer.cancel()
+            _snapshot_timer = None
+        dirty, _snapshot_dirty = _snapshot_dirty, False
+    if not dirty or not VECTOR_INDEX_DIR or not INDEX.loaded:
+        return
+    with _snapshot_write_lock:
+        # read the stamp before INDEX copies its rows: the rows are then at least as new as the stamp,
+        # so a race can only make the snapshot look stale (a rebuild), never fresher than it is
+        stamp = _index_stamp
+        try:
+            INDEX.save(VECTOR_INDEX_DIR, stamp)
+        except OSError as e:
+            # the snapshot only speeds up restarts; never fail a write over it
+            print(f"Vector index snapshot failed: {e}")
+
+
+def upsert_chunks(doc_id: str, chunk_texts: List[str], chunk_embeddings: List[List[float]], meta: Optional[Dict[str, Any]] = None,
+                  embedding_model: Optional[str] = None):
+    model = embedding_model or active_embedding_model()
     # delete existing chunks for doc and insert new ones (simple)
-    chunks_col.delete_many({"doc_id": doc_id})
+    deleted = chunks_col.delete_many({"doc_id": doc_id}).deleted_count
     to_insert = []
     for i, (txt, emb) in enumerate(zip(chunk_texts, chunk_embeddings)):
         to_insert.append({
             "doc_id": doc_id,
             "chunk_id": f"{doc_id}__{i}",
             "text": txt,
-            "embedding": emb,
+            **pack_embedding(emb),
+            "embedding_model": model,
             "meta": meta or {},
         })
-    if to_insert:
-        chunks_col.insert_many(to_insert)
+    inserted_ids = chunks_col.insert_many(to_insert).inserted_ids if to_insert else []
+    # an unloaded index picks these up from Mongo on first search
+    if INDEX.loaded:
+        if model == active_embedding_model():
+            # index what was stored, so a restart rebuilds exactly the same rows
+            INDEX.replace_document(doc_id, [d["chunk_id"] for d in to_insert], [unpack_embedding(d) for d in to_insert])
+        else:
+            print(f"WARNING: {doc_id} embedded with {model}, not the active {active_embedding_model()}; not indexed")
+            INDEX.remove_document(doc_id)
+        _index_written(deleted, inserted_ids)
 
-def _cosine_sim(a: np.ndarray, b: np.ndarray):
-    # numerical stability
-    a_norm = np.linalg.norm(a)
-    b_norm = np.linalg.norm(b)
-    if a_norm == 0 or b_norm == 0:
-        return 0.0
-    return float(np.dot(a, b) / (a_norm * b_norm))
+def delete_document_chunks(doc_id: str) -> int:
+    """Remove a document's chunks from Mongo and from the in-memory index."""
+    result = chunks_col.delete_many({"doc_id": doc_id})
+    if INDEX.loaded and (INDEX.remove_document(doc_id) or result.deleted_count):
+        _index_written(result.deleted_count, [])
+    return result.deleted_count
 
-def search_similar_local(query_embedding: List[float], top_k: int = 5, filter_doc_ids: Optional[List[str]] = None):
-    """
-    Simple local search: load candidates from Mongo into memory and compute cosine similarity.
-    Not suitable for large datasets, but fine for dev/test.
-    """
-    q_emb = np.asarray(query_embedding, dtype=np.float32)
-    q = {}
-    if filter_doc_ids:
-        q["doc_id"] = {"$in": filter_doc_ids}
-    # limit to N candidates for speed — tune as needed
-    cursor = chunks_col.find(q)
+def _rank(query_embedding: List[float], top_k: int, filter_doc_ids: Optional[List[str]]) -> List[Tuple[str, str, float]]:
+    """Phase 1: (chunk_id, doc_id, score) of the winners, from the in-memory index alone."""
+    _ensure_index_current()
+    return INDEX.search(query_embedding, top_k=top_k, filter_doc_ids=filter_doc_ids)
+
+def _attach_text(hits: List[Tuple[str, str, float]], docs: List[Dict[str, Any]]):
+    by_id = {d["chunk_id"]: d for d in docs}
     results = []
-    for doc in cursor:
-        emb = np.asarray(doc.get("embedding", []), dtype=np.float32)
-        if emb.size == 0:
+    for chunk_id, doc_id, score in hits:
+        doc = by_id.get(chunk_id)
+        if doc is None:
+            # deleted by another process since the index was loaded
             continue
-        score = _cosine_sim(q_emb, emb)
         results.append({
-            "doc_id": doc["doc_id"],
-            "chunk_id": doc["chunk_id"],
-            "text": doc["text"],
+            "doc_id": doc_id,
+            "chunk_id": chunk_id,
+            "text": doc.get("text", ""),
             "score": score,
             "meta": doc.get("meta", {})
         })
-    # sort by score desc
-    results.sort(key=lambda x: x["score"], reverse=True)
-    return results[:top_k]
+    return results
+
+def search_similar_local(query_embedding: List[float], top_k: int = 5, filter_doc_ids: Optional[List[str]] = None):
+    """
+    Cosine search over the in-memory index (exact or IVF), then one batched Mongo
+    query for the text/meta of the top_k winners only. Blocking; async callers
+    want search_similar().
+    """
+    hits = _rank(query_embedding, top_k, filter_doc_ids)
+    if not hits:
+        return []
+    docs = chunks_col.find({"chunk_id": {"$in": [cid for cid, _, _ in hits]}}, HIT_FIELDS)
+    return _attach_text(hits, list(docs))
+
+async def search_similar(query_embedding: List[float], top_k: int = 5, filter_doc_ids: Optional[List[str]] = None):
+    """
+    Non-blocking search_similar_local: ranking runs on the search executor
+    (numpy releases the GIL for the matvec) and the winners' text comes back
+    in one batched motor query.
+    """
+    loop = asyncio.get_running_loop()
+    hits = await loop.run_in_executor(_search_executor, _rank, query_embedding, top_k, filter_doc_ids)
+    if not hits:
+        return []
+    cursor = async_chunks_col.find({"chunk_id": {"$in": [cid for cid, _, _ in hits]}}, HIT_FIELDS)
+    return _attach_text(hits, await cursor.to_list(length=len(hits)))
+
+async def run_blocking(fn, *args):
+    """Run a blocking vectorstore write (upsert/delete) off the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
 
 def __now():
     from datetime import datetime
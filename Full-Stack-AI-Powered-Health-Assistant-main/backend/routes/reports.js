@@ -26,7 +26,16 @@ router.post("/analyze", auth, async (req, res) => {
     );
 
     const data = resp.data;
-    // data: { stage, stage_label, probabilities, report, model_input_shape }
+    // data: { stage, stage_label, probabilities, report, model_input_shape, gradable, quality }
+
+    // With ICARE_QUALITY_GATE on, rejected images come back with gradable: false and stage -1;
+    // that is not a result, so don't save it as a report
+    if (data.gradable === false) {
+      return res.status(422).json({
+        error: data.report || "Image quality is insufficient for grading",
+        quality: data.quality || null,
+      });
+    }
 
     // Save to MongoDB
     const reportDoc = new Report({
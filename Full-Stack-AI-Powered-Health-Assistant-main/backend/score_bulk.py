@@ -0,0 +1,392 @@
+# backend/score_bulk.py
+"""
+Score a directory or manifest of fundus images offline.
+
+    # every image under a directory (recursively), results as CSV
+    python score_bulk.py --input /data/fundus --output scores.csv
+
+    # a CSV manifest with a path or URL column, results as JSONL
+    python score_bulk.py --input manifest.csv --column image_url --output scores.jsonl
+
+    # Parquet (needs pyarrow) is written as a directory of part files
+    python score_bulk.py --input /data/fundus --output scores.parquet
+
+Uses the service's model loading (ICARE_MODEL_PATH / ICARE_MODEL_BACKEND,
+warm-up included), preprocessing and response building, so scores match
+/predict. Decoding runs on a thread pool feeding batched inference; only
+a bounded window of images is in memory at once.
+
+Rows are written in input order and a checkpoint (<output>.ckpt.json) is
+updated once they are on disk. Re-running the same command resumes where an
+interrupted run stopped; --fresh starts over.
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# offline use: no upload persistence, no prediction cache
+os.environ.setdefault("ICARE_UPLOAD_STORE", "false")
+os.environ.setdefault("ICARE_CACHE", "false")
+
+import predict_service as ps  # noqa: E402
+from predict_preprocess import load_rgb  # noqa: E402
+from predict_quality import UngradableImage  # noqa: E402
+from predict_registry import ModelVersion  # noqa: E402
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+MANIFEST_COLUMNS = ("path", "image_path", "url", "image_url", "image", "filename", "file")
+# `quality` lists the quality gate's reasons for images it rejected (stage -1, "Ungradable")
+FIELDS = ("index", "source", "stage", "stage_label", "probabilities", "quality", "model_version", "error")
+
+
+# Inputs
+def iter_directory(root):
+    # sorted walk so the order (and therefore the checkpoint) is stable across runs
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTS):
+                yield os.path.join(dirpath, name)
+
+
+def iter_manifest(path, column=None):
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        fields = reader.fieldnames or []
+        if column is None:
+            column = next((c for c in fields if c.lower() in MANIFEST_COLUMNS), fields[0] if fields else None)
+        if column not in fields:
+            raise SystemExit(f"Column '{column}' not found in {path} (columns: {', '.join(fields)})")
+        for row in reader:
+            source = (row.get(column) or "").strip()
+            if not source:
+                continue
+            if not is_url(source) and not os.path.isabs(source):
+                source = os.path.join(base, source)
+            yield source
+
+
+def iter_sources(args):
+    if os.path.isdir(args.input):
+        return iter_directory(args.input)
+    if args.input.lower().endswith(".csv"):
+        return iter_manifest(args.input, args.column)
+    files = sorted(glob.glob(args.input))
+    if not files:
+        raise SystemExit(f"No input found at: {args.input}")
+    return iter(files)
+
+
+def is_url(source: str) -> bool:
+    return source.startswith(("http://", "https://"))
+
+
+# Outputs
+# Writers keep `rows` = rows durably on disk; the checkpoint only ever records that.
+class CsvWriter:
+    def __init__(self, path, resume_at=None, rows=0):
+        self.path = path
+        self.rows = rows
+        self.pending = 0
+        self.f = self._open(path, resume_at)
+        self.writer = csv.DictWriter(self.f, fieldnames=FIELDS)
+        if resume_at is None:
+            self.writer.writeheader()
+
+    @staticmethod
+    def _open(path, resume_at):
+        if resume_at is None:
+            return open(path, "w", newline="", encoding="utf-8")
+        # drop anything written after the last checkpoint
+        f = open(path, "r+", newline="", encoding="utf-8")
+        f.seek(resume_at)
+        f.truncate()
+        return f
+
+    def write(self, rows):
+        for row in rows:
+            probs = row["probabilities"]
+            self.writer.writerow({**row, "probabilities": "" if probs is None else json.dumps(probs)})
+        self.pending += len(rows)
+
+    def commit(self):
+        """Make written rows durable; returns the position to resume from."""
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.rows += self.pending
+        self.pending = 0
+        return self.f.tell()
+
+    def close(self):
+        position = self.commit()
+        self.f.close()
+        return position
+
+
+class JsonlWriter(CsvWriter):
+    def __init__(self, path, resume_at=None, rows=0):
+        self.path = path
+        self.rows = rows
+        self.pending = 0
+        self.f = self._open(path, resume_at)
+
+    def write(self, rows):
+        for row in rows:
+            self.f.write(json.dumps(row) + "\n")
+        self.pending += len(rows)
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Parquet output needs pyarrow (pip install pyarrow); use .csv or .jsonl instead")
+    return pa, pq
+
+
+class ParquetWriter:
+    """
+    Parquet files can't be appended to, so the output is a directory of
+    part files of `rows_per_part` rows each; readers (pandas, pyarrow,
+    DuckDB, Spark) treat the directory as one dataset.
+    """
+
+    def __init__(self, path, resume_at=None, rows=0, rows_per_part=5000):
+        self.pa, self.pq = pa, pq = _pyarrow()
+        self.path = path
+        self.rows = rows
+        self.rows_per_part = rows_per_part
+        self.parts = int(resume_at or 0)
+        self.schema = pa.schema([
+            ("index", pa.int64()), ("source", pa.string()), ("stage", pa.int64()),
+            ("stage_label", pa.string()), ("probabilities", pa.list_(pa.float64())), ("quality", pa.string()),
+            ("model_version", pa.string()), ("error", pa.string()),
+        ])
+        os.makedirs(path, exist_ok=True)
+        # drop parts written after the last checkpoint
+        for name in os.listdir(path):
+            if name.startswith("part-") and int(name[5:10]) >= self.parts:
+                os.remove(os.path.join(path, name))
+        self.buffer = []
+
+    def write(self, rows):
+        self.buffer.extend(rows)
+
+    def commit(self):
+        if len(self.buffer) >= self.rows_per_part:
+            self._flush()
+        return self.parts
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        table = self.pa.Table.from_pylist(self.buffer, schema=self.schema)
+        name = f"part-{self.parts:05d}.parquet"
+        tmp = os.path.join(self.path, f".{name}.tmp")
+        self.pq.write_table(table, tmp)
+        os.replace(tmp, os.path.join(self.path, name))
+        self.parts += 1
+        self.rows += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        self._flush()
+        return self.parts
+
+
+WRITERS = {".csv": CsvWriter, ".jsonl": JsonlWriter, ".ndjson": JsonlWriter, ".parquet": ParquetWriter}
+
+
+# Checkpoint
+def load_checkpoint(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_checkpoint(path, state):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+# Scoring
+def read_source(source, client, max_bytes):
+    if is_url(source):
+        r = client.get(source)
+        r.raise_for_status()
+        if len(r.content) > max_bytes:
+            raise ValueError(f"Image exceeds {max_bytes} bytes")
+        return r.content
+    with open(source, "rb") as f:
+        return f.read(max_bytes + 1)
+
+
+def decode_one(source, options, client, max_bytes):
+    """(uint8 RGB, None), (QualityReport, None) for an ungradable image, or (None, error)."""
+    try:
+        data = read_source(source, client, max_bytes)
+        if len(data) > max_bytes:
+            raise ValueError(f"Image exceeds {max_bytes} bytes")
+        return load_rgb(data, options), None
+    except UngradableImage as e:
+        return e.report, None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def result_row(resp, error=None):
+    if resp is None:
+        return {"stage": None, "stage_label": None, "probabilities": None, "quality": None, "error": error}
+    return {"stage": resp.stage, "stage_label": resp.stage_label, "probabilities": resp.probabilities,
+            "quality": ",".join(resp.quality["reasons"]) if resp.quality else None, "error": None}
+
+
+def score_batch(mv, batch):
+    """batch: [(index, source, decoded, error)] -> output rows in the same order."""
+    rows = [None] * len(batch)
+    good = []
+    for pos, (_, _, decoded, err) in enumerate(batch):
+        if err is not None:
+            rows[pos] = result_row(None, err)
+        elif isinstance(decoded, np.ndarray):
+            good.append((pos, decoded))
+        else:
+            rows[pos] = result_row(ps.ungradable_response(decoded, mv))
+    if good:
+        try:
+            preds = ps.predict_images(mv, [rgb for _, rgb in good])
+            for (pos, _), row in zip(good, preds):
+                rows[pos] = result_row(ps.build_response(row, mv))
+        except Exception as e:
+            for pos, _ in good:
+                rows[pos] = result_row(None, f"Prediction error: {e}")
+    return [{"index": index, "source": source, "model_version": mv.name, **row}
+            for (index, source, _, _), row in zip(batch, rows)]
+
+
+def run(args):
+    ext = os.path.splitext(args.output)[1].lower()
+    if ext not in WRITERS:
+        raise SystemExit(f"Unsupported output format '{ext}' (use {', '.join(WRITERS)})")
+    if ext == ".parquet":
+        _pyarrow()  # fail before spending time on the model
+    ckpt_path = args.checkpoint or f"{args.output}.ckpt.json"
+    ckpt = None if args.fresh else load_checkpoint(ckpt_path)
+    if ckpt is not None and ckpt.get("input") != os.path.abspath(args.input):
+        raise SystemExit(f"Checkpoint {ckpt_path} belongs to a different input ({ckpt.get('input')}); use --fresh")
+    if ckpt is not None and ckpt.get("finished"):
+        print(f"{args.output} is already complete ({ckpt['done']} images); use --fresh to score again")
+        return 0
+    if ckpt is None and os.path.exists(args.output) and not args.fresh:
+        raise SystemExit(f"{args.output} exists but has no checkpoint; use --fresh to overwrite it")
+
+    model_path = args.model or ps.MODEL_PATH
+    name = ps.MODEL_VERSION if args.model is None else os.path.splitext(os.path.basename(model_path))[0]
+    mv = ps.load_version(ModelVersion(name, model_path, (args.backend or ps.MODEL_BACKEND).lower()))
+    if ckpt is not None and ckpt.get("model_id") != mv.model_id:
+        print(f"Warning: model changed since the checkpoint ({ckpt.get('model_id')} -> {mv.model_id})")
+    options = ps.preprocess_options(mv, args.clahe)
+
+    done = ckpt["done"] if ckpt else 0
+    writer = WRITERS[ext](args.output, resume_at=ckpt["position"] if ckpt else None, rows=done)
+    state = {"input": os.path.abspath(args.input), "output": os.path.abspath(args.output),
+             "model_id": mv.model_id, "done": done, "position": ckpt["position"] if ckpt else None}
+    if done:
+        print(f"Resuming after {done} images")
+
+    import httpx
+    client = httpx.Client(timeout=args.timeout, follow_redirects=True)
+    pool = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="icare-bulk")
+    window = deque()  # (index, source, future) in input order, never longer than `prefetch`
+    prefetch = max(args.batch_size, args.prefetch)
+    sources = iter_sources(args)
+    for _ in range(done):
+        next(sources, None)
+
+    def fill(index):
+        while len(window) < prefetch:
+            source = next(sources, None)
+            if source is None:
+                break
+            window.append((index, source, pool.submit(decode_one, source, options, client, args.max_bytes)))
+            index += 1
+        return index
+
+    started = last_report = time.perf_counter()
+    scored = errors = 0
+    try:
+        next_index = fill(done)
+        while window:
+            batch = []
+            while window and len(batch) < args.batch_size:
+                index, source, fut = window.popleft()
+                rgb, err = fut.result()
+                batch.append((index, source, rgb, err))
+                next_index = fill(next_index)
+            rows = score_batch(mv, batch)
+            writer.write(rows)
+            scored += len(rows)
+            errors += sum(1 for r in rows if r["error"])
+            state["position"] = writer.commit()
+            state["done"] = writer.rows
+            save_checkpoint(ckpt_path, state)
+
+            now = time.perf_counter()
+            if now - last_report >= args.report_every:
+                last_report = now
+                print(f"{done + scored} images ({errors} errors), {scored / (now - started):.1f} images/sec")
+        state["position"] = writer.close()
+        state["done"] = writer.rows
+        state["finished"] = True
+        save_checkpoint(ckpt_path, state)
+    except KeyboardInterrupt:
+        print(f"Interrupted; {state['done']} images saved. Re-run the same command to resume")
+        return 130
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        client.close()
+        ps.close_model(mv.model)
+
+    elapsed = time.perf_counter() - started
+    print(f"Scored {scored} images in {elapsed:.1f}s ({scored / elapsed if elapsed else 0:.1f} images/sec, "
+          f"{errors} errors) -> {args.output}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", required=True, help="image directory, CSV manifest, or glob")
+    parser.add_argument("--column", help="manifest column with paths/URLs (default: auto-detect)")
+    parser.add_argument("--output", required=True, help="results file: .csv, .jsonl or .parquet")
+    parser.add_argument("--model", help="model to score with (default: ICARE_MODEL_PATH)")
+    parser.add_argument("--backend", choices=["keras", "compiled", "tflite"], help="default: ICARE_MODEL_BACKEND")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <output>.ckpt.json)")
+    parser.add_argument("--fresh", action="store_true", help="ignore any checkpoint and overwrite the output")
+    parser.add_argument("--batch-size", type=int, default=ps.BATCH_MAX_SIZE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="decode threads")
+    parser.add_argument("--prefetch", type=int, default=64, help="max images decoded ahead of inference")
+    parser.add_argument("--clahe", action=argparse.BooleanOptionalAction, default=None,
+                        help="force CLAHE on (--clahe) or off (--no-clahe); default: ICARE_USE_CLAHE")
+    parser.add_argument("--timeout", type=float, default=ps.FETCH_TIMEOUT, help="URL fetch timeout (s)")
+    parser.add_argument("--max-bytes", type=int, default=ps.MAX_IMAGE_BYTES)
+    parser.add_argument("--report-every", type=float, default=10.0, help="progress interval (s)")
+    args = parser.parse_args(argv)
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())